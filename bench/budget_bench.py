@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Measures the cost of execution budget checks.
+
+用法：
+    bench/budget_bench.py [重复次数]
+"""
+
+import os
+import sys
+import time
+import timeit
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+
+# A loop-heavy program: one budget check per inner iteration. The step is
+# not just the loop variable, so that without a budget the inner loop still
+# runs instead of being added up in closed form.
+LOOP_PROGRAM = '''
+【和】是活雷锋。
+【和】装0。
+老王从1到300磨叽：
+  老张从1到300磨叽：
+    【和】走老张加1步。
+  磨叽完了。
+磨叽完了。
+唠唠：【和】。
+'''
+
+# A call-heavy program: one budget check per call.
+CALL_PROGRAM = '''
+【斐波】（几）咋整：
+  寻思：几比二小吗？
+  要行咧就滚犊子吧几。
+  滚犊子吧整【斐波】（几减一）加整【斐波】（几减二）。
+整完了。
+唠唠：整【斐波】（22）。
+'''
+
+def TimeExecution(py_code, repeat, **budget):
+  """Returns the best time of executing py_code, in seconds."""
+  return min(timeit.repeat(
+      lambda: dongbei.ExecutePython(py_code, **budget),
+      number=1, repeat=repeat))
+
+def main():
+  repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+  print('%-6s %12s %12s %12s %9s' % (
+      '程序', '无预算(秒)', '有预算(秒)', '有期限(秒)', '开销'))
+  for name, program in (('循环', LOOP_PROGRAM), ('调用', CALL_PROGRAM)):
+    tokens = list(dongbei.Tokenize(program))
+    plain_code = dongbei.TranslateTokensToPython(tokens)
+    budget_code = dongbei.TranslateTokensToPython(tokens, budget=True)
+    plain = TimeExecution(plain_code, repeat)
+    steps = TimeExecution(budget_code, repeat, max_steps=10**9)
+    deadline = TimeExecution(budget_code, repeat, timeout=3600)
+    print('%-6s %12.4f %12.4f %12.4f %8.1f%%' % (
+        name, plain, steps, deadline, (steps / plain - 1) * 100))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Times calling one dongbei function with many tuples of arguments.
+
+The function adds up the first n squares, for n from 1 to --size, times a
+given factor. It is called once per tuple in three ways: by translating,
+compiling and running a program that calls it for each tuple, as a program
+run per tuple would; by Program.CallMany() with one job; and by
+Program.CallMany() with the jobs given. The results must be the same.
+Translating per tuple is timed on the first --slow-count tuples only, and
+scaled up.
+
+用法：
+    bench/call_many_bench.py [--repeat 次数] [--count 个数] [--size 次数]
+        [--jobs 进程数] [--json 结果.json]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+
+CODE = '''
+【平方和】（头儿，【倍数】）咋整：
+  和装0。
+  老王从1到头儿磨叽：
+    和装和加老王乘老王乘【倍数】。
+  磨叽完了。
+  滚犊子吧和。
+整完了。
+'''
+
+def RunPerTuple(args_list):
+  """Translates, compiles and runs a program for each tuple."""
+  results = []
+  for args in args_list:
+    output = dongbei.Compile(
+        CODE + '唠唠：整【平方和】（%d，%d）。' % args).Run()
+    results.append(int(output))
+  return results
+
+def Best(function, repeat):
+  """Returns (the fewest seconds function() took, what it returned)."""
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    best = seconds if best is None else min(best, seconds)
+  return best, result
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--repeat', type=int, default=3,
+                      help='每个测量重复几次，取最快的')
+  parser.add_argument('--count', type=int, default=20000,
+                      help='调用几回')
+  parser.add_argument('--slow-count', type=int, default=500,
+                      help='一回一翻译的，只调用这么多回')
+  parser.add_argument('--size', type=int, default=200,
+                      help='套路里的循环最多转几圈')
+  parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                      help='几个进程一块儿跑')
+  parser.add_argument('--json', metavar='结果.json',
+                      help='把全部结果写成 JSON')
+  args = parser.parse_args()
+
+  args_list = [(1 + i % args.size, i % 7) for i in range(args.count)]
+  program = dongbei.Compile(CODE)
+  seconds = {}
+  slow_count = min(args.slow_count, args.count)
+  slow_seconds, slow_results = Best(
+      lambda: RunPerTuple(args_list[:slow_count]), args.repeat)
+  seconds['per_tuple'] = slow_seconds * args.count / slow_count
+  seconds['one_job'], expected = Best(
+      lambda: program.CallMany('平方和', args_list, jobs=1), args.repeat)
+  seconds['jobs'], results = Best(
+      lambda: program.CallMany('平方和', args_list, jobs=args.jobs),
+      args.repeat)
+  if results != expected or slow_results != expected[:slow_count]:
+    sys.exit('结果不一样了')
+
+  names = {'per_tuple': '一回一翻译', 'one_job': '一个进程',
+           'jobs': '%d 个进程' % (args.jobs,)}
+  print('%-12s %10s %10s' % ('', '秒', '快几倍'))
+  for key, name in names.items():
+    print('%-12s %10.4f %10.2f' % (
+        name, seconds[key], seconds['per_tuple'] / seconds[key]))
+
+  if args.json:
+    with io.open(args.json, 'w', encoding='utf-8') as json_file:
+      json.dump({'count': args.count, 'jobs': args.jobs, 'seconds': seconds},
+                json_file, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+  main()
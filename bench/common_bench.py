@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Times dongbei loops that repeat expressions, with and without computing
+them once.
+
+Each kind of program runs a loop in a function whose body repeats some
+arithmetic or concatenation: twice in one statement, in one statement after
+another, nested in a bigger repeated expression, and in a block that
+assigns to a variable in between, where only part of it can be computed
+once. The last kind repeats nothing. Every program is run as translated,
+and again with common subexpressions left alone (_COMMON_SUBEXPR_TYPES =
+()), taking turns, and the speedup is the ratio of the two fastest times.
+The outputs must be the same.
+
+用法：
+    bench/common_bench.py [--repeat 次数] [--size 次数] [--json 结果.json]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import timeit
+import unittest.mock
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+
+def InFunction(code):
+  """Returns code that runs the statements in code in a function."""
+  return '【跑】咋整：\n%s\n整完了。\n整【跑】。\n' % (
+      '\n'.join('  ' + line for line in code.strip().split('\n')),)
+
+def GenerateOneStatement(n):
+  """Adds up a product of a repeated sum, n times."""
+  return '''
+和装0。
+老王从1到%d磨叽：
+  和装和加（老王乘3加1）乘（老王乘3加1）。
+磨叽完了。
+唠唠：和。
+''' % (n,)
+
+def GenerateStatements(n):
+  """Uses the same expression in three statements, n times."""
+  return '''
+甲装0。乙装0。丙装0。
+老王从1到%d磨叽：
+  甲装老王乘老王减老王。
+  乙装老王乘老王减老王加1。
+  丙装老王乘老王减老王加2。
+磨叽完了。
+唠唠：甲、乙、丙。
+''' % (n,)
+
+def GenerateNested(n):
+  """Repeats an expression inside another repeated one, n times."""
+  return '''
+个数装0。
+老王从1到%d磨叽：
+  寻思：老王乘老王加老王比（老王乘老王加老王）除以2加老王乘老王大吗？要行咧就个数走走。
+磨叽完了。
+唠唠：个数。
+''' % (n,)
+
+def GenerateStrings(n):
+  """Says a repeated concatenation, n times."""
+  return '''
+老王从1到%d磨叽：
+  唠唠：（老王、“号”）、“，”、（老王、“号”）、“！”。
+磨叽完了。
+''' % (n,)
+
+def GenerateAssignedBetween(n):
+  """Changes a variable between uses of an expression of it, n times."""
+  return '''
+和装0。
+老王从1到%d磨叽：
+  甲装老王乘2加老王。
+  和走甲乘甲步。
+  甲装老王乘2加老王。
+  和走甲乘甲步。
+磨叽完了。
+唠唠：和。
+''' % (n,)
+
+def GenerateNoRepeats(n):
+  """Adds up a sum that repeats nothing, n times."""
+  return '''
+和装0。
+老王从1到%d磨叽：
+  和装和加老王乘3加1。
+磨叽完了。
+唠唠：和。
+''' % (n,)
+
+KINDS = {
+    '一句里': GenerateOneStatement,
+    '几句里': GenerateStatements,
+    '套着的': GenerateNested,
+    '字符串': GenerateStrings,
+    '中间改了': GenerateAssignedBetween,
+    '没重复的': GenerateNoRepeats,
+    }
+
+def BenchKind(generator, size, repeat):
+  code = InFunction(generator(size))
+  common = compile(dongbei.TranslateToPython(code), '<dongbei>', 'exec')
+  with unittest.mock.patch.object(dongbei, '_COMMON_SUBEXPR_TYPES', ()):
+    repeated = compile(dongbei.TranslateToPython(code), '<dongbei>', 'exec')
+  output = dongbei.ExecutePython(common)
+  if output != dongbei.ExecutePython(repeated):
+    sys.exit('只算一回以后输出不一样了：%r' % (output[-50:],))
+  common_times = []
+  repeated_times = []
+  for _ in range(repeat):
+    common_times.append(timeit.timeit(
+        lambda: dongbei.ExecutePython(common), number=1))
+    repeated_times.append(timeit.timeit(
+        lambda: dongbei.ExecutePython(repeated), number=1))
+  return {'common_seconds': min(common_times),
+          'repeated_seconds': min(repeated_times),
+          'speedup': min(repeated_times) / min(common_times)}
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--repeat', type=int, default=7,
+                      help='每个测量重复几次，取最快的')
+  parser.add_argument('--size', type=int, default=300000,
+                      help='循环转几圈')
+  parser.add_argument('--json', metavar='结果.json',
+                      help='把全部结果写成 JSON')
+  args = parser.parse_args()
+
+  results = {}
+  print('%-10s %10s %10s %8s' % ('', '算一回（秒）', '算几回（秒）', '快几倍'))
+  for kind, generator in KINDS.items():
+    result = results[kind] = BenchKind(generator, args.size, args.repeat)
+    print('%-10s %10.4f %10.4f %8.2f' % (
+        kind, result['common_seconds'], result['repeated_seconds'],
+        result['speedup']))
+
+  if args.json:
+    with io.open(args.json, 'w', encoding='utf-8') as json_file:
+      json.dump(results, json_file, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Times parsing and translating deeply nested dongbei programs.
+
+Five kinds of programs grow with the nesting depth: 开整 inside 开整, a
+寻思 chain (要不行咧就 followed by another 寻思), a decision tree (寻思
+inside the then-branch of 寻思), parentheses inside parentheses, and one
+long 、 chain. Each program is tokenized, parsed, translated, compiled and
+run, and its output is checked. Parsing and translating keep their work on
+explicit stacks, so every kind should scale linearly in time and memory.
+The scaling exponents are fitted on a log-log scale, so 1 means linear and
+2 means quadratic. The peak memory of parsing and translating is measured
+with tracemalloc, in a separate run.
+
+用法：
+    bench/depth_bench.py [--repeat 次数] [--max-depth 层数] [--json 结果.json]
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+
+def GenerateCompound(n):
+  """Nests n 开整 blocks."""
+  return '开整：' * n + '唠唠：“到底了”。' + '整完了。' * n, '到底了\n'
+
+def GenerateElseChain(n):
+  """Chains n 寻思, each in the else-branch of the one before."""
+  code = '老王装%d。' % (n - 1,)
+  for i in range(n):
+    code += '寻思：老王跟%d一样一样的吗？要行咧就唠唠：%d。要不行咧就' % (i, i)
+  return code + '唠唠：“没有”。', '%d\n' % (n - 1,)
+
+def GenerateDecisionTree(n):
+  """Nests n 寻思 in then-branches, each with an else-branch."""
+  code = '老王装%d。' % (n,)
+  for i in range(n):
+    code += '寻思：老王比%d大吗？要行咧就' % (i,)
+  code += '唠唠：“到底了”。'
+  for i in range(n):
+    code += '要不行咧就唠唠：%d。' % (n - 1 - i,)
+  return code, '到底了\n'
+
+def GenerateParens(n):
+  """Nests n parentheses, adding one inside each."""
+  return ('唠唠：' + '（1加' * n + '0' + '）' * n + '。',
+          '%d\n' % (n,))
+
+def GenerateConcat(n):
+  """Says n parts joined with 、."""
+  return '唠唠：' + '、'.join(['“哈”'] * n) + '。', '哈' * n + '\n'
+
+DEPTHS = (100, 300, 1000, 3000, 10000)
+
+KINDS = {
+    '开整套开整': GenerateCompound,
+    '寻思连寻思': GenerateElseChain,
+    '决策树': GenerateDecisionTree,
+    '括号套括号': GenerateParens,
+    '、连成串': GenerateConcat,
+    }
+
+PHASES = ('tokenize', 'parse', 'translate', 'compile', 'execute')
+
+def FitExponent(sizes, values):
+  """Returns the least-squares slope of log(value) over log(size)."""
+  xs = [math.log(size) for size in sizes]
+  ys = [math.log(max(v, 1e-9)) for v in values]
+  mean_x = sum(xs) / len(xs)
+  mean_y = sum(ys) / len(ys)
+  return (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) /
+          sum((x - mean_x) ** 2 for x in xs))
+
+def RunPhases(code):
+  """Runs code phase by phase. Returns (seconds by phase, output)."""
+  seconds = {}
+  start = time.perf_counter()
+  tokens = list(dongbei.Tokenize('老王是活雷锋。' + code))
+  seconds['tokenize'] = time.perf_counter() - start
+  start = time.perf_counter()
+  statements, _ = dongbei.ParseStmts(tokens)
+  seconds['parse'] = time.perf_counter() - start
+  start = time.perf_counter()
+  py_code = dongbei.TranslateStatementsToPython(statements)
+  seconds['translate'] = time.perf_counter() - start
+  start = time.perf_counter()
+  code_object = compile(py_code, '<dongbei>', 'exec')
+  seconds['compile'] = time.perf_counter() - start
+  start = time.perf_counter()
+  output = dongbei.ExecutePython(code_object)
+  seconds['execute'] = time.perf_counter() - start
+  return seconds, output
+
+def PeakMemory(code):
+  """Returns the peak bytes allocated while parsing and translating code."""
+  tokens = list(dongbei.Tokenize('老王是活雷锋。' + code))
+  tracemalloc.start()
+  try:
+    statements, _ = dongbei.ParseStmts(tokens)
+    dongbei.TranslateStatementsToPython(statements)
+    return tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+def BenchKind(generator, depths, repeat):
+  points = []
+  for n in depths:
+    code, expected = generator(n)
+    best = None
+    for _ in range(repeat):
+      seconds, output = RunPhases(code)
+      if output != expected:
+        sys.exit('%s 层的输出不对：%r' % (n, output[-50:]))
+      if best is None:
+        best = seconds
+      else:
+        best = {phase: min(best[phase], seconds[phase]) for phase in PHASES}
+    points.append({'depth': n, 'seconds': best,
+                   'peak_bytes': PeakMemory(code)})
+  exponents = {}
+  if len(points) >= 2:
+    sizes = [p['depth'] for p in points]
+    for phase in PHASES:
+      exponents[phase] = FitExponent(
+          sizes, [p['seconds'][phase] for p in points])
+    exponents['peak_bytes'] = FitExponent(
+        sizes, [p['peak_bytes'] for p in points])
+  return {'points': points, 'exponents': exponents}
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--repeat', type=int, default=3,
+                      help='每个测量重复几次，取最快的')
+  parser.add_argument('--max-depth', type=int, default=DEPTHS[-1],
+                      help='最多套几层')
+  parser.add_argument('--json', metavar='结果.json',
+                      help='把全部结果写成 JSON')
+  args = parser.parse_args()
+
+  depths = [n for n in DEPTHS if n <= args.max_depth]
+  results = {}
+  for kind, generator in KINDS.items():
+    result = results[kind] = BenchKind(generator, depths, args.repeat)
+    print('== %s' % (kind,))
+    print('  %8s %s %10s' % ('层数', ' '.join('%10s' % p for p in PHASES),
+                             '内存 (KB)'))
+    for point in result['points']:
+      print('  %8d %s %10.1f' % (
+          point['depth'],
+          ' '.join('%10.4f' % point['seconds'][p] for p in PHASES),
+          point['peak_bytes'] / 1024))
+    if result['exponents']:
+      print('  %8s %s %10.2f' % (
+          '指数',
+          ' '.join('%10.2f' % result['exponents'][p] for p in PHASES),
+          result['exponents']['peak_bytes']))
+
+  if args.json:
+    with io.open(args.json, 'w', encoding='utf-8') as json_file:
+      json.dump(results, json_file, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+  main()
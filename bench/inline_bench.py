@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Times dongbei loops that call small functions, with and without inlining.
+
+Each kind of program calls a function that only returns an expression of
+its parameters, many times in a loop in another function: with the loop
+variable, with two variables, with strings, and with an argument that has
+to be computed, which is not inlined. The last kind has the loop outside
+functions, where calls are not inlined either. Every program is run as
+translated, and again with inlining turned off (_MAX_INLINE_SIZE = 0),
+taking turns, and the speedup is the ratio of the two fastest times. The
+outputs must be the same.
+
+用法：
+    bench/inline_bench.py [--repeat 次数] [--size 次数] [--json 结果.json]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import timeit
+import unittest.mock
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+
+def InFunction(code):
+  """Returns code that runs the statements in code in a function."""
+  lines = code.strip().split('\n')
+  return '%s\n【跑】咋整：\n%s\n整完了。\n整【跑】。\n' % (
+      lines[0], '\n'.join('  ' + line for line in lines[1:]))
+
+def GenerateSquare(n):
+  """Adds up the squares of 1 to n."""
+  return '''
+【平方】（几）咋整：滚犊子吧几乘几。整完了。
+和装0。
+老王从1到%d磨叽：
+  和装和加整【平方】（老王）。
+磨叽完了。
+唠唠：和。
+''' % (n,)
+
+def GenerateTwoArgs(n):
+  """Compares the loop variable with a variable, n times."""
+  return '''
+【大点儿】（甲，乙）咋整：滚犊子吧甲比乙大。整完了。
+个数装0。中间装%d。
+老王从1到%d磨叽：
+  寻思：整【大点儿】（老王，中间）吗？要行咧就个数走走。
+磨叽完了。
+唠唠：个数。
+''' % (n // 2, n)
+
+def GenerateStrings(n):
+  """Says n lines made by a function."""
+  return '''
+【打招呼】（谁）咋整：滚犊子吧“你好，”、谁、“！”。整完了。
+老王从1到%d磨叽：
+  唠唠：整【打招呼】（老王）。
+磨叽完了。
+''' % (n,)
+
+def GenerateComputedArg(n):
+  """Like GenerateSquare, but the argument has to be computed."""
+  return '''
+【平方】（几）咋整：滚犊子吧几乘几。整完了。
+和装0。
+老王从1到%d磨叽：
+  和装和加整【平方】（老王加1）。
+磨叽完了。
+唠唠：和。
+''' % (n,)
+
+KINDS = {
+    '平方': lambda n: InFunction(GenerateSquare(n)),
+    '两个参数': lambda n: InFunction(GenerateTwoArgs(n)),
+    '字符串': lambda n: InFunction(GenerateStrings(n)),
+    '要算的参数': lambda n: InFunction(GenerateComputedArg(n)),
+    '函数外头': GenerateSquare,
+    }
+
+def BenchKind(generator, size, repeat):
+  code = generator(size)
+  inlined = compile(dongbei.TranslateToPython(code), '<dongbei>', 'exec')
+  with unittest.mock.patch.object(dongbei, '_MAX_INLINE_SIZE', 0):
+    called = compile(dongbei.TranslateToPython(code), '<dongbei>', 'exec')
+  output = dongbei.ExecutePython(inlined)
+  if output != dongbei.ExecutePython(called):
+    sys.exit('内联以后输出不一样了：%r' % (output[-50:],))
+  inlined_times = []
+  called_times = []
+  for _ in range(repeat):
+    inlined_times.append(timeit.timeit(
+        lambda: dongbei.ExecutePython(inlined), number=1))
+    called_times.append(timeit.timeit(
+        lambda: dongbei.ExecutePython(called), number=1))
+  return {'inlined_seconds': min(inlined_times),
+          'called_seconds': min(called_times),
+          'speedup': min(called_times) / min(inlined_times)}
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--repeat', type=int, default=7,
+                      help='每个测量重复几次，取最快的')
+  parser.add_argument('--size', type=int, default=300000,
+                      help='循环转几圈')
+  parser.add_argument('--json', metavar='结果.json',
+                      help='把全部结果写成 JSON')
+  args = parser.parse_args()
+
+  results = {}
+  print('%-10s %10s %10s %8s' % ('', '内联（秒）', '调用（秒）', '快几倍'))
+  for kind, generator in KINDS.items():
+    result = results[kind] = BenchKind(generator, args.size, args.repeat)
+    print('%-10s %10.4f %10.4f %8.2f' % (
+        kind, result['inlined_seconds'], result['called_seconds'],
+        result['speedup']))
+
+  if args.json:
+    with io.open(args.json, 'w', encoding='utf-8') as json_file:
+      json.dump(results, json_file, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+  main()
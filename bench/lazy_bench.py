@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Times starting dongbei programs that define many functions but call few.
+
+Each program defines a number of functions with a loop and a 寻思 in their
+bodies, and calls a few of them. It is translated, compiled and run as
+usual, and again with lazy=True, where the bodies are parsed, translated
+and compiled only when first called. The outputs must be the same. The time
+of lazy translation should grow with the number of functions much slower
+than the time of eager translation.
+
+用法：
+    bench/lazy_bench.py [--repeat 次数] [--called 个数] [--json 结果.json]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+
+def GenerateProgram(n, called):
+  """Defines n functions and calls the first called of them."""
+  code = ''
+  for i in range(n):
+    code += '''
+【套路%d】（几）咋整：
+  和装0。
+  老王从1到几磨叽：
+    寻思：老王比%d大吗？要行咧就和装和加老王。要不行咧就和装和减1。
+  磨叽完了。
+  滚犊子吧和。
+整完了。
+''' % (i, i % 7)
+  for i in range(min(called, n)):
+    code += '唠唠：整【套路%d】（10）。\n' % (i,)
+  return code
+
+SIZES = (100, 300, 1000, 3000)
+
+PHASES = ('translate', 'compile', 'execute')
+
+def RunPhases(code, lazy):
+  """Runs code phase by phase. Returns (seconds by phase, output)."""
+  seconds = {}
+  start = time.perf_counter()
+  py_code = dongbei.TranslateToPython(code, lazy=lazy)
+  seconds['translate'] = time.perf_counter() - start
+  start = time.perf_counter()
+  code_object = compile(py_code, '<dongbei>', 'exec')
+  seconds['compile'] = time.perf_counter() - start
+  start = time.perf_counter()
+  output = dongbei.ExecutePython(code_object)
+  seconds['execute'] = time.perf_counter() - start
+  seconds['total'] = sum(seconds.values())
+  return seconds, output
+
+def BenchSize(n, called, repeat):
+  code = GenerateProgram(n, called)
+  result = {}
+  outputs = {}
+  for mode, lazy in (('eager', False), ('lazy', True)):
+    best = None
+    for _ in range(repeat):
+      seconds, outputs[mode] = RunPhases(code, lazy)
+      if best is None:
+        best = seconds
+      else:
+        best = {phase: min(best[phase], seconds[phase]) for phase in best}
+    result[mode] = best
+  if outputs['eager'] != outputs['lazy']:
+    sys.exit('%d 个套路的时候，用的时候再翻译输出就不一样了' % (n,))
+  result['speedup'] = result['eager']['total'] / result['lazy']['total']
+  return result
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--repeat', type=int, default=3,
+                      help='每个测量重复几次，取最快的')
+  parser.add_argument('--called', type=int, default=5,
+                      help='整其中几个套路')
+  parser.add_argument('--json', metavar='结果.json',
+                      help='把全部结果写成 JSON')
+  args = parser.parse_args()
+
+  results = {}
+  print('%8s %6s %s %10s' % ('套路数', '', ' '.join(
+      '%10s' % phase for phase in PHASES + ('total',)), '快几倍'))
+  for n in SIZES:
+    result = results[n] = BenchSize(n, args.called, args.repeat)
+    for mode in ('eager', 'lazy'):
+      print('%8d %6s %s %10s' % (
+          n, mode, ' '.join('%10.4f' % result[mode][phase]
+                            for phase in PHASES + ('total',)),
+          '%.2f' % result['speedup'] if mode == 'lazy' else ''))
+
+  if args.json:
+    with io.open(args.json, 'w', encoding='utf-8') as json_file:
+      json.dump(results, json_file, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+  main()
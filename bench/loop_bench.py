@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Times dongbei loops that only count and add up.
+
+Three kinds of loops grow with the number of iterations: adding up the
+loop variable (和走老王步), counting (个数走走), and stepping by a
+variable that the loop does not change (倒数退幅度步). Such loops on
+integers are replaced by their closed forms, so their time should not grow
+at all. For comparison, the same sum is also timed with a function call in
+the loop body, which keeps the loop as it is. The scaling exponent of each
+kind is fitted on a log-log scale, so 0 means constant and 1 means linear.
+
+用法：
+    bench/loop_bench.py [--repeat 次数] [--max-size 次数] [--json 结果.json]
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import sys
+import timeit
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+
+def GenerateSum(n):
+  """Adds up 1 to n."""
+  return '''
+和装0。
+老王从1到%d磨叽：
+  和走老王步。
+磨叽完了。
+唠唠：和。
+''' % (n,)
+
+def GenerateUnoptimized(n):
+  """Like GenerateSum, but the call keeps the loop as it is."""
+  return '''
+【啥也不干】咋整：
+  滚犊子吧0。
+整完了。
+和装0。
+老王从1到%d磨叽：
+  整【啥也不干】。
+  和走老王步。
+磨叽完了。
+唠唠：和。
+''' % (n,)
+
+def GenerateCount(n):
+  """Counts to n."""
+  return '''
+个数装0。
+老王从1到%d磨叽：
+  个数走走。
+磨叽完了。
+唠唠：个数。
+''' % (n,)
+
+def GenerateStep(n):
+  """Steps down n times by a variable."""
+  return '''
+倒数装0。幅度装3。
+老王从1到%d磨叽：
+  倒数退幅度步。
+磨叽完了。
+唠唠：倒数。
+''' % (n,)
+
+SIZES = (10000, 30000, 100000, 300000, 1000000)
+
+# Maps a kind to (generator, expected output for n).
+KINDS = {
+    '累加': (GenerateSum, lambda n: n * (n + 1) // 2),
+    '累加（不优化）': (GenerateUnoptimized, lambda n: n * (n + 1) // 2),
+    '数数': (GenerateCount, lambda n: n),
+    '定步长': (GenerateStep, lambda n: -3 * n),
+    }
+
+def FitExponent(sizes, times):
+  """Returns the least-squares slope of log(time) over log(size)."""
+  xs = [math.log(size) for size in sizes]
+  ys = [math.log(max(t, 1e-9)) for t in times]
+  mean_x = sum(xs) / len(xs)
+  mean_y = sum(ys) / len(ys)
+  return (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) /
+          sum((x - mean_x) ** 2 for x in xs))
+
+def BenchKind(generator, expected, sizes, repeat):
+  points = []
+  for n in sizes:
+    code_object = compile(dongbei.TranslateToPython(generator(n)),
+                          '<dongbei>', 'exec')
+    output = dongbei.ExecutePython(code_object)
+    if output != '%d\n' % (expected(n),):
+      sys.exit('%d 圈的输出不对：%r' % (n, output))
+    seconds = min(timeit.repeat(lambda: dongbei.ExecutePython(code_object),
+                                number=1, repeat=repeat))
+    points.append({'size': n, 'seconds': seconds})
+  exponent = (FitExponent([p['size'] for p in points],
+                          [p['seconds'] for p in points])
+              if len(points) >= 2 else None)
+  return {'points': points, 'exponent': exponent}
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--repeat', type=int, default=3,
+                      help='每个测量重复几次，取最快的')
+  parser.add_argument('--max-size', type=int, default=SIZES[-1],
+                      help='循环最多转几圈')
+  parser.add_argument('--json', metavar='结果.json',
+                      help='把全部结果写成 JSON')
+  args = parser.parse_args()
+
+  results = {}
+  sizes = [n for n in SIZES if n <= args.max_size]
+  for kind, (generator, expected) in KINDS.items():
+    result = results[kind] = BenchKind(generator, expected, sizes,
+                                       args.repeat)
+    print('== %s' % (kind,))
+    for point in result['points']:
+      print('  %8d 圈 %10.6f 秒' % (point['size'], point['seconds']))
+    if result['exponent'] is not None:
+      print('  指数 %.2f' % (result['exponent'],))
+
+  if args.json:
+    with io.open(args.json, 'w', encoding='utf-8') as json_file:
+      json.dump(results, json_file, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+  main()
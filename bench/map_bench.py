@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Compares looking keys up in a map (本账) with a chain of 寻思.
+
+Before dongbei had maps, a lookup table was a function that compares the
+key against every case in turn, which takes time linear in the number of
+cases. For a growing number of cases, this times the same number of
+lookups both ways, after compiling each program once.
+
+用法：
+    bench/map_bench.py [--repeat 次数] [--lookups 次数] [--json 结果.json]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import timeit
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+
+CASE_COUNTS = (10, 30, 100, 300, 1000)
+
+def GenerateLookups(n, rounds, lookup):
+  """Adds up lookup(“键”、几) for 几 from 0 to n - 1, rounds times."""
+  return '''
+总数是活雷锋。
+总数装0。
+轮从1到%d磨叽：
+  几从0到%d磨叽：
+    总数走%s步。
+  磨叽完了。
+磨叽完了。
+唠唠：总数。
+''' % (rounds, n - 1, lookup)
+
+def GenerateChain(n, rounds):
+  """A lookup function made of n 寻思."""
+  cases = ''.join('  寻思：名跟“键%d”一样一样的吗？要行咧就滚犊子吧%d。\n' % (i, i)
+                  for i in range(n))
+  return ('【查】（名）咋整：\n%s  滚犊子吧0。\n整完了。\n' % (cases,) +
+          GenerateLookups(n, rounds, '整【查】（“键”、几）'))
+
+def GenerateMap(n, rounds):
+  """A map of n keys."""
+  return ('表是本账。\n几从0到%d磨叽：\n  表的（“键”、几）装几。\n磨叽完了。\n'
+          % (n - 1,) + GenerateLookups(n, rounds, '表的（“键”、几）'))
+
+def Bench(n, lookups, repeat):
+  rounds = max(1, lookups // n)
+  result = {'cases': n, 'lookups': rounds * n}
+  outputs = set()
+  for name, generator in (('寻思', GenerateChain), ('本账', GenerateMap)):
+    program = dongbei.Compile(generator(n, rounds))
+    outputs.add(program.Run())
+    result[name] = min(timeit.repeat(program.Run, number=1, repeat=repeat))
+  assert len(outputs) == 1, outputs
+  return result
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--repeat', type=int, default=3,
+                      help='每个测量重复几次，取最快的')
+  parser.add_argument('--lookups', type=int, default=10000,
+                      help='每个程序大约查几回')
+  parser.add_argument('--json', metavar='结果.json',
+                      help='把全部结果写成 JSON')
+  args = parser.parse_args()
+
+  results = []
+  print('%8s %8s %14s %14s %8s' % (
+      '分支数', '查几回', '寻思（微秒/回）', '本账（微秒/回）', '快几倍'))
+  for n in CASE_COUNTS:
+    result = Bench(n, args.lookups, args.repeat)
+    results.append(result)
+    print('%8d %8d %14.2f %14.2f %8.1f' % (
+        n, result['lookups'], result['寻思'] / result['lookups'] * 1e6,
+        result['本账'] / result['lookups'] * 1e6,
+        result['寻思'] / result['本账']))
+
+  if args.json:
+    with io.open(args.json, 'w', encoding='utf-8') as json_file:
+      json.dump(results, json_file, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+  main()
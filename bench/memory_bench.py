@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Measures the memory used by each phase of running dongbei programs.
+
+For generated programs of growing source size, every phase (tokenizing,
+parsing, translating, compiling and executing) is run under tracemalloc,
+keeping the results of earlier phases alive as Run() does. For each phase
+it reports the peak allocation while the phase ran and the allocation the
+phase left behind, both relative to the start of the phase, plus the
+source lines that retained the most.
+
+The results can be written as JSON Lines, one record per size and phase,
+to compare between releases.
+
+用法：
+    bench/memory_bench.py [--max-size 字节数] [--jsonl 结果.jsonl]
+"""
+
+import argparse
+import gc
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+# Add the repo root to the Python module path.
+sys.path.append(REPO_ROOT)
+
+from src import dongbei
+
+# Bumped whenever the meaning of a field in the JSON Lines output changes.
+FORMAT_VERSION = 1
+
+SIZES = (
+    1 << 10,    # 1 KB
+    10 << 10,   # 10 KB
+    100 << 10,  # 100 KB
+    1 << 20,    # 1 MB
+    10 << 20,   # 10 MB
+    100 << 20,  # 100 MB
+    )
+
+# How many distinct names the generated programs use.
+NAME_COUNT = 50
+
+# One block of a generated program, parameterized by a name index.
+BLOCK = '''
+【甲{0}】是活雷锋。
+【甲{0}】装【甲{0}】啥也不是。
+【乙{0}】（几）咋整：
+  滚犊子吧几乘二加{0}。
+整完了。
+【甲{0}】装整【乙{0}】（{0}）、“哈哈”。
+老王从1到2磨叽：
+  寻思：老王比一大吗？
+  要行咧就唠唠：【甲{0}】。
+磨叽完了。
+'''
+
+def GenerateProgram(size):
+  """Returns a program of about size bytes in UTF-8."""
+  blocks = []
+  total = 0
+  i = 0
+  while total < size:
+    block = BLOCK.format(i % NAME_COUNT)
+    blocks.append(block)
+    total += len(block.encode('utf-8'))
+    i += 1
+  return ''.join(blocks)
+
+def Translate(statements):
+  return '\n'.join(dongbei.TranslateStatementToPython(s) for s in statements)
+
+def MeasurePhases(code, top):
+  """Returns a record for each phase of running code."""
+  records = []
+  results = []  # Keeps the results of all phases alive.
+
+  def Measure(phase, func):
+    gc.collect()
+    before = tracemalloc.take_snapshot()
+    start_current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    results.append(result)
+    top_lines = [
+        {'where': '%s:%d' % (
+            os.path.relpath(stat.traceback[0].filename, REPO_ROOT),
+            stat.traceback[0].lineno),
+         'bytes': stat.size_diff}
+        for stat in after.compare_to(before, 'lineno')[:top]]
+    records.append({
+        'phase': phase,
+        'seconds': seconds,
+        'peak_bytes': peak - start_current,
+        'retained_bytes': current - start_current,
+        'top_retained': top_lines})
+    return result
+
+  tokens = Measure('tokenize', lambda: list(dongbei.Tokenize(code)))
+  statements, _ = Measure('parse', lambda: dongbei.ParseStmts(tokens))
+  py_code = Measure('translate', lambda: Translate(statements))
+  code_object = Measure(
+      'compile', lambda: compile(py_code, '<dongbei>', 'exec'))
+  Measure('execute', lambda: dongbei.ExecutePython(code_object))
+  return records
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--max-size', type=int, default=100 << 10,
+                      help='最大的源程序有多少字节（最多 100 MB）')
+  parser.add_argument('--top', type=int, default=3,
+                      help='每个阶段列出留下内存最多的几行代码')
+  parser.add_argument('--jsonl', metavar='结果.jsonl',
+                      help='把结果写成 JSON Lines')
+  args = parser.parse_args()
+
+  jsonl_file = (io.open(args.jsonl, 'w', encoding='utf-8')
+                if args.jsonl else None)
+  print('%12s %-10s %14s %14s %10s' % (
+      '源程序字节', '阶段', '峰值字节', '留下字节', '秒'))
+  tracemalloc.start()
+  try:
+    for size in SIZES:
+      if size > args.max_size:
+        break
+      code = GenerateProgram(size)
+      source_bytes = len(code.encode('utf-8'))
+      for record in MeasurePhases(code, args.top):
+        print('%12d %-10s %14d %14d %10.3f' % (
+            source_bytes, record['phase'], record['peak_bytes'],
+            record['retained_bytes'], record['seconds']))
+        if jsonl_file:
+          record = dict(record, version=FORMAT_VERSION,
+                        source_bytes=source_bytes)
+          jsonl_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+  finally:
+    tracemalloc.stop()
+    if jsonl_file:
+      jsonl_file.close()
+
+if __name__ == '__main__':
+  main()
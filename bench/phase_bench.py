@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Times each phase of running dongbei programs.
+
+The phases are tokenizing (Tokenize), parsing (ParseStmts), translating
+the statements (TranslateStatementToPython), compiling the Python code, and
+executing it. They are timed on the demo/ programs and on generated
+programs that grow along one axis at a time. For every axis the scaling
+exponent of each phase is fitted on a log-log scale, so 1 means linear and
+2 means quadratic.
+
+用法：
+    bench/phase_bench.py [--repeat 次数] [--scale 倍数] [--json 结果.json]
+"""
+
+import argparse
+import glob
+import io
+import json
+import math
+import os
+import sys
+import timeit
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+
+PHASES = ('tokenize', 'parse', 'translate', 'compile', 'execute')
+
+def GenerateStatements(n):
+  """n increment statements."""
+  return '【甲】是活雷锋。【甲】装0。' + '【甲】走走。' * n + '唠唠：【甲】。'
+
+def GenerateExpression(n):
+  """One expression with n terms."""
+  return '唠唠：' + '加'.join(['1'] * n) + '。'
+
+def GenerateNesting(n):
+  """A statement nested in n compound statements."""
+  return '开整：' * n + '唠唠：1。' + '整完了。' * n
+
+def GenerateStringLiteral(n):
+  """One string literal of n characters."""
+  return '唠唠：“' + '哈' * n + '”。'
+
+def GenerateIdentifiers(n):
+  """n distinct variables."""
+  return ''.join('【变量%d】是活雷锋。' % (i,) for i in range(n))
+
+# Maps an axis name to (generator, sizes).
+AXES = {
+    '语句数': (GenerateStatements, (64, 128, 256, 512, 1024)),
+    '表达式长度': (GenerateExpression, (32, 64, 128, 256, 512)),
+    '嵌套深度': (GenerateNesting, (4, 8, 16, 32, 64)),
+    '字符串长度': (GenerateStringLiteral, (1024, 4096, 16384, 65536, 262144)),
+    '标识符数': (GenerateIdentifiers, (64, 128, 256, 512, 1024)),
+    }
+
+def TimePhases(code, repeat):
+  """Returns a dict from phase to its best time in seconds."""
+  def Best(func):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+  times = {}
+  times['tokenize'] = Best(lambda: list(dongbei.Tokenize(code)))
+  tokens = list(dongbei.Tokenize(code))
+  times['parse'] = Best(lambda: dongbei.ParseStmts(tokens))
+  statements, _ = dongbei.ParseStmts(tokens)
+  def Translate():
+    return '\n'.join(dongbei.TranslateStatementToPython(s)
+                     for s in statements)
+  times['translate'] = Best(Translate)
+  py_code = Translate()
+  times['compile'] = Best(lambda: compile(py_code, '<dongbei>', 'exec'))
+  code_object = compile(py_code, '<dongbei>', 'exec')
+  times['execute'] = Best(lambda: dongbei.ExecutePython(code_object))
+  return times
+
+def FitExponent(sizes, times):
+  """Returns the least-squares slope of log(time) over log(size)."""
+  xs = [math.log(size) for size in sizes]
+  ys = [math.log(max(t, 1e-9)) for t in times]
+  mean_x = sum(xs) / len(xs)
+  mean_y = sum(ys) / len(ys)
+  return (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) /
+          sum((x - mean_x) ** 2 for x in xs))
+
+def BenchDemos(repeat):
+  results = {}
+  for path in sorted(glob.glob(os.path.join(
+      os.path.dirname(__file__), '..', 'demo', '*.dongbei'))):
+    with io.open(path, 'r', encoding='utf-8') as src_file:
+      code = src_file.read()
+    results[os.path.basename(path)] = {
+        'bytes': len(code.encode('utf-8')),
+        'seconds': TimePhases(code, repeat)}
+  return results
+
+def BenchAxis(generator, sizes, repeat):
+  points = []
+  for size in sizes:
+    code = generator(size)
+    point = {'size': size, 'bytes': len(code.encode('utf-8'))}
+    try:
+      point['seconds'] = TimePhases(code, repeat)
+    except (RecursionError, SyntaxError, MemoryError) as e:
+      point['error'] = '%s: %s' % (type(e).__name__, e)
+    points.append(point)
+  ok_points = [p for p in points if 'seconds' in p]
+  result = {'points': points, 'exponents': {}, 'bytes_per_second': {}}
+  if len(ok_points) >= 2:
+    for phase in PHASES:
+      result['exponents'][phase] = FitExponent(
+          [p['size'] for p in ok_points],
+          [p['seconds'][phase] for p in ok_points])
+  if ok_points:
+    largest = ok_points[-1]
+    for phase in PHASES:
+      result['bytes_per_second'][phase] = (
+          largest['bytes'] / max(largest['seconds'][phase], 1e-9))
+  return result
+
+def PrintDemoTable(results):
+  print('%-26s %8s ' % ('demo 程序', '字节') +
+        ' '.join('%10s' % (phase,) for phase in PHASES) + '   (微秒)')
+  for name, result in results.items():
+    print('%-26s %8d ' % (name, result['bytes']) +
+          ' '.join('%10.1f' % (result['seconds'][phase] * 1e6,)
+                   for phase in PHASES))
+
+def PrintAxisTable(axis, result):
+  print()
+  print('== %s' % (axis,))
+  for point in result['points']:
+    if 'error' in point:
+      print('  规模 %-8d 炸了：%s' % (point['size'], point['error']))
+  print('  %-10s %10s %14s' % ('阶段', '指数', '吞吐 (KB/秒)'))
+  for phase in PHASES:
+    if phase in result['exponents']:
+      print('  %-10s %10.2f %14.1f' % (
+          phase, result['exponents'][phase],
+          result['bytes_per_second'][phase] / 1024))
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--repeat', type=int, default=3,
+                      help='每个测量重复几次，取最快的')
+  parser.add_argument('--scale', type=float, default=1,
+                      help='把生成的程序规模都乘上这个数')
+  parser.add_argument('--axes', nargs='*', default=list(AXES),
+                      choices=list(AXES), help='只测这些维度')
+  parser.add_argument('--json', metavar='结果.json',
+                      help='把全部结果写成 JSON')
+  args = parser.parse_args()
+
+  results = {'demos': BenchDemos(args.repeat), 'axes': {}}
+  PrintDemoTable(results['demos'])
+  for axis in args.axes:
+    generator, sizes = AXES[axis]
+    sizes = [max(1, int(size * args.scale)) for size in sizes]
+    results['axes'][axis] = BenchAxis(generator, sizes, args.repeat)
+    PrintAxisTable(axis, results['axes'][axis])
+
+  if args.json:
+    with io.open(args.json, 'w', encoding='utf-8') as json_file:
+      json.dump(results, json_file, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+  main()
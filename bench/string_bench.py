@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Times building long strings in dongbei loops.
+
+Three kinds of programs grow with the number of loop iterations: adding
+to a string in a loop (结果装结果、…), 唠唠 with many parts in a loop, and
+a loop that outputs one line per iteration. A string that a loop only adds
+to is built in a list and joined after the loop, so the first kind should
+scale linearly. For comparison, the same accumulation is also timed with
+a function call in the loop body, which keeps it from being optimized.
+The scaling exponent of each kind is fitted on a log-log scale, so 1
+means linear and 2 means quadratic.
+
+用法：
+    bench/string_bench.py [--repeat 次数] [--max-size 次数] [--json 结果.json]
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import sys
+import timeit
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+
+def GenerateAccumulation(n):
+  """Adds to a string n times."""
+  return '''
+结果是活雷锋。
+结果装“”。
+老王从1到%d磨叽：
+  结果装结果、“哈”、老王。
+磨叽完了。
+''' % (n,)
+
+def GenerateUnoptimized(n):
+  """Like GenerateAccumulation, but the call keeps the loop as it is."""
+  return '''
+【啥也不干】咋整：
+  滚犊子吧0。
+整完了。
+结果是活雷锋。
+结果装“”。
+老王从1到%d磨叽：
+  整【啥也不干】。
+  结果装结果、“哈”、老王。
+磨叽完了。
+''' % (n,)
+
+def GenerateSayChain(n):
+  """Says n lines of several parts each."""
+  return '''
+老王从1到%d磨叽：
+  唠唠：“第”、老王、“行：”、老王乘二、“，”、老王乘三、“。”。
+磨叽完了。
+''' % (n,)
+
+def GenerateOutput(n):
+  """Says n short lines."""
+  return '老王从1到%d磨叽：\n  唠唠：老王。\n磨叽完了。\n' % (n,)
+
+SIZES = (10000, 30000, 100000, 300000, 1000000)
+
+# Maps a kind to (generator, largest size). The unoptimized accumulation
+# is quadratic, so it stops early.
+KINDS = {
+    '累加字符串': (GenerateAccumulation, None),
+    '累加（不优化）': (GenerateUnoptimized, 100000),
+    '唠唠多段': (GenerateSayChain, None),
+    '唠唠多行': (GenerateOutput, None),
+    }
+
+def FitExponent(sizes, times):
+  """Returns the least-squares slope of log(time) over log(size)."""
+  xs = [math.log(size) for size in sizes]
+  ys = [math.log(max(t, 1e-9)) for t in times]
+  mean_x = sum(xs) / len(xs)
+  mean_y = sum(ys) / len(ys)
+  return (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) /
+          sum((x - mean_x) ** 2 for x in xs))
+
+def BenchKind(generator, sizes, repeat):
+  points = []
+  for n in sizes:
+    code_object = compile(dongbei.TranslateToPython(generator(n)),
+                          '<dongbei>', 'exec')
+    seconds = min(timeit.repeat(lambda: dongbei.ExecutePython(code_object),
+                                number=1, repeat=repeat))
+    points.append({'size': n, 'seconds': seconds})
+  exponent = (FitExponent([p['size'] for p in points],
+                          [p['seconds'] for p in points])
+              if len(points) >= 2 else None)
+  return {'points': points, 'exponent': exponent}
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--repeat', type=int, default=3,
+                      help='每个测量重复几次，取最快的')
+  parser.add_argument('--max-size', type=int, default=SIZES[-1],
+                      help='循环最多转几圈')
+  parser.add_argument('--json', metavar='结果.json',
+                      help='把全部结果写成 JSON')
+  args = parser.parse_args()
+
+  results = {}
+  for kind, (generator, largest) in KINDS.items():
+    limit = min(args.max_size, largest or args.max_size)
+    sizes = [n for n in SIZES if n <= limit]
+    result = results[kind] = BenchKind(generator, sizes, args.repeat)
+    print('== %s' % (kind,))
+    for point in result['points']:
+      print('  %8d 圈 %10.3f 秒' % (point['size'], point['seconds']))
+    if result['exponent'] is not None:
+      print('  指数 %.2f' % (result['exponent'],))
+
+  if args.json:
+    with io.open(args.json, 'w', encoding='utf-8') as json_file:
+      json.dump(results, json_file, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+  main()
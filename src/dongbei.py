@@ -4,13 +4,40 @@
 """dongbei语言执行器
 
 用法：
-    dongbei.py 源程序文件名...
+    dongbei.py [--stats] [--cache-dir 目录] 源程序文件名...
+    dongbei.py --jobs 进程数 [--report 报告.jsonl] [--output-dir 目录] 源程序文件名...
 """
 
+import argparse
+import concurrent.futures
+import hashlib
 import io
+import itertools
+import json
+import os
 import re
 import sys
-
+import threading
+import time
+import unicodedata
+
+# The runtime has the helpers that translated code uses.
+try:
+  from . import dongbei_runtime
+  from .dongbei_runtime import (BudgetExceededError, _DbArray, _DbInput,
+                                _DbMap, _MakeBudgetCheck, _db_parallel,
+                                _dongbei_str)
+except ImportError:
+  import dongbei_runtime
+  from dongbei_runtime import (BudgetExceededError, _DbArray, _DbInput,
+                               _DbMap, _MakeBudgetCheck, _db_parallel,
+                               _dongbei_str)
+
+KW_ARRAY = '家'
+KW_ARRAY_LEN = '有几口人'
+KW_ARRAY_MAX = '最大的'
+KW_ARRAY_MIN = '最小的'
+KW_ARRAY_SUM = '一共'
 KW_BANG = '！'
 KW_BECOME = '装'
 KW_BEGIN = '开整：'
@@ -33,21 +60,29 @@ KW_ELSE = '要不行咧就'
 KW_END = '整完了'
 KW_END_LOOP = '磨叽完了'
 KW_EQUAL = '一样一样的'
+KW_FOREACH = '挨个儿磨叽：'
+KW_FOREACH_LINE = '挨句听磨叽：'
 KW_FROM = '从'
 KW_FUNC_DEF = '咋整：'
 KW_GREATER = '大'
+KW_IMPORT = '翠花，上'
 KW_INC = '走走'
 KW_INC_BY = '走'
+KW_IS_MAP = '是本账'
 KW_IS_NONE = '啥也不是'
 KW_IS_VAR = '是活雷锋'
 KW_LESS = '小'
 KW_LOOP = '磨叽：'
 KW_MINUS = '减'
 KW_NOT_EQUAL = '不是一样一样的'
+KW_OF = '的'
 KW_OPEN_PAREN = '（'
 KW_OPEN_PAREN_NARROW = '('
 KW_OPEN_QUOTE = '“'
+KW_PARALLEL_LOOP = '一块堆儿磨叽：'
 KW_PERIOD = '。'
+KW_READ_INT = '听个数'
+KW_READ_LINE = '听一句'
 KW_PLUS = '加'
 KW_RETURN = '滚犊子吧'
 KW_SAY = '唠唠'
@@ -57,6 +92,11 @@ KW_TIMES = '乘'
 KW_TO = '到'
 
 KEYWORDS = (
+    KW_ARRAY,
+    KW_ARRAY_LEN,
+    KW_ARRAY_MAX,
+    KW_ARRAY_MIN,
+    KW_ARRAY_SUM,
     KW_BANG,
     KW_BECOME,
     KW_BEGIN,
@@ -79,21 +119,29 @@ KEYWORDS = (
     KW_CALL,  # 整
     KW_END_LOOP,
     KW_EQUAL,
+    KW_FOREACH,
+    KW_FOREACH_LINE,
     KW_FROM,
     KW_FUNC_DEF,
     KW_GREATER,
+    KW_IMPORT,
     KW_INC,
     KW_INC_BY,
+    KW_IS_MAP,
     KW_IS_NONE,
     KW_IS_VAR,
     KW_LESS,
     KW_LOOP,
     KW_MINUS,
     KW_NOT_EQUAL,
+    KW_OF,
     KW_OPEN_PAREN,
     KW_OPEN_PAREN_NARROW,
     KW_OPEN_QUOTE,
+    KW_PARALLEL_LOOP,
     KW_PERIOD,
+    KW_READ_INT,
+    KW_READ_LINE,
     KW_PLUS,
     KW_RETURN,
     KW_SAY,
@@ -111,12 +159,31 @@ KEYWORD_TO_NORMALIZED_KEYWORD = {
     KW_COMMA_NARROW: KW_COMMA,
     }
 
+# Keywords that programs written before them may have in identifiers, as in
+# 家长, 张家口 and 我的钱. Tokenize() only takes them for keywords where they
+# can mean something.
+_SOFT_KEYWORDS = frozenset((
+    KW_ARRAY,
+    KW_ARRAY_LEN,
+    KW_ARRAY_MAX,
+    KW_ARRAY_MIN,
+    KW_ARRAY_SUM,
+    KW_OF,
+    ))
+
+# An array element is picked by 老 and its place, as in 老二 and 老（几）.
+ELDER = '老'
+# 老幺 picks the last element.
+YOUNGEST = '老幺'
+
 # Types of tokens.
 TK_KEYWORD = 'KEYWORD'
 TK_IDENTIFIER = 'IDENTIFIER'
 TK_STRING_LITERAL = 'STRING'
 TK_INTEGER_LITERAL = 'INTEGER'
 TK_CHAR = 'CHAR'
+# The tokens of a function body, parsed when the function is first called.
+TK_FUNC_BODY = 'FUNC_BODY'
 
 # Statements.
 STMT_ASSIGN = 'ASSIGN'
@@ -125,17 +192,23 @@ STMT_COMPOUND = 'COMPOUND'
 STMT_CONDITIONAL = 'CONDITIONAL'
 STMT_DEC_BY = 'DEC_BY'
 STMT_DELETE = 'DELETE'
+STMT_DELETE_ELEMENT = 'DELETE_ELEMENT'
+STMT_FOREACH = 'FOREACH'
 STMT_FUNC_DEF = 'FUNC_DEF'
+STMT_IMPORT = 'IMPORT'
 STMT_INC_BY = 'INC_BY'
+STMT_LAZY_FUNC_DEF = 'LAZY_FUNC_DEF'
 STMT_LOOP = 'LOOP'
+STMT_PARALLEL_LOOP = 'PARALLEL_LOOP'
 STMT_RETURN = 'RETURN'
 STMT_SAY = 'SAY'
 STMT_VAR_DECL = 'VAR_DECL'
 
 class Token:
-  def __init__(self, kind, value):
+  def __init__(self, kind, value, line = None):
     self.kind = kind
     self.value = value
+    self.line = line  # Where the token starts in the source. Not compared.
 
   def __str__(self):
     return f'{self.kind} <{self.value}>'
@@ -168,17 +241,33 @@ class Expr:
   def __ne__(self, other):
     return not (self == other)
 
+  def Children(self):
+    """Returns the expressions directly in this one."""
+    raise Exception('%s must implement Children().' % (type(self),))
+
+  def PythonFromParts(self, parts):
+    """Translates this expression to Python, given the translations of its
+    children (in the order of Children()).
+    """
+    raise Exception('%s must implement PythonFromParts().' % (type(self),))
+
   def ToPython(self):
     """Translates this expression to Python."""
-    raise Exception('%s must implement ToPython().' % (type(self),))
-
-def _dongbei_str(value):
-  """Converts a value to its dongbei string."""
-  if value is None:
-    return '啥也不是'
-  if type(value) == bool:
-    return '对' if value else '错'
-  return str(value)
+    return ExprToPython(self)
+
+def _StrToPython(expr, code):
+  """Turns code, the translation of expr, into Python code for its dongbei
+  string.
+  """
+  if isinstance(expr, ConcatExpr) or (
+      isinstance(expr, LiteralExpr) and
+      expr.token.kind == TK_STRING_LITERAL):
+    return code  # Already a string.
+  return '_dongbei_str(%s)' % (code,)
+
+# Concatenations of up to this many parts use +, which is faster than
+# ''.join() for so few.
+_CONCAT_MAX_PLUS_PARTS = 4
 
 class ConcatExpr(Expr):
   def __init__(self, exprs):
@@ -190,9 +279,16 @@ class ConcatExpr(Expr):
   def Equals(self, other):
     return self.exprs == other.exprs
 
-  def ToPython(self):
-    return ' + '.join('_dongbei_str(%s)' % (
-        expr.ToPython(),) for expr in self.exprs)
+  def Children(self):
+    return list(self.exprs)
+
+  def PythonFromParts(self, parts):
+    parts = [_StrToPython(expr, code)
+             for expr, code in zip(self.exprs, parts)]
+    if len(parts) <= _CONCAT_MAX_PLUS_PARTS:
+      return ' + '.join(parts)
+    # Join longer ones in one go, instead of copying every partial sum.
+    return "''.join((%s))" % (', '.join(parts),)
 
 ARITHMETIC_OPERATION_TO_PYTHON = {
     '加': '+',
@@ -216,11 +312,15 @@ class ArithmeticExpr(Expr):
             self.operation == other.operation and
             self.op2 == other.op2)
 
-  def ToPython(self):
-    return '%s %s %s' % (self.op1.ToPython(),
+  def Children(self):
+    return [self.op1, self.op2]
+
+  def PythonFromParts(self, parts):
+    op1, op2 = parts
+    return '%s %s %s' % (op1,
                          ARITHMETIC_OPERATION_TO_PYTHON[
                              self.operation.value],
-                         self.op2.ToPython())
+                         op2)
 
 class LiteralExpr(Expr):
   def __init__(self, token):
@@ -232,7 +332,10 @@ class LiteralExpr(Expr):
   def Equals(self, other):
     return self.token == other.token
 
-  def ToPython(self):
+  def Children(self):
+    return []
+
+  def PythonFromParts(self, parts):
     if self.token.kind == TK_INTEGER_LITERAL:
       return str(self.token.value)
     if self.token.kind == TK_STRING_LITERAL:
@@ -249,7 +352,10 @@ class VariableExpr(Expr):
   def Equals(self, other):
     return self.var == other.var
 
-  def ToPython(self):
+  def Children(self):
+    return []
+
+  def PythonFromParts(self, parts):
     return GetPythonVarName(self.var.value)
 
 class ParenExpr(Expr):
@@ -262,8 +368,11 @@ class ParenExpr(Expr):
   def Equals(self, other):
     return self.expr == other.expr
 
-  def ToPython(self):
-    return '(%s)' % (self.expr.ToPython(),)
+  def Children(self):
+    return [self.expr]
+
+  def PythonFromParts(self, parts):
+    return '(%s)' % tuple(parts)
 
 class CallExpr(Expr):
   def __init__(self, func, args):
@@ -278,10 +387,26 @@ class CallExpr(Expr):
     return (self.func == other.func and
             self.args == other.args)
 
-  def ToPython(self):
-    return '%s(%s)' % (
-        GetPythonVarName(self.func.value),
-        ', '.join(arg.ToPython() for arg in self.args))
+  def Children(self):
+    return list(self.args)
+
+  def PythonFromParts(self, parts):
+    func = GetPythonVarName(self.func.value)
+    call = '%s(%s)' % (func, ', '.join(parts))
+    inline = _inline_functions.get(self.func.value) if _inlining else None
+    # Only inline arguments that are just read, so that each is still
+    # evaluated once and before the body.
+    if (inline is None or len(parts) != len(inline[0]) or
+        not all(isinstance(arg, (LiteralExpr, VariableExpr)) or
+                part.startswith('_db_tmp')
+                for arg, part in zip(self.args, parts))):
+      return call
+    params, expr, marker = inline
+    # Call the function after all if its name has been given to another
+    # one since.
+    return '((%s) if %s is %s else %s)' % (
+        ExprToPython(expr, names=dict(zip(params, parts))), func, marker,
+        call)
 
 # Maps a dongbei comparison keyword to the Python version.
 COMPARISON_KEYWORD_TO_PYTHON = {
@@ -306,17 +431,180 @@ class ComparisonExpr(Expr):
             self.relation == other.relation and
             self.op2 == other.op2)
 
-  def ToPython(self):
+  def Children(self):
+    return [self.op1] if self.op2 is None else [self.op1, self.op2]
+
+  def PythonFromParts(self, parts):
     if self.relation.value == KW_IS_NONE:
-      return f'({self.op1.ToPython()}) is None'
-    return '%s %s %s' % (self.op1.ToPython(),
+      return f'({parts[0]}) is None'
+    op1, op2 = parts
+    return '%s %s %s' % (op1,
                          COMPARISON_KEYWORD_TO_PYTHON[self.relation.value],
-                         self.op2.ToPython())
+                         op2)
+
+class ArrayExpr(Expr):
+  """The elements given to an array, as in 老李家装一，二，三。"""
+
+  def __init__(self, exprs):
+    self.exprs = exprs
+
+  def __str__(self):
+    return 'ARRAY_EXPR<%s>' % (self.exprs,)
+
+  def Equals(self, other):
+    return self.exprs == other.exprs
+
+  def Children(self):
+    return list(self.exprs)
+
+  def PythonFromParts(self, parts):
+    return '_DbArray.Of(%s)' % (', '.join(parts),)
+
+class IndexExpr(Expr):
+  """One element of an array, as in 老李家老二.
+
+  index is None for the last element (老幺).
+  """
+
+  def __init__(self, array, index):
+    self.array = array
+    self.index = index
+
+  def __str__(self):
+    return 'INDEX_EXPR<%s>[%s]' % (self.array, self.index)
+
+  def Equals(self, other):
+    return self.array == other.array and self.index == other.index
+
+  def Children(self):
+    return [] if self.index is None else [self.index]
+
+  def PythonFromParts(self, parts):
+    array = GetPythonVarName(self.array.value)
+    if self.index is None:
+      return '%s[len(%s)]' % (array, array)
+    return '%s[%s]' % (array, parts[0])
+
+class MapExpr(Expr):
+  """A new, empty map, as in 电话是本账。"""
+
+  def __str__(self):
+    return 'MAP_EXPR<>'
+
+  def Equals(self, other):
+    return True
+
+  def Children(self):
+    return []
+
+  def PythonFromParts(self, parts):
+    return '_DbMap()'
+
+class LookupExpr(Expr):
+  """The value of a key in a map, as in 电话的“老王”."""
+
+  def __init__(self, map, key):
+    self.map = map
+    self.key = key
+
+  def __str__(self):
+    return 'LOOKUP_EXPR<%s>[%s]' % (self.map, self.key)
+
+  def Equals(self, other):
+    return self.map == other.map and self.key == other.key
+
+  def Children(self):
+    return [self.map, self.key]
+
+  def PythonFromParts(self, parts):
+    # A missing key is 啥也不是.
+    return '%s.get(%s)' % tuple(parts)
+
+  def PythonTargetFromParts(self, parts):
+    """Translates this to Python that can be assigned to."""
+    return '%s[%s]' % tuple(parts)
+
+# Maps a dongbei input keyword to the Python version.
+INPUT_KEYWORD_TO_PYTHON = {
+    KW_READ_INT: '_db_input.ReadInt()',
+    KW_READ_LINE: '_db_input.ReadLine()',
+    }
+
+class InputExpr(Expr):
+  """The next line or integer of the input, as in 听一句 and 听个数."""
+
+  def __init__(self, what):
+    self.what = what
+
+  def __str__(self):
+    return 'INPUT_EXPR<%s>' % (self.what,)
+
+  def Equals(self, other):
+    return self.what == other.what
+
+  def Children(self):
+    return []
+
+  def PythonFromParts(self, parts):
+    return INPUT_KEYWORD_TO_PYTHON[self.what.value]
+
+class LinesExpr(Expr):
+  """The lines that 挨句听磨叽 goes through.
+
+  file is None for the program's input, or the expression of a file path.
+  """
+
+  def __init__(self, file):
+    self.file = file
+
+  def __str__(self):
+    return 'LINES_EXPR<%s>' % (self.file,)
+
+  def Equals(self, other):
+    return self.file == other.file
+
+  def Children(self):
+    return [] if self.file is None else [self.file]
+
+  def PythonFromParts(self, parts):
+    if self.file is None:
+      return '_db_input.Lines()'
+    return '_DbInput.FileLines(%s)' % tuple(parts)
+
+# Maps a dongbei aggregation keyword to the Python version.
+AGGREGATION_KEYWORD_TO_PYTHON = {
+    KW_ARRAY_LEN: 'len(%s)',
+    KW_ARRAY_MAX: '%s.Max()',
+    KW_ARRAY_MIN: '%s.Min()',
+    KW_ARRAY_SUM: '%s.Sum()',
+    }
+
+class AggregationExpr(Expr):
+  """Something about a whole array, as in 老李家一共."""
+
+  def __init__(self, expr, aggregation):
+    self.expr = expr
+    self.aggregation = aggregation
+
+  def __str__(self):
+    return 'AGGREGATION_EXPR<%s, %s>' % (self.expr, self.aggregation)
+
+  def Equals(self, other):
+    return (self.expr == other.expr and
+            self.aggregation == other.aggregation)
+
+  def Children(self):
+    return [self.expr]
+
+  def PythonFromParts(self, parts):
+    return AGGREGATION_KEYWORD_TO_PYTHON[self.aggregation.value] % tuple(
+        parts)
 
 class Statement:
-  def __init__(self, kind, value):
+  def __init__(self, kind, value, line = None):
     self.kind = kind
     self.value = value
+    self.line = line  # Where the statement starts in the source. Not compared.
 
   def __str__(self):
     value_str = str(self.value)
@@ -333,73 +621,236 @@ class Statement:
   def __ne__(self, other):
     return not (self == other)
 
+def WalkExpr(expr):
+  """Yields expr and all expressions in it, each before its children."""
+  stack = [expr]
+  while stack:
+    expr = stack.pop()
+    yield expr
+    stack.extend(reversed(expr.Children()))
+
+def ExprDepth(expr):
+  """Returns how deeply expressions are nested in expr, 1 if not at all."""
+  depth = 0
+  stack = [(expr, 1)]
+  while stack:
+    expr, expr_depth = stack.pop()
+    depth = max(depth, expr_depth)
+    stack.extend((child, expr_depth + 1) for child in expr.Children())
+  return depth
+
+# Python cannot compile expressions nested much deeper than this, so deeper
+# ones are translated with temporaries (see ExprToPython()).
+_MAX_EXPR_DEPTH = 100
+
+def ExprToPython(expr, temps = None, names = None, common = None):
+  """Translates expr to Python, children first, without recursion.
+
+  If temps (a list) is given, expr and every expression in it except
+  literals are assigned to temporaries first, in the order Python would
+  evaluate them. The assignments are appended to temps, and the result is
+  the temporary that holds expr. Python code made this way is not nested
+  at all, however deeply expr is.
+
+  If names is given, it maps the names of variables to the Python code to
+  use for them instead. If common is given, it maps the ids of expressions
+  to the temporaries that hold them already (see FindCommonSubexprs()).
+  """
+  parts = []  # The translations of the expressions done so far.
+  stack = [(expr, False)]
+  while stack:
+    e, children_done = stack.pop()
+    if common and id(e) in common:
+      parts.append(common[id(e)])
+      continue
+    children = e.Children()
+    if children and not children_done:
+      stack.append((e, True))
+      stack.extend((child, False) for child in reversed(children))
+      continue
+    child_parts = parts[len(parts) - len(children):]
+    del parts[len(parts) - len(children):]
+    if (names is not None and isinstance(e, VariableExpr) and
+        e.var.value in names):
+      parts.append(names[e.var.value])
+    elif temps is None:
+      parts.append(e.PythonFromParts(child_parts))
+    elif isinstance(e, ParenExpr):
+      parts.append(child_parts[0])  # Already a temporary or a literal.
+    elif isinstance(e, LiteralExpr):
+      parts.append(e.PythonFromParts(child_parts))
+    else:
+      temp = '_db_tmp%d' % (len(temps),)
+      temps.append('%s = %s' % (temp, e.PythonFromParts(child_parts)))
+      parts.append(temp)
+  return parts[0]
+
+def ExprVarNames(expr):
+  """Yields the names of the variables, arrays and functions in expr."""
+  for e in WalkExpr(expr):
+    if isinstance(e, VariableExpr):
+      yield e.var.value
+    elif isinstance(e, IndexExpr):
+      yield e.array.value
+    elif isinstance(e, CallExpr):
+      yield e.func.value
+
+def StatementParts(stmt):
+  """Returns (targets, exprs, stmts) directly in stmt.
+
+  targets are what the statement assigns to, deletes or defines: identifier
+  tokens, IndexExprs or LookupExprs. exprs are the expressions it
+  evaluates, and stmts the statements in its body.
+  """
+  if stmt.kind in (STMT_VAR_DECL, STMT_DELETE, STMT_DELETE_ELEMENT):
+    return [stmt.value], [], []
+  if stmt.kind == STMT_IMPORT:
+    return [], [], []
+  if stmt.kind in (STMT_ASSIGN, STMT_INC_BY, STMT_DEC_BY):
+    target, expr = stmt.value
+    return [target], [expr], []
+  if stmt.kind in (STMT_SAY, STMT_CALL, STMT_RETURN):
+    return [], [stmt.value], []
+  if stmt.kind in (STMT_LOOP, STMT_PARALLEL_LOOP):
+    var, from_expr, to_expr, stmts = stmt.value
+    return [var], [from_expr, to_expr], stmts
+  if stmt.kind == STMT_FOREACH:
+    var, container, stmts = stmt.value
+    return [var], [container], stmts
+  if stmt.kind == STMT_FUNC_DEF:
+    func, params, stmts = stmt.value
+    return [func] + params, [], stmts
+  if stmt.kind == STMT_LAZY_FUNC_DEF:
+    # The body is not parsed yet.
+    func, params, _ = stmt.value
+    return [func] + params, [], []
+  if stmt.kind == STMT_COMPOUND:
+    return [], [], stmt.value
+  if stmt.kind == STMT_CONDITIONAL:
+    condition, then_stmt, else_stmt = stmt.value
+    return [], [condition], [s for s in (then_stmt, else_stmt) if s]
+  sys.exit('我不懂 %s 语句咋执行。' % (stmt.kind))
+
+def WalkStatements(stmts):
+  """Yields the statements and all statements in them, each before the
+  statements in it.
+  """
+  stack = list(reversed(stmts))
+  while stack:
+    stmt = stack.pop()
+    yield stmt
+    stack.extend(reversed(StatementParts(stmt)[2]))
+
+def TargetVarName(target):
+  """Returns the name of the variable, array or map that target is in."""
+  while isinstance(target, LookupExpr):
+    target = target.map
+  if isinstance(target, VariableExpr):
+    return target.var.value
+  if isinstance(target, IndexExpr):
+    return target.array.value
+  return target.value
+
+def CheckParallelLoop(stmts):
+  """Exits unless stmts, the body of a 一块堆儿磨叽, can run its iterations
+  apart.
+
+  Each iteration runs in a worker process, with its own copy of the
+  variables, so the body may not change any variable, array or map. Nor may
+  it define functions, import modules, return or read the input. The
+  functions it calls are not checked.
+  """
+  for stmt in WalkStatements(stmts):
+    targets, exprs, _ = StatementParts(stmt)
+    if targets:
+      sys.exit('一块堆儿磨叽里不能动%s：各磨叽各的，动了谁也看不着。' % (
+          TargetVarName(targets[0]),))
+    if stmt.kind == STMT_IMPORT:
+      sys.exit('一块堆儿磨叽里不能叫翠花上%s。' % (stmt.value.value,))
+    if stmt.kind == STMT_RETURN:
+      sys.exit('一块堆儿磨叽里不能滚犊子。')
+    for expr in exprs:
+      for e in WalkExpr(expr):
+        if (isinstance(e, InputExpr) or
+            isinstance(e, LinesExpr) and e.file is None):
+          sys.exit('一块堆儿磨叽里不能听：谁先听着算谁的？')
+
 def Keyword(str):
   """Returns a keyword token whose value is the given string."""
   return Token(TK_KEYWORD, str)
 
-def TokenizeStringLiteralAndRest(code):
-  close_quote_pos = code.find(KW_CLOSE_QUOTE)
-  if close_quote_pos < 0:
-    yield Token(TK_STRING_LITERAL, code)
-    return
+# Whitespace, and comments, which go to the end of the line.
+_WHITESPACE_AND_COMMENT_RE = re.compile(r'(?:\s|#.*)*')
 
-  yield Token(TK_STRING_LITERAL, code[:close_quote_pos])
-  yield Keyword(KW_CLOSE_QUOTE)
-  for tk in BasicTokenize(code[close_quote_pos + len(KW_CLOSE_QUOTE):]):
-    yield tk    
+# An identifier in 【】.
+_BRACKETED_IDENTIFIER_RE = re.compile('【(.*?)】')
 
-def SkipWhitespaceAndComment(code):
-  while True:
-    old_len = len(code)
-    code = code.lstrip()
-    if code.startswith('#'):  # comment
-      code = re.sub(r'^.*', '', code)  # Ignore the comment line.
-    if len(code) == old_len:  # cannot skip any further.
-      return code
-
-def TryParseKeyword(keyword, code):
-  """Returns (parsed keyword string, remaining code)."""
-  orig_code = code
+# Maps a character to the keywords that start with it, in the order of
+# KEYWORDS.
+_KEYWORDS_BY_FIRST_CHAR = {}
+for _keyword in KEYWORDS:
+  _KEYWORDS_BY_FIRST_CHAR.setdefault(_keyword[0], []).append(_keyword)
+
+def SkipWhitespaceAndComment(code, pos = 0):
+  """Returns where code continues after the whitespace and comments at pos."""
+  return _WHITESPACE_AND_COMMENT_RE.match(code, pos).end()
+
+def TryParseKeyword(keyword, code, pos = 0):
+  """Returns where code continues after keyword at pos, or None if keyword
+  is not there. There may be whitespace and comments inside keyword.
+  """
   for char in keyword:
-    code = SkipWhitespaceAndComment(code)
-    if not code.startswith(char):
-      return None, orig_code
-    code = code[1:]
-  return keyword, code
+    pos = SkipWhitespaceAndComment(code, pos)
+    if not code.startswith(char, pos):
+      return None
+    pos += 1
+  return pos
 
 def BasicTokenize(code):
-  code = SkipWhitespaceAndComment(code)
-  if not code:
-    return
-
-  # Parse 【标识符】.
-  m = re.match('^(【(.*?)】)', code)
-  if m:
-    id = re.sub(r'\s+', '', m.group(2))  # Ignore whitespace.
-    yield Token(TK_IDENTIFIER, id)
-    for tk in BasicTokenize(code[len(m.group(1)):]):
-      yield tk
-    return
-    
-  # Try to parse a keyword at the beginning of the code.
-  for keyword in KEYWORDS:
-    kw, remaining_code = TryParseKeyword(keyword, code)
-    if kw:
-      keyword = KEYWORD_TO_NORMALIZED_KEYWORD.get(keyword, keyword)
-      last_token = Keyword(keyword)
-      yield last_token
-      if last_token == Keyword(KW_OPEN_QUOTE):
-        for tk in TokenizeStringLiteralAndRest(remaining_code):
-          yield tk
-      else:
-        for tk in BasicTokenize(remaining_code.lstrip()):
-          yield tk
+  # Keep a position in code rather than slicing it, which would copy the
+  # rest of the code for every token.
+  pos = 0
+  line = 1  # The line at pos.
+  while True:
+    new_pos = SkipWhitespaceAndComment(code, pos)
+    line += code.count('\n', pos, new_pos)
+    pos = new_pos
+    if pos == len(code):
       return
 
-  yield Token(TK_CHAR, code[0])
-  for tk in BasicTokenize(code[1:]):
-    yield tk
-  
+    # Parse 【标识符】.
+    m = _BRACKETED_IDENTIFIER_RE.match(code, pos)
+    if m:
+      id = re.sub(r'\s+', '', m.group(1))  # Ignore whitespace.
+      yield Token(TK_IDENTIFIER, id, line)
+      new_pos = m.end()
+    else:
+      # Try to parse a keyword at the beginning of the code.
+      for keyword in _KEYWORDS_BY_FIRST_CHAR.get(code[pos], ()):
+        keyword_end = TryParseKeyword(keyword, code, pos)
+        if keyword_end is not None:
+          keyword = KEYWORD_TO_NORMALIZED_KEYWORD.get(keyword, keyword)
+          yield Token(TK_KEYWORD, keyword, line)
+          if keyword == KW_OPEN_QUOTE:
+            # Parse the string literal and the closing quote.
+            line += code.count('\n', pos, keyword_end)
+            pos = keyword_end
+            close_quote_pos = code.find(KW_CLOSE_QUOTE, pos)
+            if close_quote_pos < 0:
+              yield Token(TK_STRING_LITERAL, code[pos:], line)
+              return
+            yield Token(TK_STRING_LITERAL, code[pos:close_quote_pos], line)
+            yield Token(TK_KEYWORD, KW_CLOSE_QUOTE,
+                        line + code.count('\n', pos, close_quote_pos))
+            new_pos = close_quote_pos + len(KW_CLOSE_QUOTE)
+          else:
+            new_pos = keyword_end
+          break
+      else:
+        yield Token(TK_CHAR, code[pos], line)
+        new_pos = pos + 1
+    line += code.count('\n', pos, new_pos)
+    pos = new_pos
 
 CHINESE_DIGITS = {
     '零': 0,
@@ -428,17 +879,165 @@ def ParseInteger(str):
   return (None, str)
 
     
-def ParseChars(chars):
+def ParseChars(chars, line = None):
   integer, rest = ParseInteger(chars)
   if integer is not None:
-    yield Token(TK_INTEGER_LITERAL, integer)
+    yield Token(TK_INTEGER_LITERAL, integer, line)
   if rest:
-    yield Token(TK_IDENTIFIER, rest)
+    yield Token(TK_IDENTIFIER, rest, line)
+
+# Keywords that may end an array or a map.
+_EXPR_END_KEYWORDS = (
+    Keyword(KW_ARRAY),
+    Keyword(KW_CLOSE_PAREN),
+    Keyword(KW_CLOSE_QUOTE),
+    )
 
-def Tokenize(code):
+def _MapNames(tokens):
+  """Returns the names that the basic tokens make 本账, as in 电话是本账."""
+  names = set()
+  for i, token in enumerate(tokens):
+    if token.value != KW_IS_MAP or token.kind != TK_KEYWORD:
+      continue
+    start = i
+    while start > 0 and tokens[start - 1].kind == TK_CHAR:
+      start -= 1
+    if start < i:
+      names.add(''.join(token.value for token in tokens[start:i]))
+    elif i > 0 and tokens[i - 1].kind == TK_IDENTIFIER:
+      names.add(tokens[i - 1].value)
+  return names
+
+def _CharsAt(tokens, i):
+  """Returns the identifier that the TK_CHARs from tokens[i] on make."""
+  chars = []
+  for token in itertools.islice(tokens, i, None):
+    if token.kind != TK_CHAR:
+      break
+    chars.append(token.value)
+  return ''.join(chars)
+
+def _IsIndex(chars):
+  """Returns whether chars picks an element, as in 老二 and 老幺."""
+  if chars == YOUNGEST:
+    return True
+  if not chars.startswith(ELDER):
+    return False
+  index, rest = ParseInteger(chars[len(ELDER):])
+  return index is not None and not rest
+
+def _ArrayNames(tokens):
+  """Returns the names that the basic tokens use as arrays (without the 家),
+  as in 老李家是活雷锋, 老李家装1，2, 老李家老二 and 老李家一共.
+
+  Only these make 家 a keyword, since 专家装1 and 人家比3大 are about a
+  variable.
+  """
+  names = set()
+  for i, token in enumerate(tokens):
+    if (token.value != KW_ARRAY or token.kind != TK_KEYWORD or
+        i + 1 == len(tokens)):
+      continue
+    start = i
+    while start > 0 and tokens[start - 1].kind == TK_CHAR:
+      start -= 1
+    if start == i:
+      continue
+    name = ''.join(token.value for token in tokens[start:i])
+    next_token = tokens[i + 1]
+    if next_token.kind == TK_CHAR:
+      # 老二, or 老 before 大, 【几】 or （几）.
+      chars = _CharsAt(tokens, i + 1)
+      after = i + 1 + len(chars)
+      is_array = _IsIndex(chars) or (
+          chars == ELDER and after < len(tokens) and
+          (tokens[after].kind == TK_IDENTIFIER or
+           tokens[after] in (Keyword(KW_GREATER), Keyword(KW_OPEN_PAREN))))
+    elif next_token.value in AGGREGATION_KEYWORD_TO_PYTHON:
+      is_array = (i + 2 == len(tokens) or tokens[i + 2].kind != TK_CHAR)
+    elif next_token.value == KW_IS_VAR:
+      is_array = True
+    elif next_token.value == KW_BECOME:
+      # Elements separated by ， outside of parentheses, or another array.
+      depth = 0
+      for j in range(i + 2, len(tokens)):
+        value = tokens[j].value
+        if tokens[j].kind != TK_KEYWORD:
+          continue
+        if value == KW_OPEN_PAREN:
+          depth += 1
+        elif value == KW_CLOSE_PAREN:
+          depth -= 1
+        elif value == KW_PERIOD or (value == KW_COMMA and not depth):
+          break
+      else:
+        continue
+      other = _CharsAt(tokens, i + 2)
+      is_array = value == KW_COMMA or (
+          other in names and j == i + 3 + len(other) and
+          tokens[j - 1] == Keyword(KW_ARRAY))
+    else:
+      is_array = False
+    if is_array:
+      names.add(name)
+  return names
+
+def _IsKeywordHere(keyword, last_token, next_token, last_chars, after_of,
+                   map_names, array_names):
+  """Returns whether keyword, which could be part of an identifier as in
+  家长, 专家, 张家口 or 我的钱, is a keyword where it is.
+
+  last_token and next_token are the basic tokens around it. last_chars is
+  the identifier right before it, if it is one, and after_of is whether
+  that is the key of a 的. map_names and array_names are what _MapNames()
+  and _ArrayNames() return.
+  """
+  if keyword == KW_ARRAY:
+    # Comes after the name of an array, as in 老李家 and 老李家老二, or
+    # after any name in 【】.
+    if last_chars is not None:
+      if last_chars not in array_names:
+        return False
+    elif last_token.kind != TK_IDENTIFIER:
+      return False
+    return next_token.kind != TK_CHAR or next_token.value == ELDER
+  # The others come after an array or a map: a name made 本账 in the
+  # program, an array with 家, a name in 【】, or what 的 looked up.
+  if last_chars is not None:
+    after_map = after_of or last_chars in map_names
+  else:
+    after_map = (last_token.kind == TK_IDENTIFIER or
+                 last_token in _EXPR_END_KEYWORDS)
+  if keyword == KW_OF:
+    # Nothing else puts a string right after a name, as in 电话的“老王”.
+    return after_map or (next_token.kind == TK_KEYWORD and
+                         next_token.value == KW_OPEN_QUOTE)
+  # Not before more of an identifier, as in 老李家一共.
+  return after_map and next_token.kind != TK_CHAR
+
+def Tokenize(code, map_names = (), array_names = ()):
+  """Yields the tokens of code.
+
+  map_names are the names that are known to be 本账 already, as in code
+  entered before, and array_names those known to be arrays (without the
+  家); the names code itself makes 本账 or arrays need not be among them.
+  """
+  basic_tokens = list(BasicTokenize(code))
+  map_names = _MapNames(basic_tokens).union(map_names)
+  array_names = _ArrayNames(basic_tokens).union(array_names)
   last_token = Token(None, None)
   chars = ''
-  for token in BasicTokenize(code):
+  chars_line = None  # Where chars starts.
+  after_of = False  # Whether chars comes right after a 的.
+  for i, token in enumerate(basic_tokens):
+    if token.value in _SOFT_KEYWORDS and token.kind == TK_KEYWORD:
+      next_token = (basic_tokens[i + 1] if i + 1 < len(basic_tokens) else
+                    Token(None, None))
+      if not _IsKeywordHere(
+          token.value, last_token, next_token,
+          chars if last_token.kind == TK_CHAR else None, after_of,
+          map_names, array_names):
+        token = Token(TK_CHAR, token.value, token.line)
     last_last_token = last_token
     last_token = token
     if token.kind == TK_CHAR:
@@ -447,23 +1046,37 @@ def Tokenize(code):
         continue
       else:
         chars = token.value
+        chars_line = token.line
+        after_of = (last_last_token.kind == TK_KEYWORD and
+                    last_last_token.value == KW_OF)
         continue
     else:
       if last_last_token.kind == TK_CHAR:
         # A sequence of consecutive TK_CHARs ended.
-        for tk in ParseChars(chars):
+        for tk in ParseChars(chars, chars_line):
           yield tk
       yield token
       chars = ''
-  for tk in ParseChars(chars):
+  for tk in ParseChars(chars, chars_line):
     yield tk
     
 vars = {}  # Maps Chinese identifier to generated identifier.
 def GetPythonVarName(var):
+  """Returns the Python name of the dongbei identifier var.
+
+  It depends on var alone, so that code translated in different processes,
+  like a program and the modules it imports, agrees on it. Identifiers that
+  Python would not take as they are, or would normalize into another one,
+  are spelled in hex.
+  """
   if var in vars:
     return vars[var]
 
-  generated_var = '_db_var%d' % (len(vars),)
+  if (unicodedata.normalize('NFKC', var) == var and
+      ('_db_var_' + var).isidentifier()):
+    generated_var = '_db_var_' + var
+  else:
+    generated_var = '_db_varx_' + var.encode('utf-8').hex()
   vars[var] = generated_var
   return generated_var
 
@@ -495,6 +1108,74 @@ def ConsumeToken(token, tokens):
              (token, tokens[0]))
   return token, tokens[1:]
 
+class TokenList:
+  """The tokens of a list from some position on.
+
+  The parser takes the first token off all the time. Slicing a list would
+  copy the rest every time, which takes quadratic time for long programs;
+  tokens[1:] here only moves the position.
+  """
+
+  __slots__ = ('_tokens', '_start')
+
+  def __init__(self, tokens, start = 0):
+    self._tokens = tokens
+    self._start = start
+
+  def __len__(self):
+    return len(self._tokens) - self._start
+
+  def __bool__(self):
+    return self._start < len(self._tokens)
+
+  def __getitem__(self, key):
+    if isinstance(key, slice):
+      assert key.stop is None and key.step is None, key
+      return TokenList(self._tokens, self._start + (key.start or 0))
+    if key < 0:
+      key += len(self)
+    if key < 0:
+      raise IndexError(key)
+    return self._tokens[self._start + key]
+
+  def __iter__(self):
+    return itertools.islice(self._tokens, self._start, None)
+
+  def __eq__(self, other):
+    return list(self) == list(other)
+
+  def __ne__(self, other):
+    return not (self == other)
+
+  def __repr__(self):
+    return repr(list(self))
+
+def _RunParser(parser):
+  """Runs a parser generator and returns its result.
+
+  A parser generator yields the parser generators whose results it needs,
+  instead of calling them, and gets the results back from the yield. They
+  wait on a list here rather than on Python's stack, so code can be nested
+  as deeply as memory allows.
+  """
+  stack = [parser]
+  result = None
+  while True:
+    try:
+      sub_parser = stack[-1].send(result)
+    except StopIteration as e:
+      stack.pop()
+      if not stack:
+        return e.value
+      result = e.value
+    else:
+      stack.append(sub_parser)
+      result = None
+
+def _ParserInput(tokens):
+  """Returns tokens as a TokenList."""
+  return tokens if isinstance(tokens, TokenList) else TokenList(list(tokens))
+
 # Expression grammar:
 #
 #   Expr ::= NonConcatExpr |
@@ -507,15 +1188,31 @@ def ConsumeToken(token, tokens):
 #   ArithmeticExpr ::= TermExpr |
 #                      ArithmeticExpr 加 TermExpr |
 #                      ArithmeticExpr 减 TermExpr
-#   TermExpr ::= AtomicExpr |
-#                TermExpr 乘 AtomicExpr |
-#                TermExpr 除以 AtomicExpr
-#   AtomicExpr ::= LiteralExpr | VariableExpr | ParenExpr | CallExpr
+#   TermExpr ::= AggregationExpr |
+#                TermExpr 乘 AggregationExpr |
+#                TermExpr 除以 AggregationExpr
+#   AggregationExpr ::= AtomicExpr |
+#                       AtomicExpr 有几口人 |
+#                       AtomicExpr 一共 |
+#                       AtomicExpr 最大的 |
+#                       AtomicExpr 最小的
+#   AtomicExpr ::= LiteralExpr | VariableExpr | ArrayVariableExpr |
+#                  IndexExpr | LookupExpr | ParenExpr | CallExpr | InputExpr
+#   InputExpr ::= 听一句 | 听个数
+#   LookupExpr ::= VariableExpr 的 KeyExpr |
+#                  LookupExpr 的 KeyExpr
+#   KeyExpr ::= LiteralExpr | VariableExpr | ParenExpr
+#   ArrayVariableExpr ::= Identifier 家
+#   IndexExpr ::= ArrayVariableExpr Index
+#   Index ::= 老大 | 老二 | ... | 老幺 | 老 Identifier | 老 ParenExpr
 #   ParenExpr ::= （ Expr ）
 #   CallExpr ::= 整 Identifier |
 #                整 Identifier（ExprList）
 #   ExprList ::= Expr |
 #                Expr，ExprList
+#
+# The parsers below are generators, run by _RunParser(), that take a
+# TokenList. ParseExpr(), ParseStmt() and ParseStmts() run them on a list.
 
 def ParseCallExpr(tokens):
   """Returns (call_expr, remaining tokens)."""
@@ -528,7 +1225,7 @@ def ParseCallExpr(tokens):
   args = []
   if open_paren:
     while True:
-      expr, tokens = ParseExpr(tokens)
+      expr, tokens = yield _ParseExpr(tokens)
       args.append(expr)
       close_paren, tokens = TryConsumeToken(
           Keyword(KW_CLOSE_PAREN), tokens)
@@ -537,6 +1234,94 @@ def ParseCallExpr(tokens):
       _, tokens = ConsumeToken(Keyword(KW_COMMA), tokens)
   return CallExpr(func, args), tokens
  
+def TryParseArrayName(id, tokens):
+  """Parses the 家 that makes id an array, as in 老李家.
+
+  Returns (the array's identifier token or None, remaining tokens).
+  """
+  array, tokens = TryConsumeToken(Keyword(KW_ARRAY), tokens)
+  if not array:
+    return None, tokens
+  return Token(TK_IDENTIFIER, id.value + KW_ARRAY, id.line), tokens
+
+def TryParseIndex(array, tokens):
+  """Parses the index after array, as in 老李家老二.
+
+  Returns (IndexExpr or None, remaining tokens).
+  """
+  if (not tokens or tokens[0].kind != TK_IDENTIFIER or
+      not tokens[0].value.startswith(ELDER)):
+    return None, tokens
+  name, tokens = tokens[0].value, tokens[1:]
+  if name == YOUNGEST:
+    return IndexExpr(array, None), tokens
+  if name != ELDER:
+    index, rest = ParseInteger(name[len(ELDER):])
+    if index is None or rest:
+      sys.exit('我不懂 %s 是老几。' % (name,))
+    literal = LiteralExpr(Token(TK_INTEGER_LITERAL, index))
+    return IndexExpr(array, literal), tokens
+
+  # 老大 is split into 老 and the keyword 大.
+  eldest, tokens = TryConsumeToken(Keyword(KW_GREATER), tokens)
+  if eldest:
+    literal = LiteralExpr(Token(TK_INTEGER_LITERAL, 1))
+    return IndexExpr(array, literal), tokens
+  var, tokens = TryConsumeTokenType(TK_IDENTIFIER, tokens)
+  if var:
+    return IndexExpr(array, VariableExpr(var)), tokens
+  open_paren, tokens = TryConsumeToken(Keyword(KW_OPEN_PAREN), tokens)
+  if open_paren:
+    expr, tokens = yield _ParseExpr(tokens)
+    _, tokens = ConsumeToken(Keyword(KW_CLOSE_PAREN), tokens)
+    return IndexExpr(array, ParenExpr(expr)), tokens
+  sys.exit('%s的老几？' % (array.value,))
+
+def ParseKeyExpr(tokens):
+  """Parses the key after 的. Returns (expr, remaining tokens)."""
+  num, tokens = TryConsumeTokenType(TK_INTEGER_LITERAL, tokens)
+  if num:
+    return LiteralExpr(num), tokens
+
+  open_quote, tokens = TryConsumeToken(Keyword(KW_OPEN_QUOTE), tokens)
+  if open_quote:
+    str, tokens = ConsumeTokenType(TK_STRING_LITERAL, tokens)
+    _, tokens = ConsumeToken(Keyword(KW_CLOSE_QUOTE), tokens)
+    return LiteralExpr(str), tokens
+
+  id, tokens = TryConsumeTokenType(TK_IDENTIFIER, tokens)
+  if id:
+    return VariableExpr(id), tokens
+
+  open_paren, tokens = ConsumeToken(Keyword(KW_OPEN_PAREN), tokens)
+  expr, tokens = yield _ParseExpr(tokens)
+  _, tokens = ConsumeToken(Keyword(KW_CLOSE_PAREN), tokens)
+  return ParenExpr(expr), tokens
+
+def ParseLookups(expr, tokens):
+  """Parses the 的 KeyExpr's after expr, if any.
+
+  Returns (expr or LookupExpr, remaining tokens).
+  """
+  while True:
+    of, tokens = TryConsumeToken(Keyword(KW_OF), tokens)
+    if not of:
+      return expr, tokens
+    key, tokens = yield ParseKeyExpr(tokens)
+    expr = LookupExpr(expr, key)
+
+def ParseAggregationExpr(tokens):
+  """Returns (expr, remaining tokens)."""
+  expr, tokens = yield ParseAtomicExpr(tokens)
+  if not expr:
+    return None, tokens
+
+  for aggregation in AGGREGATION_KEYWORD_TO_PYTHON:
+    keyword, tokens = TryConsumeToken(Keyword(aggregation), tokens)
+    if keyword:
+      return AggregationExpr(expr, keyword), tokens
+  return expr, tokens
+
 def ParseAtomicExpr(tokens):
   """Returns (expr, remaining tokens)."""
 
@@ -555,24 +1340,37 @@ def ParseAtomicExpr(tokens):
   # Do we see an identifier?
   id, tokens = TryConsumeTokenType(TK_IDENTIFIER, tokens)
   if id:
-    return VariableExpr(id), tokens
+    # Do we see an array, or one element of it?
+    array, tokens = TryParseArrayName(id, tokens)
+    if array:
+      index_expr, tokens = yield TryParseIndex(array, tokens)
+      if index_expr:
+        return index_expr, tokens
+      return VariableExpr(array), tokens
+    return (yield ParseLookups(VariableExpr(id), tokens))
 
   # Do we see a parenthesis?
   open_paren, tokens = TryConsumeToken(Keyword(KW_OPEN_PAREN), tokens)
   if open_paren:
-    expr, tokens = ParseExpr(tokens)
+    expr, tokens = yield _ParseExpr(tokens)
     _, tokens = ConsumeToken(Keyword(KW_CLOSE_PAREN), tokens)
     return ParenExpr(expr), tokens
 
   # Do we see a function call?
-  call_expr, tokens = ParseCallExpr(tokens)
+  call_expr, tokens = yield ParseCallExpr(tokens)
   if call_expr:
     return call_expr, tokens
+
+  # Do we see a read from the input?
+  for what in INPUT_KEYWORD_TO_PYTHON:
+    keyword, tokens = TryConsumeToken(Keyword(what), tokens)
+    if keyword:
+      return InputExpr(keyword), tokens
       
   return None, tokens
 
 def ParseTermExpr(tokens):
-  factor, tokens = ParseAtomicExpr(tokens)
+  factor, tokens = yield ParseAggregationExpr(tokens)
   if not factor:
     return None, tokens
 
@@ -587,7 +1385,7 @@ def ParseTermExpr(tokens):
     if not operator:
       break
 
-    factor, tokens = ParseAtomicExpr(tokens)
+    factor, tokens = yield ParseAggregationExpr(tokens)
     if factor:
       operators.append(operator)
       factors.append(factor)
@@ -603,7 +1401,7 @@ def ParseTermExpr(tokens):
   return expr, tokens
 
 def ParseArithmeticExpr(tokens):
-  term, tokens = ParseTermExpr(tokens)
+  term, tokens = yield ParseTermExpr(tokens)
   if not term:
     return None, tokens
 
@@ -618,7 +1416,7 @@ def ParseArithmeticExpr(tokens):
     if not operator:
       break
 
-    term, tokens = ParseTermExpr(tokens)
+    term, tokens = yield ParseTermExpr(tokens)
     if term:
       operators.append(operator)
       terms.append(term)
@@ -634,13 +1432,13 @@ def ParseArithmeticExpr(tokens):
   return expr, tokens
 
 def ParseNonConcatExpr(tokens):
-  arith, tokens = ParseArithmeticExpr(tokens)
+  arith, tokens = yield ParseArithmeticExpr(tokens)
   if not arith:
     return None, tokens
 
   cmp, tokens = TryConsumeToken(Keyword(KW_COMPARE), tokens)
   if cmp:
-    arith2, tokens = ParseArithmeticExpr(tokens)
+    arith2, tokens = yield ParseArithmeticExpr(tokens)
     relation, tokens = TryConsumeToken(Keyword(KW_GREATER), tokens)
     if not relation:
       relation, tokens = ConsumeToken(Keyword(KW_LESS), tokens)
@@ -648,7 +1446,7 @@ def ParseNonConcatExpr(tokens):
 
   cmp, tokens = TryConsumeToken(Keyword(KW_COMPARE_WITH), tokens)
   if cmp:
-    arith2, tokens = ParseArithmeticExpr(tokens)
+    arith2, tokens = yield ParseArithmeticExpr(tokens)
     relation, tokens = TryConsumeToken(Keyword(KW_EQUAL), tokens)
     if not relation:
       relation, tokens = ConsumeToken(Keyword(KW_NOT_EQUAL), tokens)
@@ -660,8 +1458,8 @@ def ParseNonConcatExpr(tokens):
 
   return arith, tokens
 
-def ParseExpr(tokens):
-  nc_expr, tokens = ParseNonConcatExpr(tokens)
+def _ParseExpr(tokens):
+  nc_expr, tokens = yield ParseNonConcatExpr(tokens)
   if not nc_expr:
     return None, tokens
 
@@ -672,7 +1470,7 @@ def ParseExpr(tokens):
     if not concat:
       break
 
-    nc_expr, tokens = ParseNonConcatExpr(tokens)
+    nc_expr, tokens = yield ParseNonConcatExpr(tokens)
     if nc_expr:
       nc_exprs.append(nc_expr)
     else:
@@ -684,19 +1482,37 @@ def ParseExpr(tokens):
     return nc_exprs[0], tokens
 
   return ConcatExpr(nc_exprs), tokens
-  
+
+def ParseExpr(tokens):
+  """Returns (expr, remaining tokens)."""
+  expr, tokens = _RunParser(_ParseExpr(_ParserInput(tokens)))
+  return expr, list(tokens)
+
 def ParseExprFromStr(str):
   return ParseExpr(list(Tokenize(str)))
 
+def _ParseStmt(tokens):
+  """Returns (statement, remainding_tokens)."""
+
+  stmt, remaining_tokens = yield ParseStmtWithoutLine(tokens)
+  if stmt:
+    stmt.line = tokens[0].line
+  return stmt, remaining_tokens
+
 def ParseStmt(tokens):
   """Returns (statement, remainding_tokens)."""
+  stmt, tokens = _RunParser(_ParseStmt(_ParserInput(tokens)))
+  return stmt, list(tokens)
+
+def ParseStmtWithoutLine(tokens):
+  """Returns (statement, remainding_tokens), leaving statement.line unset."""
 
   orig_tokens = tokens
 
   # Parse 开整：
   begin, tokens = TryConsumeToken(Keyword(KW_BEGIN), tokens)
   if begin:
-    stmts, tokens = ParseStmts(tokens)
+    stmts, tokens = yield _ParseStmts(tokens)
     if not stmts:
       stmts = []
     _, tokens = ConsumeToken(Keyword(KW_END), tokens)
@@ -707,19 +1523,39 @@ def ParseStmt(tokens):
   delete, tokens = TryConsumeToken(Keyword(KW_DELETE), tokens)
   if delete:
     var, tokens = ConsumeTokenType(TK_IDENTIFIER, tokens)
+    # Parse 削电话的“老王”, which takes one key out of the map.
+    lookup_expr, tokens = yield ParseLookups(VariableExpr(var), tokens)
+    if isinstance(lookup_expr, LookupExpr):
+      _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
+      return Statement(STMT_DELETE_ELEMENT, lookup_expr), tokens
+    array, tokens = TryParseArrayName(var, tokens)
+    if array:
+      var = array
+      # Parse 削老李家老三, which takes one element out of the array.
+      index_expr, tokens = yield TryParseIndex(array, tokens)
+      if index_expr:
+        _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
+        return Statement(STMT_DELETE_ELEMENT, index_expr), tokens
     _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
     return Statement(STMT_DELETE, var), tokens
 
+  # Parse 翠花，上
+  import_, tokens = TryConsumeToken(Keyword(KW_IMPORT), tokens)
+  if import_:
+    module, tokens = ConsumeTokenType(TK_IDENTIFIER, tokens)
+    _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
+    return Statement(STMT_IMPORT, module), tokens
+
   # Parse 唠唠：
   say, tokens = TryConsumeToken(Keyword(KW_SAY), tokens)
   if say:
     colon, tokens = ConsumeToken(Keyword(KW_COLON), tokens)
-    expr, tokens = ParseExpr(tokens)
+    expr, tokens = yield _ParseExpr(tokens)
     _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
     return (Statement(STMT_SAY, expr), tokens)
 
   # Parse 整
-  call_expr, tokens = ParseCallExpr(tokens)
+  call_expr, tokens = yield ParseCallExpr(tokens)
   if call_expr:
     _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
     return Statement(STMT_CALL, call_expr), tokens
@@ -727,20 +1563,20 @@ def ParseStmt(tokens):
   # Parse 滚犊子吧
   ret, tokens = TryConsumeToken(Keyword(KW_RETURN), tokens)
   if ret:
-    expr, tokens = ParseExpr(tokens)
+    expr, tokens = yield _ParseExpr(tokens)
     _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
     return (Statement(STMT_RETURN, expr), tokens)
 
   # Parse 寻思
   check, tokens = TryConsumeToken(Keyword(KW_CHECK), tokens)
   if check:
-    expr, tokens = ParseExpr(tokens)
+    expr, tokens = yield _ParseExpr(tokens)
     _, tokens = ConsumeToken(Keyword(KW_THEN), tokens)
-    then_stmt, tokens = ParseStmt(tokens)
+    then_stmt, tokens = yield _ParseStmt(tokens)
     # Parse the optional else-branch.
     kw_else, tokens = TryConsumeToken(Keyword(KW_ELSE), tokens)
     if kw_else:
-      else_stmt, tokens = ParseStmt(tokens)
+      else_stmt, tokens = yield _ParseStmt(tokens)
     else:
       else_stmt = None
     return Statement(STMT_CONDITIONAL, (expr, then_stmt, else_stmt)), tokens
@@ -752,16 +1588,58 @@ def ParseStmt(tokens):
 
   # Code below is for statements that start with an identifier.
 
+  # Parse 家, and the index after it if any.
+  array, tokens = TryParseArrayName(id, tokens)
+  if array:
+    index_expr, tokens = yield TryParseIndex(array, tokens)
+    if index_expr:
+      # The statement is about one element, which can be assigned to,
+      # incremented or decremented like a variable.
+      id = index_expr
+    else:
+      id = array
+
+      # Parse 是活雷锋, which makes an empty array.
+      is_var, tokens = TryConsumeToken(Keyword(KW_IS_VAR), tokens)
+      if is_var:
+        _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
+        return (Statement(STMT_ASSIGN, (array, ArrayExpr([]))), tokens)
+
+      # Parse 装 and the elements, separated by ，.
+      become, tokens = TryConsumeToken(Keyword(KW_BECOME), tokens)
+      if become:
+        exprs = []
+        while True:
+          expr, tokens = yield _ParseExpr(tokens)
+          exprs.append(expr)
+          comma, tokens = TryConsumeToken(Keyword(KW_COMMA), tokens)
+          if not comma:
+            break
+        _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
+        return (Statement(STMT_ASSIGN, (array, ArrayExpr(exprs))), tokens)
+
+  else:
+    # Parse 的, which makes the statement about the value of a key.
+    lookup_expr, tokens = yield ParseLookups(VariableExpr(id), tokens)
+    if isinstance(lookup_expr, LookupExpr):
+      id = lookup_expr
+
   # Parse 是活雷锋
   is_var, tokens = TryConsumeToken(Keyword(KW_IS_VAR), tokens)
   if is_var:
     _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
     return (Statement(STMT_VAR_DECL, id), tokens)
 
+  # Parse 是本账
+  is_map, tokens = TryConsumeToken(Keyword(KW_IS_MAP), tokens)
+  if is_map:
+    _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
+    return (Statement(STMT_ASSIGN, (id, MapExpr())), tokens)
+
   # Parse 装
   become, tokens = TryConsumeToken(Keyword(KW_BECOME), tokens)
   if become:
-    expr, tokens = ParseExpr(tokens)
+    expr, tokens = yield _ParseExpr(tokens)
     _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
     return (Statement(STMT_ASSIGN, (id, expr)), tokens)
 
@@ -777,7 +1655,7 @@ def ParseStmt(tokens):
   inc, tokens = TryConsumeToken(
       Keyword(KW_INC_BY), tokens)
   if inc:
-    expr, tokens = ParseExpr(tokens)
+    expr, tokens = yield _ParseExpr(tokens)
     _, tokens = ConsumeToken(Keyword(KW_STEP), tokens)
     _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
     return (Statement(STMT_INC_BY, (id, expr)), tokens)
@@ -794,7 +1672,7 @@ def ParseStmt(tokens):
   dec, tokens = TryConsumeToken(
       Keyword(KW_DEC_BY), tokens)
   if dec:
-    expr, tokens = ParseExpr(tokens)
+    expr, tokens = yield _ParseExpr(tokens)
     _, tokens = ConsumeToken(Keyword(KW_STEP), tokens)
     _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
     return (Statement(STMT_DEC_BY, (id, expr)), tokens)
@@ -802,15 +1680,46 @@ def ParseStmt(tokens):
   # Parse 磨叽
   from_, tokens = TryConsumeToken(Keyword(KW_FROM), tokens)
   if from_:
-    from_expr, tokens = ParseExpr(tokens)
+    from_expr, tokens = yield _ParseExpr(tokens)
+    # Parse 挨个儿磨叽, which goes through the keys of a map or the
+    # elements of an array.
+    foreach, tokens = TryConsumeToken(Keyword(KW_FOREACH), tokens)
+    if foreach:
+      stmts, tokens = yield _ParseStmts(tokens)
+      _, tokens = ConsumeToken(Keyword(KW_END_LOOP), tokens)
+      _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
+      return (Statement(STMT_FOREACH, (id, from_expr, stmts)), tokens)
+    # Parse 挨句听磨叽, which goes through the lines of a file.
+    foreach, tokens = TryConsumeToken(Keyword(KW_FOREACH_LINE), tokens)
+    if foreach:
+      stmts, tokens = yield _ParseStmts(tokens)
+      _, tokens = ConsumeToken(Keyword(KW_END_LOOP), tokens)
+      _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
+      return (Statement(STMT_FOREACH, (id, LinesExpr(from_expr), stmts)),
+              tokens)
     _, tokens = ConsumeToken(Keyword(KW_TO), tokens)
-    to_expr, tokens = ParseExpr(tokens)
-    _, tokens = ConsumeToken(Keyword(KW_LOOP), tokens)
-    stmts, tokens = ParseStmts(tokens)
+    to_expr, tokens = yield _ParseExpr(tokens)
+    # Parse 一块堆儿磨叽, whose iterations run at the same time.
+    parallel, tokens = TryConsumeToken(Keyword(KW_PARALLEL_LOOP), tokens)
+    if not parallel:
+      _, tokens = ConsumeToken(Keyword(KW_LOOP), tokens)
+    stmts, tokens = yield _ParseStmts(tokens)
     _, tokens = ConsumeToken(Keyword(KW_END_LOOP), tokens)
     _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
+    if parallel:
+      CheckParallelLoop(stmts)
+      return (Statement(STMT_PARALLEL_LOOP,
+                        (id, from_expr, to_expr, stmts)), tokens)
     return (Statement(STMT_LOOP, (id, from_expr, to_expr, stmts)), tokens)
 
+  # Parse 挨句听磨叽 without 从, which goes through the lines of the input.
+  foreach, tokens = TryConsumeToken(Keyword(KW_FOREACH_LINE), tokens)
+  if foreach:
+    stmts, tokens = yield _ParseStmts(tokens)
+    _, tokens = ConsumeToken(Keyword(KW_END_LOOP), tokens)
+    _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
+    return (Statement(STMT_FOREACH, (id, LinesExpr(None), stmts)), tokens)
+
   # Parse 咋整
   open_paren, tokens = TryConsumeToken(
       Keyword(KW_OPEN_PAREN), tokens)
@@ -826,160 +1735,1314 @@ def ParseStmt(tokens):
         
     func_def, tokens = ConsumeToken(
         Keyword(KW_FUNC_DEF), tokens)
-    stmts, tokens = ParseStmts(tokens)
-    _, tokens = ConsumeToken(Keyword(KW_END), tokens)
-    _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
-    return (Statement(STMT_FUNC_DEF, (id, params, stmts)), tokens)
+    return (yield ParseFuncBody(id, params, tokens))
 
   func_def, tokens = TryConsumeToken(
       Keyword(KW_FUNC_DEF), tokens)
   if func_def:
-    stmts, tokens = ParseStmts(tokens)
-    _, tokens = ConsumeToken(Keyword(KW_END), tokens)
-    _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
-    return (Statement(STMT_FUNC_DEF, (id, [], stmts)), tokens)
+    return (yield ParseFuncBody(id, [], tokens))
 
   return (None, orig_tokens)
 
+def ParseFuncBody(func, params, tokens):
+  """Returns (function definition, remaining tokens), given the function
+  and its parameters, with tokens starting after 咋整：.
+  """
+  body, tokens = TryConsumeTokenType(TK_FUNC_BODY, tokens)
+  if body:
+    stmt = Statement(STMT_LAZY_FUNC_DEF, (func, params, body.value))
+  else:
+    stmts, tokens = yield _ParseStmts(tokens)
+    stmt = Statement(STMT_FUNC_DEF, (func, params, stmts))
+  _, tokens = ConsumeToken(Keyword(KW_END), tokens)
+  _, tokens = ConsumeToken(Keyword(KW_PERIOD), tokens)
+  return (stmt, tokens)
+
 def ParseStmtFromStr(tokens):
   return ParseStmt(list(Tokenize(tokens)))
 
-def ParseStmts(tokens):
+def _ParseStmts(tokens):
   """Returns (statement list, remaining tokens)."""
 
   stmts = []
   while True:
-    stmt, tokens = ParseStmt(tokens)
+    stmt, tokens = yield _ParseStmt(tokens)
     if not stmt:
       return stmts, tokens
     stmts.append(stmt)
 
-def TranslateStatementToPython(stmt, indent = ''):
-  """Translates the statements to Python code, without trailing newline."""
-  
-  if stmt.kind == STMT_VAR_DECL:
-    var_token = stmt.value
-    var = GetPythonVarName(var_token.value)
-    return indent + '%s = None' % (var,)
-
-  if stmt.kind == STMT_ASSIGN:
-    var_token, expr = stmt.value
-    var = GetPythonVarName(var_token.value)
-    return indent + '%s = %s' % (var, expr.ToPython())
-
-  if stmt.kind == STMT_SAY:
-    expr = stmt.value
-    return indent + '_db_append_output("%%s\\n" %% (_dongbei_str(%s),))' % (
-        expr.ToPython(),)
-
-  if stmt.kind == STMT_INC_BY:
-    var_token, expr = stmt.value
-    var = GetPythonVarName(var_token.value)
-    return indent + f'{var} += {expr.ToPython()}'
-
-  if stmt.kind == STMT_DEC_BY:
-    var_token, expr = stmt.value
-    var = GetPythonVarName(var_token.value)
-    return indent + '%s -= %s' % (var, expr.ToPython())
-
-  if stmt.kind == STMT_LOOP:
-    var_token, from_val, to_val, stmts = stmt.value
-    var = GetPythonVarName(var_token.value)
-    loop = indent + 'for %s in range(%s, %s + 1):' % (
-        var, from_val.ToPython(),
-        to_val.ToPython())
-    for s in stmts:
-      loop += '\n' + TranslateStatementToPython(s, indent + '  ')
-    if not stmts:
-      loop += '\n' + indent + '  pass'
-    return loop
+def ParseStmts(tokens):
+  """Returns (statement list, remaining tokens)."""
+  stmts, tokens = _RunParser(_ParseStmts(_ParserInput(tokens)))
+  return stmts, list(tokens)
+
+def DeferFunctionBodies(tokens):
+  """Returns the tokens with the body of each function defined outside
+  other functions replaced by a TK_FUNC_BODY token, whose value is the list
+  of the tokens of the body. The parser then makes a STMT_LAZY_FUNC_DEF.
+
+  A body without its 整完了 is left alone, for the parser to complain about.
+  """
+  # Find the 整完了 of each 咋整： and 开整：.
+  ends = {}
+  opened = []
+  for i, token in enumerate(tokens):
+    if token.kind != TK_KEYWORD:
+      continue
+    if token.value in (KW_FUNC_DEF, KW_BEGIN):
+      opened.append(i)
+    elif token.value == KW_END and opened:
+      ends[opened.pop()] = i
+
+  result = []
+  i = 0
+  while i < len(tokens):
+    token = tokens[i]
+    result.append(token)
+    if i in ends and token.value == KW_FUNC_DEF:
+      result.append(Token(TK_FUNC_BODY, tokens[i + 1:ends[i]], token.line))
+      i = ends[i]
+    else:
+      i += 1
+  return result
+
+def _IsStringAppend(stmt):
+  """Tells whether stmt is like 结果装结果、…。"""
+  if stmt.kind != STMT_ASSIGN:
+    return False
+  target, expr = stmt.value
+  return (isinstance(target, Token) and isinstance(expr, ConcatExpr) and
+          expr.exprs[0] == VariableExpr(target))
+
+def FindStringBuilders(loop_var, stmts):
+  """Returns the names of the variables that a loop only adds strings to.
+
+  stmts is the body of the loop. A variable qualifies if every statement
+  in the body that mentions it is like 结果装结果、…。 and mentions it only
+  at the start. There must also be no function calls or definitions in the
+  body, as functions may see the variable too, and no imports, as a
+  module may set it.
+  """
+  candidates = set()
+  others = set()  # Names mentioned any other way.
+  for stmt in WalkStatements(stmts):
+    targets, exprs, _ = StatementParts(stmt)
+    if stmt.kind in (STMT_FUNC_DEF, STMT_IMPORT):
+      return set()
+    if any(isinstance(e, CallExpr) for expr in exprs for e in WalkExpr(expr)):
+      return set()
+    if _IsStringAppend(stmt):
+      candidates.add(targets[0].value)
+      exprs = exprs[0].exprs[1:]
+    else:
+      others.update(TargetVarName(target) for target in targets)
+      for target in targets:
+        if not isinstance(target, Token):
+          others.update(ExprVarNames(target))
+    for expr in exprs:
+      others.update(ExprVarNames(expr))
+  return candidates - others - {loop_var.value}
+
+# Functions that only return an expression of at most this many parts are
+# inlined where they are called.
+_MAX_INLINE_SIZE = 16
+
+# The functions inlined in the code being translated, as returned by
+# FindInlineFunctions().
+_inline_functions = {}
+
+# Whether the code being translated is in a function, where calls are
+# inlined. Outside functions, Python looks up every variable by name, so
+# reading the arguments in the inlined body costs about as much as the call
+# saves.
+_inlining = False
+
+def FindInlineFunctions(statements):
+  """Returns the functions in statements to inline where they are called.
+
+  A function qualifies if it is defined once, outside other functions, and
+  nothing else in statements sets its name. Its body must be just
+  滚犊子吧 of an expression of its parameters, with no more than
+  _MAX_INLINE_SIZE parts and no calls, arrays or input. The expression
+  must use every parameter, or an argument would not be evaluated at all.
+
+  The result maps the function name to (parameter names, expression,
+  marker). marker is the Python variable that gets the function when it is
+  defined. Where it is called, the function is inlined only if it is still
+  the one in marker, which is the same for the same definition anywhere.
+  """
+  target_counts = {}
+  for stmt in WalkStatements(statements):
+    for target in StatementParts(stmt)[0]:
+      name = TargetVarName(target)
+      target_counts[name] = target_counts.get(name, 0) + 1
+
+  functions = {}
+  stack = list(statements)  # Statements outside functions.
+  while stack:
+    stmt = stack.pop()
+    if stmt.kind != STMT_FUNC_DEF:
+      stack.extend(StatementParts(stmt)[2])
+      continue
+    func, params, stmts = stmt.value
+    if (target_counts[func.value] != 1 or len(stmts) != 1 or
+        stmts[0].kind != STMT_RETURN):
+      continue
+    expr = stmts[0].value
+    param_names = [param.value for param in params]
+    parts = list(WalkExpr(expr))
+    if (len(parts) <= _MAX_INLINE_SIZE and
+        not any(isinstance(e, (CallExpr, IndexExpr, InputExpr, LinesExpr))
+                for e in parts) and
+        set(ExprVarNames(expr)) == set(param_names)):
+      functions[func.value] = (param_names, expr, '_db_inline_' +
+                               hashlib.sha1(str(stmt).encode('utf-8'))
+                               .hexdigest()[:12])
+  return functions
+
+def FindClosedForm(loop_var, stmts):
+  """Returns what a 磨叽 does in closed form, or None if it can't.
+
+  stmts is the body of the loop. It qualifies if it only has 走走, 退退,
+  走X步 and 退X步 on variables other than loop_var, where X is an integer,
+  the loop variable, or a variable that the body does not change. The
+  result is a list of (variable token, operator, amount) in the order of
+  the body, where operator is '+=' or '-=' and amount is X, or None for the
+  loop variable.
+  """
+  if not stmts:
+    return None
+  changes = []
+  for stmt in stmts:
+    if stmt.kind not in (STMT_INC_BY, STMT_DEC_BY):
+      return None
+    target, amount = stmt.value
+    if not isinstance(target, Token) or target.value == loop_var.value:
+      return None
+    if isinstance(amount, VariableExpr) and amount.var == loop_var:
+      amount = None
+    elif not (isinstance(amount, VariableExpr) or
+              isinstance(amount, LiteralExpr) and
+              amount.token.kind == TK_INTEGER_LITERAL):
+      return None
+    changes.append((target, '+=' if stmt.kind == STMT_INC_BY else '-=',
+                    amount))
+  changed = {target.value for target, _, _ in changes}
+  if any(isinstance(amount, VariableExpr) and amount.var.value in changed
+         for _, _, amount in changes):
+    return None
+  return changes
+
+# The expressions that are computed once into a temporary when they repeat.
+_COMMON_SUBEXPR_TYPES = (ArithmeticExpr, ComparisonExpr, ConcatExpr)
+
+def _EvaluatedExprs(stmt, exprs):
+  """Returns the expressions that the translation of stmt, whose
+  expressions are exprs, evaluates, in order.
+  """
+  if stmt.kind == STMT_SAY and isinstance(stmt.value, ConcatExpr):
+    return stmt.value.exprs  # Each part is formatted into the output.
+  if _IsStringAppend(stmt):
+    return stmt.value[1].exprs[1:]  # The string may be built in a list.
+  return exprs
+
+def FindCommonSubexprs(stmts):
+  """Finds the arithmetic, comparisons and concatenations that stmts, a
+  block, computes more than once with the same values.
+
+  Only expressions of variables and literals count. They are the same as
+  long as none of their variables is assigned to, and nothing runs that may
+  change anything, including what other variables hold: a function call, a
+  statement with a body, an import, or a change to an array or a map in
+  place. Statements that call functions or are too deep for Python are
+  left alone.
+
+  Returns (the number of such expressions, and a list with for each
+  statement (definitions, uses)). definitions are the (number, expression)
+  to compute before the statement, each after those it uses. uses maps the
+  id of each expression in the statement that is computed already to its
+  number.
+  """
+  numbers = {}  # Maps the key of an expression to its number.
+  expr_numbers = {}  # Maps the id of an expression to its number.
+  counts = {}
+  versions = {}  # How many times each variable has been assigned to.
+  epoch = 0  # How many times anything may have changed.
+  evaluated = []
+  for stmt in stmts:
+    targets, exprs, body = StatementParts(stmt)
+    roots = _EvaluatedExprs(stmt, exprs)
+    # Number the expressions, children first, so that expressions with the
+    # same key have the same value.
+    found = []  # The numbers of the expressions that may be common.
+    has_call = too_deep = False
+    walked = []  # Each expression with its children, before them.
+    stack = [(root, 1) for root in roots]
+    while stack:
+      e, depth = stack.pop()
+      children = e.Children()
+      walked.append((e, children))
+      if children:
+        too_deep = too_deep or depth >= _MAX_EXPR_DEPTH
+        stack.extend((child, depth + 1) for child in children)
+    for e, children in reversed(walked):
+      if isinstance(e, CallExpr):
+        has_call = True
+        continue
+      child_numbers = [expr_numbers.get(id(child)) for child in children]
+      if None in child_numbers:
+        continue
+      if isinstance(e, ParenExpr):
+        expr_numbers[id(e)] = child_numbers[0]
+        continue
+      if isinstance(e, VariableExpr):
+        key = (e.var.value, epoch, versions.get(e.var.value, 0))
+      elif isinstance(e, LiteralExpr):
+        key = (e.token.kind, e.token.value)
+      elif isinstance(e, ArithmeticExpr):
+        key = (e.operation.value,) + tuple(child_numbers)
+      elif isinstance(e, ComparisonExpr):
+        key = (e.relation.value,) + tuple(child_numbers)
+      elif isinstance(e, ConcatExpr):
+        key = ('、',) + tuple(child_numbers)
+      else:
+        continue  # May have a different value each time.
+      number = expr_numbers[id(e)] = numbers.setdefault(key, len(numbers))
+      if isinstance(e, _COMMON_SUBEXPR_TYPES):
+        found.append(number)
+    if has_call or too_deep:
+      roots = []
+    else:
+      for number in found:
+        counts[number] = counts.get(number, 0) + 1
+    evaluated.append(roots)
+    if (has_call or body and stmt.kind != STMT_FUNC_DEF or
+        stmt.kind in (STMT_IMPORT, STMT_DELETE_ELEMENT) or
+        stmt.kind == STMT_ASSIGN and isinstance(exprs[0], ArrayExpr) or
+        not all(isinstance(target, Token) for target in targets)):
+      epoch += 1
+    else:
+      for target in targets:
+        versions[target.value] = versions.get(target.value, 0) + 1
 
-  if stmt.kind == STMT_FUNC_DEF:
-    func_token, params, stmts = stmt.value
-    func_name = GetPythonVarName(func_token.value)
-    param_names = map(lambda tk: GetPythonVarName(tk.value), params)
-    code = indent + 'def %s(%s):' % (func_name, ', '.join(param_names))
-    for s in stmts:
-      code += '\n' + TranslateStatementToPython(s, indent + '  ')
-    if not stmts:
-      code += '\n' + indent + '  pass'
-    return code
+  common = {number for number, count in counts.items() if count > 1}
+  if not common:
+    return 0, []
+  while True:
+    # Where an expression is in another common one, it is computed only
+    # the first time, for the definition of the other one.
+    result = []
+    defined = {}  # Maps a common expression number to its final number.
+    use_counts = {}
+    for roots in evaluated:
+      definitions = []
+      uses = {}
+      stack = [(root, False) for root in reversed(roots)]
+      while stack:
+        e, children_done = stack.pop()
+        number = expr_numbers.get(id(e))
+        if children_done:
+          definitions.append((defined[number], e))
+          continue
+        if number in common and isinstance(e, _COMMON_SUBEXPR_TYPES):
+          use_counts[number] = use_counts.get(number, 0) + 1
+          if number in defined:
+            uses[id(e)] = defined[number]
+            continue
+          defined[number] = len(defined)
+          uses[id(e)] = defined[number]
+          stack.append((e, True))
+        stack.extend((child, False) for child in reversed(e.Children()))
+      result.append((definitions, uses))
+    unused = {number for number in common
+              if use_counts.get(number, 0) < 2}
+    if not unused:
+      return len(defined), result
+    common -= unused
+
+def TargetToPython(target, temps = None):
+  """Translates what a statement assigns to: a variable, an IndexExpr or a
+  LookupExpr. temps is as in ExprToPython().
+  """
+  if isinstance(target, IndexExpr):
+    return target.PythonFromParts(
+        [ExprToPython(child, temps) for child in target.Children()])
+  if isinstance(target, LookupExpr):
+    return target.PythonTargetFromParts(
+        [ExprToPython(child, temps) for child in target.Children()])
+  return GetPythonVarName(target.value)
+
+def _NeedsTemps(stmt):
+  """Tells whether stmt has expressions too deep for Python."""
+  targets, exprs, _ = StatementParts(stmt)
+  return any(ExprDepth(expr) > _MAX_EXPR_DEPTH
+             for expr in exprs + [t for t in targets if isinstance(t, Expr)])
+
+# Python cannot indent much more than 100 levels, and each elif nests one
+# level deeper inside Python's compiler, which cannot go much deeper than
+# 2000. Conditionals nested deeper than these are translated into flags
+# (_db_guardN) instead of blocks, keeping the rest of them at this level.
+_MAX_BLOCK_DEPTH = 50
+_MAX_NESTING = 500
+
+class _StatementTranslator:
+  """Translates one statement to Python lines.
+
+  The statements in it wait on a stack instead of Python's, so they can be
+  nested as deeply as memory allows. Lines are collected in a list and
+  joined once.
+  """
+
+  def __init__(self, budget, counted):
+    self.budget = budget
+    self.counted = counted
+    self.lines = []
+    self.guard_count = 0
+    self.common_count = 0
+    # Maps the id of a statement to the common expressions to compute
+    # before it, and those it uses, as in FindCommonSubexprs(), but with
+    # the temporaries that hold them.
+    self.common = {}
+    # Items waiting to be translated, the next one last. Each is a method
+    # and its arguments.
+    self.stack = []
+    # The number of lines when each block that is still open started.
+    self.block_starts = []
+
+  def Translate(self, stmts, depth):
+    """Returns the Python code of stmts, a block at the given indent level.
+    """
+    self.Push(*self.Statements(stmts, depth, depth, None, {}))
+    while self.stack:
+      method, *args = self.stack.pop()
+      method(*args)
+    return '\n'.join(self.lines)
+
+  def Push(self, *items):
+    """Translates the items next, in the given order."""
+    self.stack.extend(reversed(items))
+
+  def Line(self, line):
+    self.lines.append(line)
+
+  def OpenBlock(self, line):
+    """Adds line, which starts a block, like if ...:."""
+    self.lines.append(line)
+    self.block_starts.append(len(self.lines))
+
+  def CloseBlock(self, indent):
+    """Ends the last block, adding pass if it is empty."""
+    if len(self.lines) == self.block_starts.pop():
+      self.lines.append(indent + 'pass')
+
+  def Statements(self, stmts, depth, nesting, guard, builders):
+    """Returns the items that translate stmts, a block, computing each
+    expression that it repeats only once.
+    """
+    count, common = FindCommonSubexprs(stmts)
+    names = ['_db_common%d' % (self.common_count + i,) for i in range(count)]
+    self.common_count += count
+    for stmt, (definitions, uses) in zip(stmts, common):
+      if uses:
+        self.common[id(stmt)] = (
+            [(names[number], e) for number, e in definitions],
+            {key: names[number] for key, number in uses.items()})
+    return [(self.Statement, s, depth, nesting, guard, builders)
+            for s in stmts]
+
+  def Block(self, header, stmts, depth, nesting, builders,
+            first_lines = ()):
+    """Returns the items that translate header and the block of stmts under
+    it. first_lines come first in the block.
+    """
+    indent = '  ' * (depth + 1)
+    return ([(self.OpenBlock, '  ' * depth + header)] +
+            [(self.Line, indent + line) for line in first_lines] +
+            self.Statements(stmts, depth + 1, nesting + 1, None, builders) +
+            [(self.CloseBlock, indent)])
+
+  def Inlining(self, enabled):
+    """Sets whether calls are inlined in the code translated next."""
+    global _inlining
+    _inlining = enabled
+
+  def Guarded(self, guard, lines, depth):
+    """Adds the lines, to run only if guard (which may be None) is true."""
+    indent = '  ' * depth
+    if guard is None:
+      self.lines.extend(indent + line for line in lines)
+    elif lines:
+      self.lines.append(indent + 'if %s:' % (guard,))
+      self.lines.extend(indent + '  ' + line for line in lines)
+
+  def Statement(self, stmt, depth, nesting, guard, builders):
+    """Translates stmt at the given indent level, in nesting levels of
+    Python statements.
+
+    If guard is not None, stmt runs only if the Python variable guard is
+    true. builders maps the variables built by enclosing loops to their
+    builders.
+    """
+    if guard is not None and stmt.kind not in (STMT_COMPOUND,
+                                               STMT_CONDITIONAL):
+      self.Push((self.OpenBlock, '  ' * depth + 'if %s:' % (guard,)),
+                (self.Statement, stmt, depth + 1, nesting + 1, None,
+                 builders),
+                (self.CloseBlock, '  ' * (depth + 1)))
+      return
+    if self.counted is not None:
+      self.Guarded(guard, ['_db_counts[%d] += 1' % (len(self.counted),)],
+                   depth)
+      self.counted.append(stmt)
+    temps = [] if _NeedsTemps(stmt) else None
+    definitions, common = self.common.pop(id(stmt), ((), None))
+    # Compute the expressions repeated in the block the first time.
+    before = [
+        '%s = %s' % (name, e.PythonFromParts(
+            [ExprToPython(child, common=common) for child in e.Children()]))
+        for name, e in definitions]
+    # Translate the expressions in the order Python evaluates them, so
+    # that the temporaries are assigned in that order too.
+    def Py(expr):
+      return ExprToPython(expr, temps, common=common)
+    def Target(target):
+      return TargetToPython(target, temps)
+    indent = '  ' * depth
+
+    if stmt.kind == STMT_COMPOUND:
+      self.Push(*self.Statements(stmt.value, depth, nesting, guard,
+                                 builders))
+      return
 
-  if stmt.kind == STMT_CALL:
-    func_token = stmt.value.func
-    args = stmt.value.args
-    func_name = GetPythonVarName(func_token.value)
-    code = indent + '%s(%s)' % (func_name,
-                                ', '.join(arg.ToPython() for arg in args))
-    return code
+    if stmt.kind == STMT_CONDITIONAL:
+      condition, then_stmt, else_stmt = stmt.value
+      condition = Py(condition)
+      self.Guarded(guard, before + (temps or []), depth)
+      if (guard is None and depth < _MAX_BLOCK_DEPTH and
+          nesting < _MAX_NESTING):
+        self.Push(*self.Conditional('if', condition, then_stmt, else_stmt,
+                                    depth, nesting, builders))
+        return
+      # Too deep for another block: run each branch under a flag.
+      self.guard_count += 1
+      then_guard = '_db_guard%d' % (self.guard_count,)
+      if guard is None:
+        self.Line(indent + '%s = bool(%s)' % (then_guard, condition))
+      else:
+        self.Line(indent + '%s = %s and bool(%s)' % (
+            then_guard, guard, condition))
+      items = [(self.Statement, then_stmt, depth, nesting, then_guard,
+                builders)]
+      if else_stmt:
+        self.guard_count += 1
+        else_guard = '_db_guard%d' % (self.guard_count,)
+        items.append((self.Line, indent + '%s = %snot %s' % (
+            else_guard, '' if guard is None else guard + ' and ',
+            then_guard)))
+        items.append((self.Statement, else_stmt, depth, nesting, else_guard,
+                      builders))
+      self.Push(*items)
+      return
 
-  if stmt.kind == STMT_RETURN:
-    return indent + 'return ' + stmt.value.ToPython()
+    if stmt.kind in (STMT_LOOP, STMT_FOREACH):
+      if stmt.kind == STMT_LOOP:
+        var_token, from_val, to_val, stmts = stmt.value
+        var = GetPythonVarName(var_token.value)
+        items = 'range(%s, %s + 1)' % (Py(from_val), Py(to_val))
+        # Every iteration counts towards the budget and the counters, so
+        # only skip them if there are none.
+        changes = (None if self.budget or self.counted is not None or
+                   depth + 1 >= _MAX_BLOCK_DEPTH or
+                   nesting + 1 >= _MAX_NESTING else
+                   FindClosedForm(var_token, stmts))
+        if changes:
+          self.Guarded(None, before + (temps or []), depth)
+          self.Push(*self.ClosedFormLoop(var_token, items, stmts, changes,
+                                         depth, nesting, builders))
+          return
+        header = 'for %s in %s:' % (var, items)
+      else:
+        var_token, container, stmts = stmt.value
+        var = GetPythonVarName(var_token.value)
+        if isinstance(container, LinesExpr):
+          # Read the lines one at a time, however many there are.
+          header = 'for %s in %s:' % (var, Py(container))
+        else:
+          # Go through a copy, so that the body may change the container.
+          header = 'for %s in list(%s):' % (var, Py(container))
+      self.Guarded(None, before + (temps or []), depth)
+      self.Push(*self.Loop(header, var_token, stmts, depth, nesting,
+                           builders))
+      return
 
-  if stmt.kind == STMT_COMPOUND:
-    code = indent + 'if True:'
-    stmts = stmt.value
-    if stmts:
-      for s in stmts:
-        code += '\n' + TranslateStatementToPython(s, indent + '  ')
+    if stmt.kind == STMT_PARALLEL_LOOP:
+      var_token, from_val, to_val, stmts = stmt.value
+      var = GetPythonVarName(var_token.value)
+      items = 'range(%s, %s + 1)' % (Py(from_val), Py(to_val))
+      self.Guarded(None, before + (temps or []), depth)
+      # The body becomes a function that worker processes call with each
+      # value of the variable. Looping over what _db_parallel() returns
+      # leaves the variable as 磨叽 does.
+      first_lines = ['_db_check_budget()'] if self.budget else []
+      self.Push((self.Inlining, True),
+                *self.Block('def _db_parallel_body(%s):' % (var,), stmts,
+                            depth, nesting, {}, first_lines),
+                (self.Inlining, _inlining),
+                (self.Line, indent + 'for %s in _db_parallel('
+                 '_db_parallel_body, %s):' % (var, items)),
+                (self.Line, indent + '  pass'))
+      return
+
+    if stmt.kind == STMT_FUNC_DEF:
+      func_token, params, stmts = stmt.value
+      header = 'def %s(%s):' % (
+          GetPythonVarName(func_token.value),
+          ', '.join(GetPythonVarName(tk.value) for tk in params))
+      # The function entry.
+      first_lines = ['_db_check_budget()'] if self.budget else []
+      items = ([(self.Inlining, True)] +
+               self.Block(header, stmts, depth, nesting, {}, first_lines) +
+               [(self.Inlining, _inlining)])
+      inline = _inline_functions.get(func_token.value)
+      if inline:
+        items.append((self.Line, indent + '%s = %s' % (
+            inline[2], GetPythonVarName(func_token.value))))
+      self.Push(*items)
+      return
+
+    if stmt.kind == STMT_VAR_DECL:
+      code = '%s = None' % (Target(stmt.value),)
+    elif stmt.kind == STMT_ASSIGN:
+      var_token, expr = stmt.value
+      if _IsStringAppend(stmt) and var_token.value in builders:
+        parts = [_StrToPython(e, Py(e)) for e in expr.exprs[1:]]
+        builder = builders[var_token.value]
+        # The builder starts with the variable the first time it is added
+        # to, which fails as usual if the variable was never set.
+        code = '%s = %s or [_dongbei_str(%s)]; ' % (
+            builder, builder, GetPythonVarName(var_token.value))
+        if len(parts) == 1:
+          code += '%s.append(%s)' % (builder, parts[0])
+        else:
+          code += '%s.extend((%s))' % (builder, ', '.join(parts))
+      elif (isinstance(expr, ArrayExpr) and len(expr.exprs) > 1 and
+            expr.exprs[0] == VariableExpr(var_token)):
+        # 老李家装老李家，五。 adds to the array in place, in amortized
+        # constant time per element.
+        code = '%s.Extend(%s)' % (
+            Target(var_token), ', '.join(Py(e) for e in expr.exprs[1:]))
+      else:
+        value = Py(expr)
+        code = '%s = %s' % (Target(var_token), value)
+    elif stmt.kind == STMT_SAY:
+      expr = stmt.value
+      if isinstance(expr, ConcatExpr):
+        # Format the parts and the newline into the output in one go,
+        # instead of adding them up one by one first.
+        code = '_db_append_output("%s\\n" %% (%s,))' % (
+            '%s' * len(expr.exprs),
+            ', '.join(_StrToPython(e, Py(e)) for e in expr.exprs))
+      else:
+        code = '_db_append_output("%%s\\n" %% (%s,))' % (
+            _StrToPython(expr, Py(expr)),)
+    elif stmt.kind == STMT_INC_BY:
+      var_token, expr = stmt.value
+      var = Target(var_token)
+      code = f'{var} += {Py(expr)}'
+    elif stmt.kind == STMT_DEC_BY:
+      var_token, expr = stmt.value
+      var = Target(var_token)
+      code = '%s -= %s' % (var, Py(expr))
+    elif stmt.kind == STMT_LAZY_FUNC_DEF:
+      # A stand-in that translates the function when it is first called.
+      # The function is kept in the code, so that it goes away with it.
+      code = '%s = _db_lazy(%r, globals(), %s)' % (
+          GetPythonVarName(stmt.value[0].value), _LazyFunctionToJson(stmt),
+          self.budget)
+    elif stmt.kind == STMT_IMPORT:
+      # Loads the module when the statement runs, not when translating.
+      code = '_db_import(u"%s", globals(), %s)' % (
+          stmt.value.value, self.budget)
+    elif stmt.kind == STMT_CALL:
+      func_token = stmt.value.func
+      args = stmt.value.args
+      code = '%s(%s)' % (GetPythonVarName(func_token.value),
+                         ', '.join(Py(arg) for arg in args))
+    elif stmt.kind == STMT_RETURN:
+      code = 'return ' + Py(stmt.value)
+    elif stmt.kind == STMT_DELETE:
+      code = GetPythonVarName(stmt.value.value) + ' = None'
+    elif stmt.kind == STMT_DELETE_ELEMENT:
+      if isinstance(stmt.value, LookupExpr):
+        # Taking out a missing key is fine.
+        code = '%s.pop(%s, None)' % (Py(stmt.value.map), Py(stmt.value.key))
+      else:
+        code = 'del ' + Target(stmt.value)
     else:
-      code += '\n' + indent + '  pass'
-    return code
+      sys.exit('我不懂 %s 语句咋执行。' % (stmt.kind))
+    self.Guarded(None, before + (temps or []) + [code], depth)
+
+  def Conditional(self, keyword, condition, then_stmt, else_stmt, depth,
+                  nesting, builders):
+    """Returns the items that translate a conditional, starting with the
+    keyword if or elif.
+    """
+    items = self.Block('%s %s:' % (keyword, condition), [then_stmt], depth,
+                       nesting, builders)
+    if not else_stmt:
+      return items
+    if (else_stmt.kind == STMT_CONDITIONAL and self.counted is None and
+        nesting + 1 < _MAX_NESTING and not _NeedsTemps(else_stmt)):
+      # 要不行咧就寻思 continues the chain without indenting.
+      items.append((self.ElseIf, else_stmt, depth, nesting + 1, builders))
+    else:
+      items += self.Block('else:', [else_stmt], depth, nesting, builders)
+    return items
 
-  if stmt.kind == STMT_CONDITIONAL:
+  def ElseIf(self, stmt, depth, nesting, builders):
     condition, then_stmt, else_stmt = stmt.value
-    code = indent + 'if %s:\n' % (condition.ToPython(),)
-    code += TranslateStatementToPython(then_stmt, indent + '  ')
-    if else_stmt:
-      code += '\n' + indent + 'else:\n'
-      code += TranslateStatementToPython(else_stmt, indent + '  ')
-    return code
-
-  if stmt.kind == STMT_DELETE:
-    return indent + GetPythonVarName(stmt.value.value) + ' = None'
-    
-  sys.exit('我不懂 %s 语句咋执行。' % (stmt.kind))
-  
-def TranslateTokensToPython(tokens):
+    self.Push(*self.Conditional('elif', ExprToPython(condition), then_stmt,
+                                else_stmt, depth, nesting, builders))
+
+  def Loop(self, header, loop_var, stmts, depth, nesting, builders):
+    """Returns the items that translate a loop, given its first line,
+    variable and body.
+
+    Strings that the loop only adds to are built in a list and joined once
+    after the loop, which takes linear instead of quadratic time.
+    """
+    # The loop's back-edge.
+    first_lines = ['_db_check_budget()'] if self.budget else []
+    new_builders = {
+        name: GetPythonVarName(name) + '_builder'
+        for name in sorted(FindStringBuilders(loop_var, stmts) -
+                           builders.keys())}
+    if not new_builders:
+      return self.Block(header, stmts, depth, nesting, builders,
+                        first_lines)
+
+    indent = '  ' * depth
+    items = [(self.Line, indent + '%s = None' % (builder,))
+             for builder in new_builders.values()]
+    items.append((self.OpenBlock, indent + 'try:'))
+    items += self.Block(header, stmts, depth + 1, nesting + 1,
+                        {**builders, **new_builders}, first_lines)
+    items.append((self.CloseBlock, indent + '  '))
+    items.append((self.Line, indent + 'finally:'))
+    for name, builder in new_builders.items():
+      # Leave the variable alone if the loop never added to it.
+      items.append((self.Line, indent + '  if %s is not None:' % (builder,)))
+      items.append((self.Line, indent + "    %s = ''.join(%s)" % (
+          GetPythonVarName(name), builder)))
+    return items
+
+  def ClosedFormLoop(self, loop_var, items, stmts, changes, depth, nesting,
+                     builders):
+    """Returns the items that translate a 磨叽 over the range items with
+    the closed form changes from FindClosedForm().
+
+    If the range is not empty and every variable involved is an integer,
+    each change is made at once, in constant time. Otherwise, as with
+    floats, whose sums depend on the order of the additions, the loop runs
+    as usual.
+    """
+    indent = '  ' * depth
+    var = GetPythonVarName(loop_var.value)
+    names = []
+    for target, _, amount in changes:
+      for token in (target, amount and getattr(amount, 'var', None)):
+        if token and GetPythonVarName(token.value) not in names:
+          names.append(GetPythonVarName(token.value))
+    items = [(self.Line, indent + '_db_range = %s' % (items,)),
+             (self.OpenBlock, indent + 'if _db_range and %s:' % (
+                 ' and '.join('type(%s) is int' % (name,)
+                              for name in names),))]
+    for target, operator, amount in changes:
+      if amount is None:
+        total = '(_db_range[0] + _db_range[-1]) * len(_db_range) // 2'
+      else:
+        total = 'len(_db_range) * %s' % (ExprToPython(amount),)
+      items.append((self.Line, indent + '  %s %s %s' % (
+          GetPythonVarName(target.value), operator, total)))
+    items.append((self.Line, indent + '  %s = _db_range[-1]' % (var,)))
+    items.append((self.CloseBlock, indent + '  '))
+    items.append((self.Line, indent + 'else:'))
+    items += self.Loop('for %s in _db_range:' % (var,), loop_var, stmts,
+                       depth + 1, nesting + 1, builders)
+    return items
+
+def TranslateStatementToPython(stmt, indent = '', budget = False,
+                               counted = None):
+  """Translates the statements to Python code, without trailing newline.
+
+  If budget is true, budget checks are added at every loop back-edge and
+  function entry, so that the program can be stopped by Run().
+
+  If counted (a list) is given, every statement is appended to it and gets
+  a counter, _db_counts[i] where i is its index in counted, that goes up
+  each time the statement runs.
+  """
+  return _StatementTranslator(budget, counted).Translate(
+      [stmt], len(indent) // 2)
+
+class RunStats:
+  """Where the time of running a program went, and how big things got.
+
+  Pass one to Run() to have it filled in.
+  """
+
+  # Phases in the order they run, with their names in reports.
+  PHASES = (
+      ('tokenize', '分词'),
+      ('parse', '解析'),
+      ('translate', '翻译'),
+      ('compile', '编译'),
+      ('execute', '执行'),
+      )
+
+  def __init__(self):
+    self.seconds = {}  # Maps a phase to the seconds it took.
+    self.token_count = 0
+    # Including the statements in loops, conditionals and functions, but
+    # not in the bodies of lazy functions, which are not parsed yet.
+    self.statement_count = 0
+    self.python_code_size = 0  # In characters.
+    self.output_size = 0  # In characters.
+
+  def ToDict(self):
+    return {'seconds': dict(self.seconds),
+            'token_count': self.token_count,
+            'statement_count': self.statement_count,
+            'python_code_size': self.python_code_size,
+            'output_size': self.output_size}
+
+  def __str__(self):
+    lines = ['%s：%.6f 秒' % (name, self.seconds[phase])
+             for phase, name in self.PHASES if phase in self.seconds]
+    lines.append('符号：%d 个' % (self.token_count,))
+    lines.append('语句：%d 句' % (self.statement_count,))
+    lines.append('Python 代码：%d 字' % (self.python_code_size,))
+    lines.append('运行结果：%d 字' % (self.output_size,))
+    return '\n'.join(lines)
+
+def TranslateTokensToPython(tokens, budget = False, stats = None,
+                            counted = None, lazy = False, inline = True):
+  if stats is not None:
+    start = time.perf_counter()
+  if lazy and counted is None:
+    tokens = DeferFunctionBodies(tokens)
   statements, tokens = ParseStmts(tokens)
   assert not tokens, ('多余符号：%s' % (tokens,))
-  py_code = []
-  for s in statements:
-    py_code.append(TranslateStatementToPython(s))
+  if stats is not None:
+    stats.seconds['parse'] = time.perf_counter() - start
+    stats.statement_count = sum(1 for _ in WalkStatements(statements))
+    start = time.perf_counter()
+  py_code = _TranslateStatements(statements, budget, counted, inline)
+  if stats is not None:
+    stats.seconds['translate'] = time.perf_counter() - start
+    stats.python_code_size = len(py_code)
+  return py_code
+
+# GetPythonVarName() shares one symbol table, so only one thread may
+# translate at a time.
+_translate_lock = threading.Lock()
+
+def TranslateToPython(code, budget = False, stats = None, counted = None,
+                      lazy = False, inline = True):
+  """Translates dongbei code to Python code. Safe to call from any thread.
+
+  See TranslateStatementToPython() for counted. If lazy is true, functions
+  defined outside other functions are parsed, translated and compiled when
+  they are first called (see _db_lazy()), unless counted is given. If
+  inline is false, small functions are never inlined where they are
+  called, so that every call shows up, e.g. to a profiler.
+  """
+  with _translate_lock:
+    if stats is None:
+      return TranslateTokensToPython(list(Tokenize(code)), budget,
+                                     counted=counted, lazy=lazy,
+                                     inline=inline)
+    start = time.perf_counter()
+    tokens = list(Tokenize(code))
+    stats.seconds['tokenize'] = time.perf_counter() - start
+    stats.token_count = len(tokens)
+    return TranslateTokensToPython(tokens, budget, stats, counted, lazy,
+                                   inline)
+
+def TranslateStatementsToPython(statements, budget = False):
+  """Translates parsed statements to Python code. Safe to call from any
+  thread.
+  """
+  with _translate_lock:
+    return _TranslateStatements(statements, budget)
+
+def _TranslateStatements(statements, budget = False, counted = None,
+                         inline = True):
+  """Translates statements to Python code, inlining small functions if
+  inline is true.
+
+  Function calls count towards the budget and the counters, so they are
+  not inlined with either, nor with lazy functions, whose bodies may set
+  any name.
+  """
+  global _inline_functions, _inlining
+  if not inline or budget or counted is not None or any(
+      stmt.kind == STMT_LAZY_FUNC_DEF for stmt in WalkStatements(statements)):
+    functions = {}
+  else:
+    functions = FindInlineFunctions(statements)
+  # Until the function is defined, the marker is nothing it could be.
+  py_code = ['%s = object()' % (marker,)
+             for _, _, marker in functions.values()]
+  _inline_functions = functions
+  try:
+    if statements:
+      # Together, so that what one statement computes may serve the next.
+      py_code.append(
+          _StatementTranslator(budget, counted).Translate(statements, 0))
+  finally:
+    _inline_functions = {}
+    _inlining = False
   return '\n'.join(py_code)
 
+def _LazyFunctionToJson(stmt):
+  """Returns the STMT_LAZY_FUNC_DEF stmt in JSON.
+
+  One string is much quicker for Python to compile than the same tuples
+  written out.
+  """
+  func, params, body = stmt.value
+  return json.dumps(
+      [func.value, stmt.line, [param.value for param in params],
+       [[token.kind, token.value, token.line] for token in body]],
+      ensure_ascii=False, separators=(',', ':'))
+
+def _CompileLazyFunction(function, budget):
+  """Returns (Python name, code object) of the function that the JSON from
+  _LazyFunctionToJson() defines."""
+  name, line, params, body = json.loads(function)
+  stmts, tokens = ParseStmts([Token(*token) for token in body])
+  if tokens:  # Where 整完了 should have been.
+    ConsumeToken(Keyword(KW_END), tokens)
+  py_code = TranslateStatementsToPython(
+      [Statement(STMT_FUNC_DEF,
+                 (Token(TK_IDENTIFIER, name, line),
+                  [Token(TK_IDENTIFIER, param, line) for param in params],
+                  stmts), line)], budget)
+  return GetPythonVarName(name), compile(py_code, '<dongbei>', 'exec')
+
+def _db_lazy(function, namespace, budget):
+  """Returns a stand-in for the function that the JSON from
+  _LazyFunctionToJson() defines in namespace.
+
+  The first call takes the function, parsed, translated and compiled then,
+  in the place of the stand-in in namespace, and calls it.
+  """
+  compiled = None
+  def CallLazyFunction(*args):
+    nonlocal compiled
+    if compiled is None:
+      name, code_object = _CompileLazyFunction(function, budget)
+      current = namespace.get(name)
+      exec(code_object, namespace)
+      compiled = namespace[name]
+      if current is not CallLazyFunction:
+        namespace[name] = current  # The name has been given to another.
+    return compiled(*args)
+  return CallLazyFunction
+
 def ParseToAst(code):
   tokens = list(Tokenize(code))
   statements, tokens = ParseStmts(tokens)
   assert not tokens, ('多余符号：%s' % (tokens,))
   return statements
 
+# The output is collected in a list and joined once at the end, as adding
+# to a global string copies all of it every time.
 _db_output = ''
-def _db_append_output(s):
-  global _db_output
-  _db_output += s
+_db_output_parts = []
+_db_append_output = _db_output_parts.append
+
+# The statement counters of a program translated with counted.
+_db_counts = None
+
+# The input of the running program.
+_db_input = None
+
+# Charges one step to the budget of the running program.
+_db_check_budget = _MakeBudgetCheck(None, None)
+
+# Where the running program looks for modules before MODULE_PATH.
+_db_module_dir = None
+
+def ExecutePython(py_code, max_steps = None, timeout = None, stats = None,
+                  counts = None, input_file = None, module_dir = None):
+  """Executes translated code and returns its output.
+
+  The program reads its input (听一句 and so on) from input_file, or from
+  the standard input if it is None.
+
+  The program imports modules from module_dir, if given, before looking in
+  MODULE_PATH.
+
+  max_steps limits the number of loop iterations plus function calls, and
+  timeout limits the wall-clock seconds. Either one only takes effect if the
+  code was translated with budget checks.
+
+  If the code was translated with counted, counts must be a sequence of
+  as many integers as there are counted statements, all zero. The counters
+  are kept in it.
+  """
+  if stats is not None:
+    start = time.perf_counter()
+    py_code = compile(py_code, '<dongbei>', 'exec')
+    stats.seconds['compile'] = time.perf_counter() - start
+    start = time.perf_counter()
+    output = ExecutePython(py_code, max_steps, timeout, counts=counts,
+                           input_file=input_file, module_dir=module_dir)
+    stats.seconds['execute'] = time.perf_counter() - start
+    stats.output_size = len(output)
+    return output
+
+  global _db_output, _db_output_parts, _db_append_output
+  global _db_check_budget, _db_counts, _db_input, _db_module_dir
+  _db_output = ''
+  _db_output_parts = []
+  _db_append_output = _db_output_parts.append
+  _db_counts = counts
+  _db_input = _DbInput(sys.stdin if input_file is None else input_file)
+  _db_check_budget = _MakeBudgetCheck(max_steps, timeout)
+  _db_module_dir = module_dir
+  try:
+    # See https://stackoverflow.com/questions/871887/using-exec-with-recursive-functions
+    # Use the same dictionary for local and global definitions.
+    # Needed for defining recursive dongbei functions.
+    exec(py_code, globals(), globals())
+  finally:
+    # Keep what was output before an error, too.
+    _db_output = ''.join(_db_output_parts)
+  return _db_output
 
-def Run(code):
-  tokens = list(Tokenize(code))
-  py_code = TranslateTokensToPython(tokens)
+def Run(code, max_steps = None, timeout = None, stats = None, lazy = False,
+        module_dir = None):
+  """Runs dongbei code and returns its output.
+
+  If max_steps or timeout is given, the program raises BudgetExceededError
+  once it has taken more than max_steps loop iterations and function calls
+  together, or has run for more than timeout seconds.
+
+  If stats (a RunStats) is given, it is filled in as the program runs.
+
+  If lazy is true, functions are translated when first called, as in
+  TranslateToPython().
+
+  Modules are imported from module_dir, if given, before MODULE_PATH.
+  """
+  budget = max_steps is not None or timeout is not None
+  py_code = TranslateToPython(code, budget, stats, lazy=lazy)
   print('Python 代码：')
   print('%s' % (py_code,))
-  global _db_output
-  _db_output = ''
-  # See https://stackoverflow.com/questions/871887/using-exec-with-recursive-functions
-  # Use the same dictionary for local and global definitions.
-  # Needed for defining recursive dongbei functions.
-  exec(py_code, globals(), globals())
+  output = ExecutePython(py_code, max_steps, timeout, stats,
+                         module_dir=module_dir)
   print('运行结果：')
-  print('%s' % (_db_output,))
-  return _db_output
+  print('%s' % (output,))
+  return output
+
+class Program(dongbei_runtime.Program):
+  """A compiled dongbei program, which can be run any number of times.
+
+  Get one from Compile(). Every Run() starts from scratch: variables set
+  by one run are not seen by the next, and runs in different threads do not
+  get in each other's way.
+  """
+
+  def __init__(self, python_code, budget, module_dir = None):
+    self.python_code = python_code
+    self.module_dir = module_dir
+    super().__init__(compile(python_code, '<dongbei>', 'exec'), budget)
+
+  def Run(self, output = None, max_steps = None, timeout = None,
+          input_file = None):
+    """Runs the program and returns its output.
+
+    If output (a file-like object) is given, the output is written to it as
+    the program runs instead, and None is returned.
+
+    The program reads its input from input_file, or from the standard input
+    if it is None.
+
+    max_steps and timeout work as in Run(), but only if the program was
+    compiled with budget checks.
+    """
+    return super().Run(output, max_steps, timeout, input_file)
+
+  def CallMany(self, name, args_list, jobs = None, max_steps = None,
+               timeout = None):
+    """Runs the program once, then calls its function name (without 【】)
+    with each tuple of arguments in args_list, and returns the list of
+    what the calls return, in the order of args_list.
+
+    The calls are split among jobs worker processes, as many as for
+    一块堆儿磨叽 if None, which are forked after the program has run. With one job, or without
+    fork, they run here one after another. If a call fails, its exception
+    is raised.
+
+    The program and the calls read no input, and what they say is dropped.
+    max_steps and timeout limit the program and each call apart, as in
+    Run().
+    """
+    with _translate_lock:
+      python_name = GetPythonVarName(name)
+    results = self._CallMany(python_name, args_list, jobs, max_steps,
+                             timeout)
+    if results is None:
+      sys.exit('程序里没有【%s】这个套路。' % (name,))
+    return results
+
+  def _NewNamespace(self, write, input_file, max_steps = None,
+                    timeout = None):
+    namespace = NewNamespace(write, input_file, max_steps, timeout)
+    namespace['_db_module_dir'] = self.module_dir
+    return namespace
+
+def NewNamespace(write, input_file, max_steps = None, timeout = None):
+  """Returns a fresh namespace to run translated code in.
+
+  The code's output goes to write(), and its input comes from input_file.
+  Modules are imported from dongbei source.
+  """
+  namespace = dongbei_runtime.NewNamespace(write, input_file, max_steps,
+                                           timeout)
+  namespace['_db_import'] = _db_import
+  namespace['_db_lazy'] = _db_lazy
+  return namespace
+
+def Compile(code, budget = False, lazy = False, module_dir = None):
+  """Translates and compiles dongbei code once, and returns a Program.
+
+  If budget is true, the program gets budget checks, so that Program.Run()
+  can stop it after max_steps or timeout.
+
+  If lazy is true, functions are translated and compiled when first called,
+  as in TranslateToPython().
+
+  The program imports modules from module_dir, if given, before looking in
+  MODULE_PATH. Give it the directory of the program's file.
+  """
+  return Program(TranslateToPython(code, budget, lazy=lazy), budget,
+                 module_dir)
+
+# The directories where 翠花，上xx。 looks for xx.dongbei, before the current
+# directory. Starts out as the DONGBEI_PATH environment variable.
+MODULE_PATH = [path for path in
+               os.environ.get('DONGBEI_PATH', '').split(os.pathsep) if path]
+
+# Bumped whenever the format of the files in the disk cache changes.
+_MODULE_CACHE_VERSION = 2
+
+class ModuleCache:
+  """The compiled dongbei modules, shared by every program in the process.
+
+  A module is translated and compiled the first time a program imports it,
+  and again only if its file changes. If cache_dir is set, the translated
+  code is kept there as well, so that other processes need not parse the
+  module again.
+  """
+
+  def __init__(self, cache_dir = None):
+    self.cache_dir = cache_dir
+    # Maps (path, budget) to (mtime_ns, size, code object).
+    self._modules = {}
+    self._lock = threading.Lock()
+
+  def Load(self, path, budget = False):
+    """Returns the code object of the module in path."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    with self._lock:
+      entry = self._modules.get((path, budget))
+      if entry and entry[:2] == (st.st_mtime_ns, st.st_size):
+        return entry[2]
+      with io.open(path, 'r', encoding='utf-8') as src_file:
+        code = src_file.read()
+      py_code = self._Translate(path, code, budget)
+      code_object = compile(py_code, '<dongbei:%s>' % (path,), 'exec')
+      self._modules[(path, budget)] = (st.st_mtime_ns, st.st_size,
+                                       code_object)
+      return code_object
+
+  def _Translate(self, path, code, budget):
+    if not self.cache_dir:
+      return TranslateToPython(code, budget)
+    source_hash = hashlib.sha256(code.encode('utf-8')).hexdigest()
+    cache_path = os.path.join(self.cache_dir, '%s%s.json' % (
+        hashlib.sha256(path.encode('utf-8')).hexdigest()[:16],
+        '-budget' if budget else ''))
+    try:
+      with io.open(cache_path, 'r', encoding='utf-8') as cache_file:
+        cached = json.load(cache_file)
+      if (cached['version'] == _MODULE_CACHE_VERSION and
+          cached['source_sha256'] == source_hash):
+        return cached['python_code']
+    except (OSError, ValueError, KeyError):
+      pass  # Not cached yet, or the cache is broken.
+
+    # The Python names of identifiers are the same in every process, so the
+    # code works as it is in another one.
+    py_code = TranslateToPython(code, budget)
+    try:
+      os.makedirs(self.cache_dir, exist_ok=True)
+      tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+      with io.open(tmp_path, 'w', encoding='utf-8') as cache_file:
+        json.dump({'version': _MODULE_CACHE_VERSION,
+                   'source_sha256': source_hash,
+                   'python_code': py_code}, cache_file, ensure_ascii=False)
+      os.replace(tmp_path, cache_path)
+    except OSError:
+      pass  # The module works without the cache.
+    return py_code
+
+module_cache = ModuleCache(os.environ.get('DONGBEI_CACHE_DIR'))
+
+def FindModule(name, module_dir = None):
+  """Returns the path of module name, looking in module_dir if given, in
+  MODULE_PATH and then in the current directory.
+  """
+  filename = name + '.dongbei'
+  directories = MODULE_PATH + [os.getcwd()]
+  if module_dir is not None:
+    directories.insert(0, module_dir)
+  for directory in directories:
+    path = os.path.join(directory, filename)
+    if os.path.isfile(path):
+      return os.path.abspath(path)
+  sys.exit('翠花上不了%s：哪儿都没有 %s。' % (name, filename))
+
+def _db_import(name, namespace, budget):
+  """Runs module name in the namespace of the importing program.
+
+  The module's functions and variables thereby become the program's. Each
+  module runs at most once per run of the program.
+  """
+  path = FindModule(name, namespace.get('_db_module_dir'))
+  imported = namespace.setdefault('_db_imported', set())
+  if path in imported:
+    return
+  # Mark the module first, so that modules that import each other work.
+  imported.add(path)
+  exec(module_cache.Load(path, budget), namespace)
+
+def RunFileForBatch(filepath, output_dir = None):
+  """Runs one program of a batch and returns its report as a dict.
+
+  The output goes to output_dir/<file name>.out if output_dir is given, or
+  into the report otherwise.
+  """
+  report = {'file': filepath}
+  start = time.perf_counter()
+  # Keeps what was output before an error, too.
+  output_buffer = io.StringIO()
+  try:
+    with io.open(filepath, 'r', encoding='utf-8') as src_file:
+      # Every program starts from scratch, even in a reused worker, and
+      # imports the modules next to it.
+      Compile(src_file.read(),
+              module_dir=os.path.dirname(os.path.abspath(filepath))).Run(
+                  output_buffer)
+    report['exit_status'] = 0
+  except SystemExit as e:
+    report['exit_status'] = 1
+    report['error'] = str(e.code)
+  except Exception as e:
+    report['exit_status'] = 1
+    report['error'] = '%s: %s' % (type(e).__name__, e)
+  output = output_buffer.getvalue()
+  report['seconds'] = time.perf_counter() - start
+  if output_dir is None:
+    report['output'] = output
+  else:
+    output_path = os.path.join(
+        output_dir, os.path.basename(filepath) + '.out')
+    with io.open(output_path, 'w', encoding='utf-8') as output_file:
+      output_file.write(output)
+    report['output_file'] = output_path
+  return report
+
+def RunBatch(filepaths, jobs = None, report_file = None, output_dir = None):
+  """Runs programs on jobs worker processes and returns how many failed.
+
+  A JSON Lines report (one line per program, in the given order) is written
+  to report_file if given. Otherwise each program's output is printed.
+
+  With output_dir, two different programs may not have the same file name,
+  or their outputs would go to the same file.
+  """
+  filepaths = list(filepaths)
+  if output_dir is not None:
+    paths_by_name = {}
+    for filepath in filepaths:
+      name = os.path.basename(filepath)
+      path = paths_by_name.setdefault(name, os.path.abspath(filepath))
+      if path != os.path.abspath(filepath):
+        sys.exit('%s 和 %s 重名了，输出都得写到 %s.out 里，整不了。' % (
+            path, os.path.abspath(filepath), name))
+    os.makedirs(output_dir, exist_ok=True)
+  failures = 0
+  with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+    for report in executor.map(RunFileForBatch, filepaths,
+                               itertools.repeat(output_dir)):
+      if report['exit_status']:
+        failures += 1
+      if report_file is not None:
+        report_file.write(json.dumps(report, ensure_ascii=False) + '\n')
+      else:
+        print('执行 %s ...' % (report['file'],))
+        if 'error' in report:
+          print('出错了：%s' % (report['error'],))
+        elif 'output' in report:
+          print('%s' % (report['output'],))
+  return failures
 
 
 if __name__ == '__main__':
   if len(sys.argv) == 1:
     sys.exit(__doc__)
 
-  for filepath in sys.argv[1:]:
+  parser = argparse.ArgumentParser(description='dongbei语言执行器')
+  parser.add_argument('filepaths', nargs='+', metavar='源程序文件名')
+  parser.add_argument('--jobs', type=int,
+                      help='用这么多个进程批量执行，默认是CPU个数')
+  parser.add_argument('--report', metavar='报告.jsonl',
+                      help='批量执行，把每个程序的结果写成 JSON Lines 报告')
+  parser.add_argument('--output-dir', metavar='目录',
+                      help='批量执行，把每个程序的输出写到这个目录里')
+  parser.add_argument('--stats', action='store_true',
+                      help='跑完了说说时间都花在哪儿了')
+  parser.add_argument('--cache-dir', metavar='目录',
+                      help='把翻译好的模块存在这个目录里，下回不用再翻译')
+  parser.add_argument('--lazy', action='store_true',
+                      help='套路头一回整的时候才翻译，整不着的套路就不翻译了')
+  args = parser.parse_args()
+  if args.cache_dir:
+    module_cache.cache_dir = args.cache_dir
+
+  if args.jobs or args.report or args.output_dir:
+    if args.report:
+      with io.open(args.report, 'w', encoding='utf-8') as report_file:
+        failures = RunBatch(args.filepaths, args.jobs, report_file,
+                            args.output_dir)
+    else:
+      failures = RunBatch(args.filepaths, args.jobs,
+                          output_dir=args.output_dir)
+    sys.exit(1 if failures else 0)
+
+  for filepath in args.filepaths:
     with io.open(filepath, 'r', encoding='utf-8') as src_file:
       print('执行 %s ...' % (filepath,))
-      Run(src_file.read())
+      stats = RunStats() if args.stats else None
+      # Modules are looked up next to the program first.
+      Run(src_file.read(), stats=stats, lazy=args.lazy,
+          module_dir=os.path.dirname(os.path.abspath(filepath)))
+      if stats is not None:
+        print('统计：')
+        print('%s' % (stats,))
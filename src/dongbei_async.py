@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""dongbei语言的asyncio接口
+
+翻译在线程池里整，运行在进程池里整，都不卡事件循环。
+
+用法：
+    async with AsyncRunner(max_concurrency=4) as runner:
+      output = await runner.Run('唠唠：“你好”。', timeout=1)
+"""
+
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+try:
+  from . import dongbei
+  from . import dongbei_runtime
+except ImportError:
+  import dongbei
+  import dongbei_runtime
+
+class CompileError(Exception):
+  """Raised when a dongbei program cannot be translated to Python."""
+
+def _Translate(code, budget):
+  """Translates code in a worker thread, turning exits into CompileError."""
+  try:
+    return dongbei.TranslateToPython(code, budget)
+  except SystemExit as e:
+    raise CompileError(e.code) from None
+  except AssertionError as e:
+    raise CompileError(str(e)) from None
+
+# In a worker process: one flag per slot, which is set to 1 when the run in
+# that slot is cancelled.
+_cancel_flags = None
+
+def _InitWorker(cancel_flags):
+  global _cancel_flags
+  _cancel_flags = cancel_flags
+
+def _Execute(py_code, max_steps, timeout, slot):
+  """Runs py_code in a fresh namespace in a worker process, and returns
+  its output.
+
+  The program stops at its next budget check once the flag of slot is set.
+  """
+  parts = []
+  namespace = dongbei.NewNamespace(parts.append, sys.stdin)
+  namespace['_db_check_budget'] = dongbei_runtime._MakeBudgetCheck(
+      max_steps, timeout, lambda: _cancel_flags[slot])
+  exec(compile(py_code, '<dongbei>', 'exec'), namespace)
+  return ''.join(parts)
+
+class AsyncRunner:
+  """Compiles and runs dongbei programs without blocking the event loop.
+
+  At most max_concurrency Compile() and Run() calls are in flight at the
+  same time; the others wait for their turn. Every Run() starts from
+  scratch, as Program.Run() does.
+  """
+
+  def __init__(self, max_concurrency = 8, thread_workers = None,
+               process_workers = None):
+    self._semaphore = asyncio.Semaphore(max_concurrency)
+    self._threads = concurrent.futures.ThreadPoolExecutor(thread_workers)
+    # A run holds a slot from when it starts until its worker is done with
+    # it, which can be after a cancelled Run() has returned: while it holds
+    # the semaphore, or while its call is in the pool, queued or running.
+    process_workers = process_workers or os.cpu_count() or 1
+    slot_count = max_concurrency + 2 * process_workers + 1
+    self._cancel_flags = multiprocessing.RawArray('b', slot_count)
+    self._free_slots = queue.Queue()
+    for slot in range(slot_count):
+      self._free_slots.put(slot)
+    self._processes = concurrent.futures.ProcessPoolExecutor(
+        process_workers, initializer=_InitWorker,
+        initargs=(self._cancel_flags,))
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc_info):
+    await self.Close()
+
+  async def Close(self):
+    """Shuts down the worker pools.
+
+    Programs that are still running are stopped at their next budget check,
+    and Close() does not wait for them.
+    """
+    for slot in range(len(self._cancel_flags)):
+      self._cancel_flags[slot] = 1
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, self._threads.shutdown)
+    self._processes.shutdown(wait=False, cancel_futures=True)
+
+  async def Compile(self, code, budget = False):
+    """Translates code to Python code on a worker thread."""
+    async with self._semaphore:
+      return await self._Compile(code, budget)
+
+  async def _Compile(self, code, budget):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        self._threads, _Translate, code, budget)
+
+  async def Run(self, code, timeout = None, max_steps = None):
+    """Compiles and runs code, and returns its output.
+
+    Raises asyncio.TimeoutError if the whole thing takes more than timeout
+    seconds. The program is always compiled with budget checks, so that
+    the worker process stops on its own at the same deadline, or soon after
+    the Run() is cancelled, instead of running on in the background.
+    """
+    async with self._semaphore:
+      return await asyncio.wait_for(
+          self._Run(code, timeout, max_steps), timeout)
+
+  async def _Run(self, code, timeout, max_steps):
+    start = time.monotonic()
+    py_code = await self._Compile(code, True)
+    if timeout is not None:
+      timeout = max(0, timeout - (time.monotonic() - start))
+    while True:
+      try:
+        slot = self._free_slots.get_nowait()
+        break
+      except queue.Empty:
+        # Cancelled runs are still stopping.
+        await asyncio.sleep(0.01)
+    self._cancel_flags[slot] = 0
+    future = self._processes.submit(_Execute, py_code, max_steps, timeout,
+                                    slot)
+    future.add_done_callback(lambda _: self._free_slots.put(slot))
+    try:
+      return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+      # The slot is not given to another run until the worker is done.
+      if not future.done():
+        self._cancel_flags[slot] = 1
+      raise
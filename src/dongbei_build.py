@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""dongbei语言的事先编译器
+
+把 .dongbei 程序翻译成能 import 的 Python 模块（.py 和 .pyc），连同它们
+翠花要上的模块，再捎上一份 dongbei_runtime.py。线上只要这些文件就能跑，
+用不着分词、解析和翻译。
+
+一块儿编译的程序和模块得一块儿用：翻译出来的变量名是它们共用的。
+
+用法：
+    dongbei_build.py [--budget] [--output-dir 目录] 源程序文件名...
+
+    # 线上：
+    program = dongbei_runtime.Load('九九表')
+    output = program.Run()
+"""
+
+import argparse
+import io
+import os
+import py_compile
+import shutil
+import sys
+
+try:
+  from . import dongbei
+  from . import dongbei_runtime
+except ImportError:
+  import dongbei
+  import dongbei_runtime
+
+# Comes before the translated code in every built module. When the module
+# is imported or run by itself, rather than by dongbei_runtime, it says to
+# the standard output.
+_HEADER = '''# -*- coding: utf-8 -*-
+# dongbei_build.py 从 %s 翻译出来的，别改。
+if '_db_append_output' not in globals():
+  import sys
+  import dongbei_runtime
+  globals().update(dongbei_runtime.NewNamespace(sys.stdout.write, sys.stdin))
+'''
+
+def ModuleName(path):
+  """Returns the name of the Python module built from the file in path."""
+  return os.path.splitext(os.path.basename(path))[0]
+
+def _FindImports(path, statements):
+  """Returns the paths of the modules that statements import."""
+  # Look next to the importing file first, as the executor does.
+  module_dir = os.path.dirname(os.path.abspath(path))
+  return [dongbei.FindModule(stmt.value.value, module_dir)
+          for stmt in dongbei.WalkStatements(statements)
+          if stmt.kind == dongbei.STMT_IMPORT]
+
+def Build(filepaths, output_dir, budget = False):
+  """Builds the files and the modules they import into output_dir.
+
+  Returns the paths of the .py files written, including the runtime's.
+  """
+  os.makedirs(output_dir, exist_ok=True)
+  built = {}  # Maps module name to the path it was built from.
+  written = []
+  pending = [os.path.abspath(path) for path in filepaths]
+  while pending:
+    path = pending.pop(0)
+    name = ModuleName(path)
+    if name in built:
+      if built[name] != path:
+        sys.exit('%s 跟 %s 编译出来都叫 %s。' % (built[name], path, name))
+      continue
+    built[name] = path
+    with io.open(path, 'r', encoding='utf-8') as src_file:
+      statements = dongbei.ParseToAst(src_file.read())
+    pending.extend(_FindImports(path, statements))
+    py_path = os.path.join(output_dir, name + '.py')
+    with io.open(py_path, 'w', encoding='utf-8') as py_file:
+      py_file.write(_HEADER % (os.path.basename(path),))
+      py_file.write(dongbei.TranslateStatementsToPython(statements, budget))
+      py_file.write('\n')
+    written.append(py_path)
+
+  runtime_path = os.path.join(output_dir, 'dongbei_runtime.py')
+  shutil.copyfile(dongbei_runtime.__file__, runtime_path)
+  written.append(runtime_path)
+  for py_path in written:
+    py_compile.compile(py_path, doraise=True)
+  return written
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='dongbei语言的事先编译器')
+  parser.add_argument('filepaths', nargs='+', metavar='源程序文件名')
+  parser.add_argument('--output-dir', metavar='目录', default='.',
+                      help='把编译好的模块放在这个目录里，默认是当前目录')
+  parser.add_argument('--budget', action='store_true',
+                      help='编译成能用步数和时间管着的程序')
+  args = parser.parse_args()
+
+  for py_path in Build(args.filepaths, args.output_dir, args.budget):
+    print(py_path)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""dongbei语言常驻服务
+
+服务在本地 Unix 套接字上听着，把翻译好的程序都记着，客户端只管发请求。
+
+用法：
+    dongbei_daemon.py [--socket 路径] serve [--workers 进程数]
+    dongbei_daemon.py [--socket 路径] run [--timeout 秒数] 源程序文件名...
+    dongbei_daemon.py [--socket 路径] stop
+
+请求和回复都是一行 JSON：
+    {"op": "run", "code": "唠唠：1。", "timeout": 1}
+    {"ok": true, "output": "1\\n", "cached": false}
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+
+try:
+  from . import dongbei
+  from . import dongbei_runtime
+except ImportError:
+  import dongbei
+  import dongbei_runtime
+
+DEFAULT_SOCKET_PATH = os.environ.get(
+    'DONGBEI_SOCKET', '/tmp/dongbei-%d.sock' % (os.getuid(),))
+
+# How many translated programs the daemon remembers.
+DEFAULT_CACHE_SIZE = 1024
+
+class _CompileCache:
+  """A thread-safe LRU cache from dongbei code to translated Python code."""
+
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def Get(self, code, budget):
+    """Returns (key, Python code, whether it was cached)."""
+    key = hashlib.sha256(
+        ('%d:%s' % (budget, code)).encode('utf-8')).hexdigest()
+    with self._lock:
+      py_code = self._entries.get(key)
+      if py_code is not None:
+        self._entries.move_to_end(key)
+        return key, py_code, True
+    py_code = dongbei.TranslateToPython(code, budget)
+    with self._lock:
+      self._entries[key] = py_code
+      if len(self._entries) > self.capacity:
+        self._entries.popitem(last=False)
+    return key, py_code, False
+
+# Maps cache key to the compiled code object, in each worker process.
+_code_objects = {}
+
+# In a worker process: one flag per slot, which is set to 1 when the
+# request in that slot is to stop.
+_cancel_flags = None
+
+def _InitWorker(cancel_flags):
+  global _cancel_flags
+  _cancel_flags = cancel_flags
+
+def _RunInWorker(key, py_code, max_steps, timeout, slot):
+  """Runs the program in a fresh namespace, so that nothing is left over
+  from earlier requests, and returns its output.
+
+  The program stops at its next budget check once the flag of slot is set.
+  """
+  code_object = _code_objects.get(key)
+  if code_object is None:
+    if len(_code_objects) >= DEFAULT_CACHE_SIZE:
+      _code_objects.clear()
+    code_object = compile(py_code, '<dongbei>', 'exec')
+    _code_objects[key] = code_object
+  parts = []
+  namespace = dongbei.NewNamespace(parts.append, io.StringIO())
+  namespace['_db_check_budget'] = dongbei_runtime._MakeBudgetCheck(
+      max_steps, timeout, lambda: _cancel_flags[slot])
+  exec(code_object, namespace)
+  return ''.join(parts)
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+  # Seconds to wait for the next request on an idle connection.
+  timeout = 10
+
+  def handle(self):
+    try:
+      for line in self.rfile:
+        response = self.server.Handle(json.loads(line))
+        self.wfile.write(
+            (json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+    except socket.timeout:
+      pass
+
+class DaemonServer(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+  """Serves compile and run requests with a pool of worker processes."""
+
+  # Let requests in flight finish when shutting down. Close() stops the
+  # programs they run first.
+  block_on_close = True
+
+  def __init__(self, socket_path, workers = None,
+               cache_size = DEFAULT_CACHE_SIZE):
+    self.socket_path = socket_path
+    self.workers = workers or os.cpu_count()
+    self.cache = _CompileCache(cache_size)
+    # A request holds a slot from when it is sent to the pool until its
+    # worker is done with it. The pool runs workers of them at a time and
+    # queues up about as many more.
+    slot_count = 2 * self.workers
+    self._cancel_flags = multiprocessing.RawArray('b', slot_count)
+    self._free_slots = queue.Queue()
+    for slot in range(slot_count):
+      self._free_slots.put(slot)
+    self._closed = False
+    self._lock = threading.Lock()  # Guards _closed and submitting.
+    self.executor = concurrent.futures.ProcessPoolExecutor(
+        self.workers, initializer=_InitWorker,
+        initargs=(self._cancel_flags,))
+    super().__init__(socket_path, _RequestHandler)
+
+  def Handle(self, request):
+    """Handles one request and returns the response."""
+    op = request.get('op')
+    try:
+      if op == 'compile':
+        _, py_code, cached = self.cache.Get(request['code'], False)
+        return {'ok': True, 'python': py_code, 'cached': cached}
+      if op == 'run':
+        # Always with budget checks, so that Close() can stop the program.
+        key, py_code, cached = self.cache.Get(request['code'], True)
+        output = self._Run(key, py_code, request.get('max_steps'),
+                           request.get('timeout'))
+        return {'ok': True, 'output': output, 'cached': cached}
+      if op == 'shutdown':
+        # shutdown() waits for serve_forever() to return, so it cannot be
+        # called from a request thread directly.
+        threading.Thread(target=self.shutdown).start()
+        return {'ok': True}
+      return {'ok': False, 'error': '我不懂 %s 请求咋整。' % (op,)}
+    except SystemExit as e:
+      return {'ok': False, 'error': str(e.code)}
+    except Exception as e:
+      return {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+
+  def _Run(self, key, py_code, max_steps, timeout):
+    slot = self._free_slots.get()
+    with self._lock:
+      if self._closed:
+        self._free_slots.put(slot)
+        sys.exit('服务收工了，不跑了。')
+      self._cancel_flags[slot] = 0
+      future = self.executor.submit(_RunInWorker, key, py_code, max_steps,
+                                    timeout, slot)
+    future.add_done_callback(lambda _: self._free_slots.put(slot))
+    return future.result()
+
+  def Close(self):
+    """Stops accepting requests, stops the programs that are still
+    running at their next budget check, and cleans up.
+    """
+    with self._lock:
+      self._closed = True
+      for slot in range(len(self._cancel_flags)):
+        self._cancel_flags[slot] = 1
+    self.executor.shutdown(wait=False, cancel_futures=True)
+    self.server_close()
+    if os.path.exists(self.socket_path):
+      os.unlink(self.socket_path)
+
+def _RemoveStaleSocket(socket_path):
+  if not os.path.exists(socket_path):
+    return
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+    try:
+      sock.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+      os.unlink(socket_path)
+      return
+  sys.exit('%s 已经有人在听着了。' % (socket_path,))
+
+def Serve(socket_path = DEFAULT_SOCKET_PATH, workers = None,
+          cache_size = DEFAULT_CACHE_SIZE):
+  """Runs the daemon until SIGTERM, SIGINT or a shutdown request."""
+  _RemoveStaleSocket(socket_path)
+  server = DaemonServer(socket_path, workers, cache_size)
+  def Stop(signum, frame):
+    threading.Thread(target=server.shutdown).start()
+  signal.signal(signal.SIGTERM, Stop)
+  signal.signal(signal.SIGINT, Stop)
+  # Start the workers now, so the first request does not pay for it.
+  list(server.executor.map(int, range(server.workers)))
+  try:
+    server.serve_forever()
+  finally:
+    server.Close()
+
+def Request(request, socket_path = DEFAULT_SOCKET_PATH):
+  """Sends one request to the daemon and returns its response."""
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+    sock.connect(socket_path)
+    sock.sendall(
+        (json.dumps(request, ensure_ascii=False) + '\n').encode('utf-8'))
+    sock.shutdown(socket.SHUT_WR)
+    with sock.makefile('rb') as response_file:
+      return json.loads(response_file.readline())
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='dongbei语言常驻服务')
+  parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH,
+                      help='Unix 套接字路径')
+  commands = parser.add_subparsers(dest='command', required=True)
+  serve_parser = commands.add_parser('serve', help='开始听着')
+  serve_parser.add_argument('--workers', type=int,
+                            help='工作进程数，默认是CPU个数')
+  serve_parser.add_argument('--cache-size', type=int,
+                            default=DEFAULT_CACHE_SIZE,
+                            help='最多记住几个翻译好的程序')
+  run_parser = commands.add_parser('run', help='让服务跑程序')
+  run_parser.add_argument('filepaths', nargs='+', metavar='源程序文件名')
+  run_parser.add_argument('--timeout', type=float, help='每个程序最多跑几秒')
+  commands.add_parser('stop', help='让服务收工')
+  args = parser.parse_args()
+
+  if args.command == 'serve':
+    Serve(args.socket, args.workers, args.cache_size)
+  elif args.command == 'stop':
+    Request({'op': 'shutdown'}, args.socket)
+  else:
+    failed = False
+    for filepath in args.filepaths:
+      with io.open(filepath, 'r', encoding='utf-8') as src_file:
+        response = Request({'op': 'run', 'code': src_file.read(),
+                            'timeout': args.timeout}, args.socket)
+      if response['ok']:
+        sys.stdout.write(response['output'])
+      else:
+        failed = True
+        print('出错了：%s' % (response['error'],), file=sys.stderr)
+    sys.exit(1 if failed else 0)
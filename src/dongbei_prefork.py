@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""dongbei语言预先分叉的工作进程池
+
+父进程先把 dongbei 和要跑的程序都准备好，再提前分叉出工作进程。
+每个工作进程只接一个活儿，干完就走，活儿跟活儿之间谁也不碍着谁。
+分叉出来的进程跟父进程共享内存页（写时复制），接活儿的时候只差一次分叉。
+
+用法：
+    pool = PreforkPool(size=4)
+    pool.Precompile('九九表', code)
+    output = pool.Run(name='九九表')
+"""
+
+import collections
+import gc
+import json
+import os
+import threading
+
+try:
+  from . import dongbei
+except ImportError:
+  import dongbei
+
+class JobError(Exception):
+  """Raised when a job fails in its worker process."""
+
+def _ReadAll(fd):
+  chunks = []
+  while True:
+    chunk = os.read(fd, 65536)
+    if not chunk:
+      return b''.join(chunks)
+    chunks.append(chunk)
+
+def _WriteAll(fd, data):
+  while data:
+    data = data[os.write(fd, data):]
+
+class _Worker:
+  """A forked process that waits for exactly one job."""
+
+  def __init__(self, pid, job_fd, result_fd):
+    self.pid = pid
+    self.job_fd = job_fd
+    self.result_fd = result_fd
+
+class PreforkJob:
+  """A job that has been handed to a worker process."""
+
+  def __init__(self, worker):
+    self._worker = worker
+    self._result = None
+
+  def Result(self):
+    """Waits for the job to finish and returns its output."""
+    if self._result is None:
+      data = _ReadAll(self._worker.result_fd)
+      os.close(self._worker.result_fd)
+      os.waitpid(self._worker.pid, 0)
+      self._result = (json.loads(data) if data
+                      else {'ok': False, 'error': '工作进程没了。'})
+    if not self._result['ok']:
+      raise JobError(self._result['error'])
+    return self._result['output']
+
+class PreforkPool:
+  """Keeps size workers forked ahead of time from this warm process."""
+
+  def __init__(self, size = 4):
+    self.size = size
+    # Maps program name to (plain code object, code object with budget checks).
+    self._programs = {}
+    self._idle = collections.deque()
+    self._lock = threading.Lock()
+    self._closed = False
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.Close()
+
+  def Precompile(self, name, code):
+    """Compiles code once in the parent, to be run later by name.
+
+    Workers forked before this call do not know about the program, so
+    precompile everything before the first job if possible.
+    """
+    self._programs[name] = tuple(
+        compile(dongbei.TranslateToPython(code, budget),
+                '<dongbei:%s>' % (name,), 'exec')
+        for budget in (False, True))
+
+  def Start(self):
+    """Forks the idle workers. Submit() does this if needed."""
+    with self._lock:
+      self._Refill()
+
+  def _Refill(self):
+    if len(self._idle) >= self.size:
+      return
+    # Keep the garbage collector from touching, and thereby copying, the
+    # pages of everything the parent has set up so far.
+    gc.freeze()
+    while len(self._idle) < self.size:
+      self._idle.append(self._Fork())
+
+  def _Fork(self):
+    job_read_fd, job_write_fd = os.pipe()
+    result_read_fd, result_write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+      os.close(job_write_fd)
+      os.close(result_read_fd)
+      for worker in self._idle:
+        os.close(worker.job_fd)
+        os.close(worker.result_fd)
+      try:
+        self._WorkerMain(job_read_fd, result_write_fd)
+      finally:
+        os._exit(0)
+    os.close(job_read_fd)
+    os.close(result_write_fd)
+    return _Worker(pid, job_write_fd, result_read_fd)
+
+  def _WorkerMain(self, job_fd, result_fd):
+    data = _ReadAll(job_fd)
+    if not data:  # The pool is closing.
+      return
+    job = json.loads(data)
+    budget = job['max_steps'] is not None or job['timeout'] is not None
+    try:
+      if job['name'] is not None:
+        code = self._programs[job['name']][budget]
+      else:
+        code = dongbei.TranslateToPython(job['code'], budget)
+      output = dongbei.ExecutePython(code, job['max_steps'], job['timeout'])
+      result = {'ok': True, 'output': output}
+    except SystemExit as e:
+      result = {'ok': False, 'error': str(e.code)}
+    except KeyError as e:
+      result = {'ok': False, 'error': '没有叫 %s 的程序。' % (e,)}
+    except Exception as e:
+      result = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+    _WriteAll(result_fd, json.dumps(result, ensure_ascii=False).encode('utf-8'))
+
+  def Submit(self, code = None, name = None, max_steps = None,
+             timeout = None):
+    """Hands a job to an idle worker and returns a PreforkJob.
+
+    The job runs either the given code, or the program precompiled under
+    name. A new worker is forked to take the place of the busy one.
+    """
+    with self._lock:
+      if self._closed:
+        raise JobError('池子已经关了。')
+      self._Refill()
+      worker = self._idle.popleft()
+      job = {'code': code, 'name': name,
+             'max_steps': max_steps, 'timeout': timeout}
+      _WriteAll(worker.job_fd,
+                json.dumps(job, ensure_ascii=False).encode('utf-8'))
+      os.close(worker.job_fd)
+      self._Refill()
+    return PreforkJob(worker)
+
+  def Run(self, code = None, name = None, max_steps = None, timeout = None):
+    """Runs a job on a worker and returns its output."""
+    return self.Submit(code, name, max_steps, timeout).Result()
+
+  def Close(self):
+    """Tells the idle workers to exit and waits for them."""
+    with self._lock:
+      self._closed = True
+      while self._idle:
+        worker = self._idle.popleft()
+        os.close(worker.job_fd)
+        os.close(worker.result_fd)
+        os.waitpid(worker.pid, 0)
+      gc.unfreeze()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""dongbei语言的函数剖析器
+
+cProfile 只认得 _db_var_阶乘 这样的名字和翻译出来的 Python 代码行。
+这个剖析器把它们对回【标识符】和 dongbei 源程序的行号，数每个 dongbei
+函数被整了几回，花了多少时间（算上和不算它整的别的函数），还能导出
+pstats 文件和火焰图用的折叠栈。
+
+要找磨叽里头哪句最热，用 --heat 给每句话都安个计数器，跑完了按源程序
+一行一行地说每行跑了几回。
+
+用法：
+    dongbei_profile.py [--pstats 结果.prof] [--flamegraph 结果.folded] 源程序文件名
+    dongbei_profile.py --heat 源程序文件名
+
+    profile = Profile(code)
+    print(profile)
+    print(HeatMap(code))
+"""
+
+import argparse
+import array
+import io
+import marshal
+import re
+import sys
+import time
+
+try:
+  from . import dongbei
+except ImportError:
+  import dongbei
+
+# The name reported for the statements outside of any function.
+TOP_LEVEL_NAME = '顶层'
+
+# The file name the translated code is compiled with.
+_PY_FILENAME = '<dongbei>'
+
+def _WalkFuncDefs(statements):
+  """Yields the function definitions in statements, in translation order."""
+  return (stmt for stmt in dongbei.WalkStatements(statements)
+          if stmt.kind == dongbei.STMT_FUNC_DEF)
+
+def MapFunctions(statements, py_code):
+  """Maps the first line of each generated function to (name, line).
+
+  The name is the dongbei name of the function and the line is where it is
+  defined in the dongbei source. The top level maps from line 0.
+  """
+  def_lines = [i + 1 for i, line in enumerate(py_code.split('\n'))
+               if re.match(r'\s*def _db_var', line)]
+  functions = {0: (TOP_LEVEL_NAME, 1)}
+  for py_line, stmt in zip(def_lines, _WalkFuncDefs(statements)):
+    functions[py_line] = (stmt.value[0].value, stmt.line)
+  return functions
+
+class FunctionStats:
+  """What one dongbei function cost."""
+
+  def __init__(self, name, line):
+    self.name = name
+    self.line = line  # Where the function is defined in the dongbei source.
+    self.calls = 0
+    self.primitive_calls = 0  # Calls that are not recursive.
+    self.inclusive = 0.0  # Seconds, including the functions it called.
+    self.exclusive = 0.0  # Seconds, excluding the functions it called.
+    # Maps a caller's key to [calls, primitive calls, exclusive, inclusive].
+    self.callers = {}
+
+  def Key(self):
+    return (self.name, self.line)
+
+class Profile:
+  """Runs a dongbei program under the profiler and keeps the results.
+
+  The program's output is in output, and the statistics in functions, a
+  dict from (name, line) to FunctionStats.
+  """
+
+  def __init__(self, code, filename = '<dongbei>'):
+    self.filename = filename
+    # Every call is traced, so none may be inlined.
+    py_code = dongbei.TranslateToPython(code, inline=False)
+    self._functions = MapFunctions(dongbei.ParseToAst(code), py_code)
+    self.functions = {}
+    # Maps a call stack, as a tuple of names, to its exclusive seconds.
+    self.stacks = {}
+    # Entries are [FunctionStats, start time, seconds spent in callees].
+    self._stack = []
+    code_object = compile(py_code, _PY_FILENAME, 'exec')
+    sys.setprofile(self._Trace)
+    try:
+      self.output = dongbei.ExecutePython(code_object)
+    finally:
+      sys.setprofile(None)
+      # Close the frames that an exception left open.
+      now = time.perf_counter()
+      while self._stack:
+        self._Return(now)
+
+  def _Stats(self, frame):
+    py_line = 0 if frame.f_code.co_name == '<module>' else (
+        frame.f_code.co_firstlineno)
+    name, line = self._functions.get(
+        py_line, (frame.f_code.co_name, py_line))
+    stats = self.functions.get((name, line))
+    if stats is None:
+      stats = self.functions[(name, line)] = FunctionStats(name, line)
+    return stats
+
+  def _Trace(self, frame, event, arg):
+    if frame.f_code.co_filename != _PY_FILENAME:
+      return
+    if event == 'call':
+      self._stack.append([self._Stats(frame), time.perf_counter(), 0.0])
+    elif event == 'return' and self._stack:
+      self._Return(time.perf_counter())
+
+  def _Return(self, now):
+    stats, start, callee_seconds = self._stack.pop()
+    seconds = now - start
+    exclusive = seconds - callee_seconds
+    recursive = any(entry[0] is stats for entry in self._stack)
+    stats.calls += 1
+    stats.exclusive += exclusive
+    if not recursive:
+      # Time in recursive calls is already in the outermost call.
+      stats.primitive_calls += 1
+      stats.inclusive += seconds
+    if self._stack:
+      caller = self._stack[-1]
+      caller[2] += seconds
+      edge = stats.callers.setdefault(caller[0].Key(), [0, 0, 0.0, 0.0])
+      edge[0] += 1
+      edge[2] += exclusive
+      if not recursive:
+        edge[1] += 1
+        edge[3] += seconds
+    path = tuple(entry[0].name for entry in self._stack) + (stats.name,)
+    self.stacks[path] = self.stacks.get(path, 0.0) + exclusive
+
+  def SortedFunctions(self):
+    """Returns the FunctionStats, the most expensive first."""
+    return sorted(self.functions.values(),
+                  key=lambda stats: (-stats.inclusive, stats.line))
+
+  def __str__(self):
+    lines = ['%8s %12s %12s  %s' % ('调用次数', '总时间（秒）', '自身时间（秒）',
+                                    '函数')]
+    for stats in self.SortedFunctions():
+      calls = ('%d' % (stats.calls,) if stats.calls == stats.primitive_calls
+               else '%d/%d' % (stats.calls, stats.primitive_calls))
+      lines.append('%8s %12.6f %12.6f  【%s】（第%d行）' % (
+          calls, stats.inclusive, stats.exclusive, stats.name, stats.line))
+    return '\n'.join(lines)
+
+  def _PstatsKey(self, key):
+    name, line = key
+    return (self.filename, line, name)
+
+  def WritePstats(self, path):
+    """Writes the results in the format that pstats.Stats() reads."""
+    stats_dict = {}
+    for stats in self.functions.values():
+      callers = {self._PstatsKey(caller): (cc, nc, tt, ct)
+                 for caller, (nc, cc, tt, ct) in stats.callers.items()}
+      stats_dict[self._PstatsKey(stats.Key())] = (
+          stats.primitive_calls, stats.calls, stats.exclusive,
+          stats.inclusive, callers)
+    with open(path, 'wb') as pstats_file:
+      marshal.dump(stats_dict, pstats_file)
+
+  def CollapsedStacks(self):
+    """Returns the stacks in the collapsed format flamegraph.pl reads.
+
+    Each line is a call stack joined by semicolons and the microseconds
+    spent in its last function.
+    """
+    return ''.join('%s %d\n' % (';'.join(path), round(seconds * 1e6))
+                   for path, seconds in sorted(self.stacks.items()))
+
+class HeatMap:
+  """Runs a dongbei program with a counter on every statement.
+
+  The program's output is in output, and counts maps a line of the source
+  to how many times the busiest statement starting on it ran.
+  """
+
+  def __init__(self, code):
+    self.source_lines = code.split('\n')
+    counted = []
+    py_code = dongbei.TranslateToPython(code, counted=counted)
+    statement_counts = array.array('q', [0]) * len(counted)
+    self.output = dongbei.ExecutePython(py_code, counts=statement_counts)
+    self.counts = {}
+    for stmt, count in zip(counted, statement_counts):
+      self.counts[stmt.line] = max(self.counts.get(stmt.line, 0), count)
+
+  def Hottest(self, n = 10):
+    """Returns the n lines that ran most, as (line, count), hottest first."""
+    return sorted(self.counts.items(),
+                  key=lambda item: (-item[1], item[0]))[:n]
+
+  def __str__(self):
+    width = max([len(str(count)) for count in self.counts.values()] + [1])
+    return '\n'.join(
+        '%4d %*s│%s' % (line, width, self.counts.get(line, ''), source_line)
+        for line, source_line in enumerate(self.source_lines, 1))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='dongbei语言的函数剖析器')
+  parser.add_argument('filepath', metavar='源程序文件名')
+  parser.add_argument('--pstats', metavar='结果.prof',
+                      help='把结果写成 pstats 文件')
+  parser.add_argument('--flamegraph', metavar='结果.folded',
+                      help='把折叠栈写出来，给 flamegraph.pl 画火焰图')
+  parser.add_argument('--heat', action='store_true',
+                      help='数每句话跑了几回，一行一行地说')
+  args = parser.parse_args()
+
+  with io.open(args.filepath, 'r', encoding='utf-8') as src_file:
+    code = src_file.read()
+  if args.heat:
+    heat_map = HeatMap(code)
+    sys.stdout.write(heat_map.output)
+    print('每行跑了几回：')
+    print('%s' % (heat_map,))
+    sys.exit(0)
+  profile = Profile(code, args.filepath)
+  sys.stdout.write(profile.output)
+  print('剖析结果：')
+  print('%s' % (profile,))
+  if args.pstats:
+    profile.WritePstats(args.pstats)
+  if args.flamegraph:
+    with io.open(args.flamegraph, 'w', encoding='utf-8') as folded_file:
+      folded_file.write(profile.CollapsedStacks())
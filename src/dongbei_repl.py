@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""dongbei语言的交互模式
+
+一句一句地敲，敲完一句跑一句。前头定义的活雷锋和套路后头接着用。
+一句话没说完（比如套路还没整完了）就接着敲下一行。
+
+每回只分词、解析和翻译新敲的这几句，跟前头敲了多少没关系，
+所以敲多久都不会越来越慢。
+
+用法：
+    dongbei_repl.py
+
+    repl = Repl()
+    repl.Feed('老王是活雷锋。老王装1。')
+    repl.Feed('唠唠：老王。')  # 打印 1
+"""
+
+import sys
+
+try:
+  from . import dongbei
+except ImportError:
+  import dongbei
+
+PROMPT = '老铁> '
+CONTINUATION_PROMPT = '  ..> '
+
+# The error the parser gives when the input ends in the middle of a
+# statement.
+_EARLY_END_ERROR = '语句结束太早。'
+
+class Repl:
+  """A dongbei session that runs code as it is entered.
+
+  All code runs in one namespace, so the variables and functions it
+  defines stay around for the code entered later.
+  """
+
+  def __init__(self, output = None, input_file = None):
+    self.output = output or sys.stdout
+    self.namespace = dongbei.NewNamespace(
+        self._Write, sys.stdin if input_file is None else input_file)
+    self._pending = ''  # The start of an unfinished statement.
+    # The names that are 本账 or arrays (without the 家) in the namespace,
+    # so that the 的 or 家 after them is a keyword in the code entered later.
+    self._map_names = set()
+    self._array_names = set()
+
+  def _Write(self, s):
+    self.output.write(s)
+
+  def NeedsMore(self):
+    """Returns whether the last line ended in the middle of a statement."""
+    return bool(self._pending)
+
+  def Reset(self):
+    """Drops the unfinished statement, if any."""
+    self._pending = ''
+
+  def Feed(self, line):
+    """Runs the statements finished by line.
+
+    Returns False if they are not finished yet, so more lines are needed.
+    Errors in the code are raised after dropping it, as SystemExit for
+    syntax errors and as other exceptions for runtime errors.
+    """
+    code = self._pending + line + '\n'
+    statements = self._Parse(code)
+    if statements is None:
+      self._pending = code
+      return False
+    self._pending = ''
+    py_code = dongbei.TranslateStatementsToPython(statements)
+    try:
+      exec(compile(py_code, '<dongbei>', 'exec'), self.namespace)
+    finally:
+      self._UpdateNames(statements)
+    return True
+
+  def _UpdateNames(self, statements):
+    """Keeps track of which names are 本账 or arrays after running
+    statements.
+    """
+    names = set()
+    for stmt in dongbei.WalkStatements(statements):
+      if stmt.kind == dongbei.STMT_IMPORT:
+        # The module may set any name. Imports are rare, so look at all.
+        names.update(list(dongbei.vars))
+        break
+      names.update(dongbei.TargetVarName(target)
+                   for target in dongbei.StatementParts(stmt)[0])
+    for name in names:
+      value = self.namespace.get(dongbei.GetPythonVarName(name))
+      if isinstance(value, dict):
+        self._map_names.add(name)
+      else:
+        self._map_names.discard(name)
+      if name.endswith(dongbei.KW_ARRAY) and len(name) > 1:
+        if isinstance(value, dongbei._DbArray):
+          self._array_names.add(name[:-len(dongbei.KW_ARRAY)])
+        else:
+          self._array_names.discard(name[:-len(dongbei.KW_ARRAY)])
+
+  def _Parse(self, code):
+    """Returns the statements in code, or None if code stops too early."""
+    tokens = list(dongbei.Tokenize(code, self._map_names,
+                                   self._array_names))
+    try:
+      statements, tokens = dongbei.ParseStmts(tokens)
+    except SystemExit as e:
+      if e.code == _EARLY_END_ERROR:
+        return None
+      self._pending = ''
+      raise
+    except IndexError:
+      # The parser looked past the last token.
+      return None
+    if tokens:
+      self._pending = ''
+      sys.exit('多余符号：%s' % (tokens[0],))
+    return statements
+
+def Main():
+  repl = Repl()
+  print('dongbei 交互模式。整完了就按 Ctrl-D。')
+  while True:
+    try:
+      line = input(CONTINUATION_PROMPT if repl.NeedsMore() else PROMPT)
+    except EOFError:
+      print()
+      return
+    except KeyboardInterrupt:
+      print()
+      repl.Reset()
+      continue
+    try:
+      repl.Feed(line)
+    except SystemExit as e:
+      print(e.code)
+    except KeyboardInterrupt:
+      print('不磨叽了。')
+    except Exception as e:
+      print('%s: %s' % (type(e).__name__, e))
+    sys.stdout.flush()
+
+if __name__ == '__main__':
+  Main()
@@ -0,0 +1,656 @@
+# -*- coding: utf-8 -*-
+
+"""dongbei语言的运行时
+
+翻译好的程序跑起来只要这个模块：把值变成字符串、一家子、本账、输入、
+步数和时间的预算，都在这儿。分词、解析和翻译都不在这儿，所以
+dongbei_build.py 事先编译好的程序，光有它就能跑。
+
+用法：
+    program = dongbei_runtime.Load('九九表')
+    output = program.Run()
+"""
+
+import array
+import concurrent.futures
+import functools
+import importlib.util
+import io
+import itertools
+import math
+import multiprocessing
+import operator
+import os
+import re
+import sys
+import time
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Joins the elements when an array or map is turned into a string, as
+# KW_CONCAT does in dongbei.py.
+_CONCAT = '、'
+
+def _dongbei_str(value):
+  """Converts a value to its dongbei string."""
+  if value is None:
+    return '啥也不是'
+  if type(value) == bool:
+    return '对' if value else '错'
+  return str(value)
+
+# Whole-array operations on arrays shorter than this do not use NumPy, as
+# converting would cost more than it saves.
+_NUMPY_MIN_SIZE = 256
+
+# Integers in array('q') storage are within (-_INT64_LIMIT, _INT64_LIMIT).
+_INT64_LIMIT = 1 << 63
+
+def _IsInteger(value):
+  return type(value) is int  # bool is not an integer here.
+
+class _DbArray:
+  """A dongbei array, as in 老李家. The first element is 老大, at index 1.
+
+  As long as every element is an integer that fits in 64 bits, the elements
+  are kept in a compact array('q'); anything else turns the storage into a
+  list. Arithmetic between arrays, or between an array and a number, works
+  element by element over the whole array at once, with NumPy if it is
+  installed.
+  """
+
+  __slots__ = ('_items',)
+
+  def __init__(self, items = ()):
+    if isinstance(items, _DbArray):
+      items = items._items
+    if isinstance(items, array.array):
+      self._items = array.array('q', items)
+      return
+    items = list(items)
+    if all(_IsInteger(item) for item in items):
+      try:
+        self._items = array.array('q', items)
+        return
+      except OverflowError:
+        pass
+    self._items = items
+
+  @staticmethod
+  def Of(*values):
+    """Makes the array for 老李家装values。
+
+    The elements of arrays among values are taken one by one, so 老李家装
+    老张家。 makes a copy and 老李家装老张家，五。 one more.
+    """
+    if len(values) == 1 and isinstance(values[0], _DbArray):
+      return _DbArray(values[0])
+    result = _DbArray()
+    result.Extend(*values)
+    return result
+
+  def Extend(self, *values):
+    """Adds values at the end, taking the elements of arrays one by one."""
+    for value in values:
+      if isinstance(value, _DbArray):
+        if (isinstance(self._items, array.array) and
+            not isinstance(value._items, array.array)):
+          self._items = list(self._items)
+        self._items.extend(value._items)
+        continue
+      if isinstance(self._items, array.array):
+        if _IsInteger(value):
+          try:
+            self._items.append(value)
+            continue
+          except OverflowError:
+            pass
+        self._items = list(self._items)
+      self._items.append(value)
+
+  def __len__(self):
+    return len(self._items)
+
+  def __iter__(self):
+    return iter(self._items)
+
+  def __eq__(self, other):
+    return (isinstance(other, _DbArray) and
+            len(self._items) == len(other._items) and
+            all(map(operator.eq, self._items, other._items)))
+
+  def __str__(self):
+    return _CONCAT.join(map(_dongbei_str, self._items))
+
+  def __repr__(self):
+    return '_DbArray(%r)' % (list(self._items),)
+
+  def _Index(self, n):
+    if not _IsInteger(n) or not 1 <= n <= len(self._items):
+      raise IndexError('没有老%s，一共才%d口人。' % (
+          _dongbei_str(n), len(self._items)))
+    return n - 1
+
+  def __getitem__(self, n):
+    return self._items[self._Index(n)]
+
+  def __setitem__(self, n, value):
+    i = self._Index(n)
+    if isinstance(self._items, array.array):
+      if _IsInteger(value):
+        try:
+          self._items[i] = value
+          return
+        except OverflowError:
+          pass
+      self._items = list(self._items)
+    self._items[i] = value
+
+  def __delitem__(self, n):
+    del self._items[self._Index(n)]
+
+  def _Bound(self):
+    """Returns the largest magnitude of the elements, as a Python int."""
+    values = numpy.frombuffer(self._items, dtype=numpy.int64)
+    return max(int(values.max()), -int(values.min()))
+
+  def _ApplyWithNumpy(self, other, op):
+    """Returns op over the elements with NumPy, or None if that won't do.
+
+    NumPy integers wrap around instead of growing, so NumPy is only used
+    when the result surely fits in 64 bits.
+    """
+    if (numpy is None or op not in (operator.add, operator.sub, operator.mul)
+        or len(self._items) < _NUMPY_MIN_SIZE
+        or not isinstance(self._items, array.array)):
+      return None
+    if isinstance(other, _DbArray):
+      if not isinstance(other._items, array.array):
+        return None
+      other_bound = other._Bound()
+      other_values = numpy.frombuffer(other._items, dtype=numpy.int64)
+    elif _IsInteger(other):
+      other_bound = abs(other)
+      other_values = other
+    else:
+      return None
+    bound = self._Bound()
+    if op is operator.mul:
+      result_bound = bound * other_bound
+    else:
+      result_bound = bound + other_bound
+    if result_bound >= _INT64_LIMIT:
+      return None
+    values = numpy.frombuffer(self._items, dtype=numpy.int64)
+    result = _DbArray()
+    result._items = array.array('q', op(values, other_values).tobytes())
+    return result
+
+  def _Apply(self, other, op, reflected = False):
+    """Applies op to every element, and the same element of other if it is
+    an array, or to other itself otherwise.
+    """
+    if isinstance(other, _DbArray):
+      if len(other._items) != len(self._items):
+        raise ValueError('两家人数不一样：%d口人和%d口人。' % (
+            len(self._items), len(other._items)))
+      others = other._items
+    else:
+      others = itertools.repeat(other)
+    if reflected:
+      return _DbArray(map(op, others, self._items))
+    result = self._ApplyWithNumpy(other, op)
+    if result is not None:
+      return result
+    return _DbArray(map(op, self._items, others))
+
+  def __add__(self, other):
+    return self._Apply(other, operator.add)
+
+  def __radd__(self, other):
+    return self._Apply(other, operator.add, reflected=True)
+
+  def __sub__(self, other):
+    return self._Apply(other, operator.sub)
+
+  def __rsub__(self, other):
+    return self._Apply(other, operator.sub, reflected=True)
+
+  def __mul__(self, other):
+    return self._Apply(other, operator.mul)
+
+  def __rmul__(self, other):
+    return self._Apply(other, operator.mul, reflected=True)
+
+  def __truediv__(self, other):
+    return self._Apply(other, operator.truediv)
+
+  def __rtruediv__(self, other):
+    return self._Apply(other, operator.truediv, reflected=True)
+
+  def _UseNumpy(self):
+    return (numpy is not None and len(self._items) >= _NUMPY_MIN_SIZE and
+            isinstance(self._items, array.array))
+
+  def Sum(self):
+    """一共: the sum of the elements."""
+    if (self._UseNumpy() and
+        self._Bound() * len(self._items) < _INT64_LIMIT):
+      return int(numpy.frombuffer(self._items, dtype=numpy.int64).sum())
+    return sum(self._items)
+
+  def Max(self):
+    """最大的: the largest element, or None if there is none."""
+    if not self._items:
+      return None
+    if self._UseNumpy():
+      return int(numpy.frombuffer(self._items, dtype=numpy.int64).max())
+    return max(self._items)
+
+  def Min(self):
+    """最小的: the smallest element, or None if there is none."""
+    if not self._items:
+      return None
+    if self._UseNumpy():
+      return int(numpy.frombuffer(self._items, dtype=numpy.int64).min())
+    return min(self._items)
+
+class _DbMap(dict):
+  """A dongbei map, as in 电话是本账。 Keys are kept in the order they came."""
+
+  __slots__ = ()
+
+  def __str__(self):
+    return _CONCAT.join('%s：%s' % (_dongbei_str(key), _dongbei_str(value))
+                          for key, value in self.items())
+
+class _DbInput:
+  """Reads the input of a dongbei program, one line or integer at a time.
+
+  Nothing is read before it is asked for, so programs can go through
+  inputs of any size.
+  """
+
+  # An integer, and the whitespace before it. Matched at a position in the
+  # line rather than on the rest of it, which would copy the rest every time.
+  _INTEGER_RE = re.compile(r'\s*(\S+)')
+
+  def __init__(self, file):
+    self._file = file
+    # The line that 听个数 has read part of, and where the rest starts.
+    self._line = None
+    self._pos = 0
+
+  def _NextLine(self):
+    if self._line is not None:
+      m = self._INTEGER_RE.match(self._line, self._pos)
+      line = self._line
+      self._line = None
+      if m:
+        return line[m.start(1):]
+    return self._file.readline()
+
+  def ReadLine(self):
+    """听一句: the rest of the current line, or the next line if there is
+    nothing left of it; None at the end of the input.
+    """
+    line = self._NextLine()
+    if not line:
+      return None
+    return line[:-1] if line.endswith('\n') else line
+
+  def ReadInt(self):
+    """听个数: the next whitespace-separated integer; None at the end of the
+    input.
+    """
+    m = None
+    if self._line is not None:
+      m = self._INTEGER_RE.match(self._line, self._pos)
+    while not m:
+      self._line = self._file.readline()
+      if not self._line:
+        self._line = None
+        return None
+      m = self._INTEGER_RE.match(self._line)
+    self._pos = m.end()
+    word = m.group(1)
+    try:
+      return int(word)
+    except ValueError:
+      raise ValueError('“%s”不是个数。' % (word,)) from None
+
+  def Lines(self):
+    """Yields the lines that are left, for 挨句听磨叽."""
+    while True:
+      line = self.ReadLine()
+      if line is None:
+        return
+      yield line
+
+  @staticmethod
+  def FileLines(path):
+    """Yields the lines of the file at path, for 从“文件”挨句听磨叽."""
+    with io.open(path, 'r', encoding='utf-8') as input_file:
+      for line in input_file:
+        yield line[:-1] if line.endswith('\n') else line
+
+class BudgetExceededError(Exception):
+  """Raised when a program runs out of its step budget or its time."""
+
+# How many budget checks to do between two looks at the clock.
+_DB_CLOCK_CHECK_INTERVAL = 64
+
+def _MakeBudgetCheck(max_steps, timeout, cancelled = None):
+  """Returns a function that charges one step to a new budget.
+
+  The budget allows max_steps steps and timeout seconds from now; None
+  means no limit. If cancelled is given, the budget also runs out once
+  cancelled() returns true; it is called as often as the clock is read.
+
+  The function's StepsLeft() tells how many steps are left, and its
+  Charge(steps) charges steps that were taken elsewhere, as in the worker
+  processes of 一块堆儿磨叽.
+  """
+  steps_left = math.inf if max_steps is None else max_steps
+  deadline = math.inf if timeout is None else time.monotonic() + timeout
+  clock_countdown = _DB_CLOCK_CHECK_INTERVAL
+  def CheckBudget():
+    nonlocal steps_left, clock_countdown
+    steps_left -= 1
+    if steps_left < 0:
+      raise BudgetExceededError('磨叽太久了：步数用完了。')
+    clock_countdown -= 1
+    if clock_countdown <= 0:
+      clock_countdown = _DB_CLOCK_CHECK_INTERVAL
+      if time.monotonic() > deadline:
+        raise BudgetExceededError('磨叽太久了：时间到了。')
+      if cancelled is not None and cancelled():
+        raise BudgetExceededError('磨叽太久了：不让磨叽了。')
+  def StepsLeft():
+    return steps_left
+  def Charge(steps):
+    nonlocal steps_left
+    steps_left -= steps
+    if steps_left < 0:
+      raise BudgetExceededError('磨叽太久了：步数用完了。')
+  CheckBudget.StepsLeft = StepsLeft
+  CheckBudget.Charge = Charge
+  return CheckBudget
+
+# How many worker processes 一块堆儿磨叽 uses. Starts out as the DONGBEI_JOBS
+# environment variable; None means one per CPU.
+PARALLEL_JOBS = int(os.environ['DONGBEI_JOBS']) if os.environ.get(
+    'DONGBEI_JOBS') else None
+
+# Each worker process gets this many chunks of the iterations on average,
+# so that one slow chunk does not hold up the rest for long.
+_PARALLEL_CHUNKS_PER_JOB = 4
+
+# Maps a number to the body of a 一块堆儿磨叽 that is running. Worker
+# processes are forked from the program, so they get it, and every variable
+# it reads, as they were when the loop started. Programs running in
+# different threads each have a number of their own.
+_parallel_bodies = {}
+_parallel_numbers = itertools.count()
+
+# Whether this process is a worker of a 一块堆儿磨叽. Workers run the
+# 一块堆儿磨叽 in the functions they call one iteration after another.
+_in_parallel_worker = False
+
+def _RunParallelChunk(number, items):
+  """Runs the body of 一块堆儿磨叽 number for items, in a worker process.
+
+  Returns (output, error, steps): the output of the iterations, the
+  exception that stopped them or None, and the budget steps they took. The
+  output of the iterations before the error still counts.
+  """
+  global _in_parallel_worker
+  _in_parallel_worker = True
+  body = _parallel_bodies[number]
+  namespace = body.__globals__
+  # The worker's budget is a copy of the program's, which the worker may
+  # have charged for other chunks already.
+  steps_left = namespace['_db_check_budget'].StepsLeft()
+  parts = []
+  write = namespace['_db_append_output']
+  namespace['_db_append_output'] = parts.append
+  try:
+    for item in items:
+      body(item)
+  except Exception as e:
+    return ''.join(parts), e, 0
+  finally:
+    namespace['_db_append_output'] = write
+  if steps_left == math.inf:  # No limit.
+    return ''.join(parts), None, 0
+  return (''.join(parts), None,
+          steps_left - namespace['_db_check_budget'].StepsLeft())
+
+def _WorkerPool(items, jobs = None):
+  """Returns (executor, chunks) to run the items in worker processes, or
+  None if they had better run here: without fork, with one CPU, or in a
+  worker already.
+
+  jobs is the number of worker processes, PARALLEL_JOBS if None. The
+  workers are forked, so they start with what this process has.
+  """
+  jobs = jobs or PARALLEL_JOBS or os.cpu_count() or 1
+  if (jobs < 2 or len(items) < 2 or _in_parallel_worker or
+      'fork' not in multiprocessing.get_all_start_methods()):
+    return None
+  chunk_size = -(-len(items) // (jobs * _PARALLEL_CHUNKS_PER_JOB))
+  chunks = [items[i:i + chunk_size]
+            for i in range(0, len(items), chunk_size)]
+  executor = concurrent.futures.ProcessPoolExecutor(
+      min(jobs, len(chunks)), mp_context=multiprocessing.get_context('fork'))
+  return executor, chunks
+
+def _db_parallel(body, items):
+  """Runs body(item) for every item in the range items, for 一块堆儿磨叽.
+
+  The items are split into chunks that worker processes run at the same
+  time. Their output comes out in the order of the items, as if they ran
+  one after another. Without fork, with one CPU, or in a worker already,
+  they do.
+
+  Returns the last item as a range, or an empty range if there are no
+  items, so that looping over it leaves the loop variable as 磨叽 does.
+  """
+  pool = _WorkerPool(items)
+  if pool is None:
+    for item in items:
+      body(item)
+    return items[-1:]
+
+  write = body.__globals__['_db_append_output']
+  check_budget = body.__globals__['_db_check_budget']
+  executor, chunks = pool
+  number = next(_parallel_numbers)
+  _parallel_bodies[number] = body
+  try:
+    for output, error, steps in executor.map(
+        functools.partial(_RunParallelChunk, number), chunks):
+      # Every worker has the whole budget that was left, so the steps of
+      # all chunks together are charged here.
+      if error is None:
+        check_budget.Charge(steps)
+      if output:
+        write(output)
+      if error is not None:
+        raise error
+  finally:
+    del _parallel_bodies[number]
+    # Drop the chunks that have not started, if one failed.
+    executor.shutdown(cancel_futures=True)
+  return items[-1:]
+
+# Maps a number to the function that a CallMany() is calling, with the
+# budget of each call: (function, max_steps, timeout). Worker processes are
+# forked with it, and the namespace it runs in.
+_many_calls = {}
+_many_call_numbers = itertools.count()
+
+def _CallEach(number, args_list):
+  """Calls the function of CallMany() number with each tuple in args_list.
+
+  Returns (results, error): the results of the calls, and the exception
+  that stopped them or None.
+  """
+  function, max_steps, timeout = _many_calls[number]
+  namespace = function.__globals__
+  results = []
+  try:
+    for args in args_list:
+      # Each call gets a budget of its own, as each Run() does.
+      namespace['_db_check_budget'] = _MakeBudgetCheck(max_steps, timeout)
+      results.append(function(*args))
+  except Exception as e:
+    return results, e
+  return results, None
+
+def _CallChunk(number, args_list):
+  """Runs _CallEach() in a worker process."""
+  global _in_parallel_worker
+  _in_parallel_worker = True
+  return _CallEach(number, args_list)
+
+def _CallMany(function, args_list, jobs, max_steps, timeout):
+  """Returns the results of function(*args) for each tuple in args_list,
+  in order, calling it in jobs worker processes (see _WorkerPool()).
+
+  Raises the exception of the first call that fails.
+  """
+  args_list = list(args_list)
+  number = next(_many_call_numbers)
+  _many_calls[number] = (function, max_steps, timeout)
+  try:
+    pool = _WorkerPool(args_list, jobs)
+    if pool is None:
+      results, error = _CallEach(number, args_list)
+      if error is not None:
+        raise error
+      return results
+    executor, chunks = pool
+    try:
+      results = []
+      for chunk_results, error in executor.map(
+          functools.partial(_CallChunk, number), chunks):
+        if error is not None:
+          raise error
+        results.extend(chunk_results)
+      return results
+    finally:
+      # Drop the chunks that have not started, if one failed.
+      executor.shutdown(cancel_futures=True)
+  finally:
+    del _many_calls[number]
+
+def NewNamespace(write, input_file, max_steps = None, timeout = None):
+  """Returns a fresh namespace to run translated code in.
+
+  The code's output goes to write(), and its input comes from input_file.
+  """
+  return {
+      '_dongbei_str': _dongbei_str,
+      '_DbArray': _DbArray,
+      '_DbMap': _DbMap,
+      '_DbInput': _DbInput,
+      '_db_input': _DbInput(input_file),
+      '_db_append_output': write,
+      '_db_check_budget': _MakeBudgetCheck(max_steps, timeout),
+      '_db_import': _db_import,
+      '_db_parallel': _db_parallel,
+      }
+
+def _LoadCode(name):
+  """Returns the code object of the built module name, without running it."""
+  spec = importlib.util.find_spec(name)
+  if spec is None or spec.loader is None:
+    sys.exit('翠花上不了%s：哪儿都没有编译好的 %s。' % (name, name))
+  return spec.loader.get_code(name)
+
+def _db_import(name, namespace, budget):
+  """Runs the built module name in the namespace of the importing program.
+
+  Each module runs at most once per run of the program.
+  """
+  imported = namespace.setdefault('_db_imported', set())
+  if name in imported:
+    return
+  # Mark the module first, so that modules that import each other work.
+  imported.add(name)
+  exec(_LoadCode(name), namespace)
+
+class Program:
+  """A compiled dongbei program, which can be run any number of times.
+
+  Every Run() starts from scratch: variables set by one run are not seen by
+  the next, and runs in different threads do not get in each other's way.
+  """
+
+  def __init__(self, code_object, budget):
+    self.code_object = code_object
+    self.budget = budget  # Whether the code has budget checks.
+
+  def Run(self, output = None, max_steps = None, timeout = None,
+          input_file = None):
+    """Runs the program and returns its output.
+
+    If output (a file-like object) is given, the output is written to it as
+    the program runs instead, and None is returned.
+
+    The program reads its input from input_file, or from the standard input
+    if it is None.
+
+    max_steps and timeout limit the number of loop iterations plus function
+    calls and the wall-clock seconds, but only if the program has budget
+    checks.
+    """
+    if input_file is None:
+      input_file = sys.stdin
+    if output is None:
+      parts = []
+      self._Execute(parts.append, max_steps, timeout, input_file)
+      return ''.join(parts)
+    self._Execute(output.write, max_steps, timeout, input_file)
+    return None
+
+  def _Execute(self, write, max_steps, timeout, input_file):
+    exec(self.code_object,
+         self._NewNamespace(write, input_file, max_steps, timeout))
+
+  def _CallMany(self, name, args_list, jobs, max_steps, timeout):
+    """Runs the program, and returns the results of calling the function
+    it defines as name, in the translated code, with each tuple in
+    args_list, as in _CallMany(). Returns None if there is no such
+    function.
+
+    The program and the calls read no input, and what they say is dropped.
+    """
+    namespace = self._NewNamespace(lambda text: None, io.StringIO(),
+                                   max_steps, timeout)
+    exec(self.code_object, namespace)
+    function = namespace.get(name)
+    if not callable(function):
+      return None
+    return _CallMany(function, args_list, jobs, max_steps, timeout)
+
+  _NewNamespace = staticmethod(NewNamespace)
+
+def _UsesName(code_object, name):
+  """Returns whether code_object or any function in it uses name."""
+  return name in code_object.co_names or any(
+      _UsesName(const, name) for const in code_object.co_consts
+      if hasattr(const, 'co_names'))
+
+def Load(name):
+  """Returns the Program built by dongbei_build.py as module name.
+
+  The module is found like any Python module, and its code is loaded from
+  the .pyc file if there is an up-to-date one.
+  """
+  code_object = _LoadCode(name)
+  return Program(code_object, _UsesName(code_object, '_db_check_budget'))
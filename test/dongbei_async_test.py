@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+from src.dongbei_async import AsyncRunner
+from src.dongbei_async import CompileError
+
+class DongbeiAsyncTest(unittest.TestCase):
+  def testCompile(self):
+    async def Compile():
+      async with AsyncRunner() as runner:
+        return await runner.Compile('唠唠：五加二。')
+    self.assertIn('5 + 2', asyncio.run(Compile()))
+
+  def testCompileError(self):
+    async def Compile():
+      async with AsyncRunner() as runner:
+        return await runner.Compile('唠唠：五加二')
+    with self.assertRaises(CompileError):
+      asyncio.run(Compile())
+
+  def testRun(self):
+    async def RunAll():
+      async with AsyncRunner(max_concurrency=2) as runner:
+        return await asyncio.gather(
+            runner.Run('唠唠：“这旮旯儿嗷嗷美好哇！”。'),
+            runner.Run('老张从1到3磨叽：唠唠：老张。磨叽完了。'),
+            runner.Run('唠唠：五乘二。'))
+    self.assertEqual(asyncio.run(RunAll()),
+                     ['这旮旯儿嗷嗷美好哇！\n', '1\n2\n3\n', '10\n'])
+
+  def testImport(self):
+    async def RunBoth():
+      async with AsyncRunner(process_workers=1) as runner:
+        # The worker is already running when the program is translated.
+        await runner.Run('唠唠：1。')
+        # Only this process knows this name, not the worker.
+        await runner.Run('这边才有的名字装1。')
+        return await runner.Run('翠花，上工具。唠唠：整【加个一】（41）。')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      with open(os.path.join(tmp_dir, '工具.dongbei'), 'w',
+                encoding='utf-8') as f:
+        f.write('【加个一】（几）咋整：滚犊子吧几加1。整完了。')
+      with unittest.mock.patch.object(dongbei, 'MODULE_PATH', [tmp_dir]):
+        self.assertEqual(asyncio.run(RunBoth()), '42\n')
+
+  def testRunTimeout(self):
+    async def RunForever():
+      async with AsyncRunner() as runner:
+        return await runner.Run('老张从1到100000000000磨叽：磨叽完了。',
+                                timeout=0.2)
+    with self.assertRaises(asyncio.TimeoutError):
+      asyncio.run(RunForever())
+
+  def testRunExceedsStepBudget(self):
+    async def RunLong():
+      async with AsyncRunner() as runner:
+        return await runner.Run('老张从1到100磨叽：磨叽完了。', max_steps=10)
+    with self.assertRaises(dongbei.BudgetExceededError):
+      asyncio.run(RunLong())
+
+  def testCancel(self):
+    async def RunAndCancel():
+      async with AsyncRunner() as runner:
+        task = asyncio.create_task(
+            runner.Run('老张从1到100000000000磨叽：磨叽完了。', timeout=1))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await task
+    with self.assertRaises(asyncio.CancelledError):
+      asyncio.run(RunAndCancel())
+
+  def testCancelWithoutBudget(self):
+    async def RunAndCancel():
+      async with AsyncRunner(process_workers=1) as runner:
+        task = asyncio.create_task(
+            runner.Run('老张从1到100000000000磨叽：磨叽完了。'))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+          await task
+        # The only worker process is free again.
+        return await asyncio.wait_for(runner.Run('唠唠：五乘二。'), 5)
+    self.assertEqual(asyncio.run(RunAndCancel()), '10\n')
+
+  def testRunsAreIsolated(self):
+    async def RunBoth():
+      async with AsyncRunner(process_workers=1) as runner:
+        self.assertEqual(await runner.Run('老王装1。唠唠：老王。'), '1\n')
+        await runner.Run('唠唠：老王。')
+    with self.assertRaises(NameError):
+      asyncio.run(RunBoth())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.dongbei_build import Build
+
+PROGRAM = '''
+翠花，上工具。
+唠唠：整【加倍】（听个数）。
+老王从1到3磨叽：
+  唠唠：老王。
+磨叽完了。
+'''
+
+MODULE = '''
+【加倍】（几）咋整：
+  滚犊子吧几乘二。
+整完了。
+'''
+
+class DongbeiBuildTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.src_dir = os.path.join(self.tmp_dir.name, 'src')
+    self.output_dir = os.path.join(self.tmp_dir.name, 'out')
+    os.mkdir(self.src_dir)
+    for name, code in (('主', PROGRAM), ('工具', MODULE)):
+      with io.open(os.path.join(self.src_dir, name + '.dongbei'), 'w',
+                   encoding='utf-8') as f:
+        f.write(code)
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def Build(self, budget = False):
+    return Build([os.path.join(self.src_dir, '主.dongbei')], self.output_dir,
+                 budget)
+
+  def RunPython(self, *args):
+    """Runs Python in the output directory, without the translator."""
+    return subprocess.run(
+        [sys.executable, '-E', '-s'] + list(args), cwd=self.output_dir,
+        input='21\n', capture_output=True, encoding='utf-8', check=True).stdout
+
+  def testBuild(self):
+    written = self.Build()
+    self.assertEqual(
+        [os.path.basename(path) for path in written],
+        ['主.py', '工具.py', 'dongbei_runtime.py'])
+    self.assertTrue(all(os.path.exists(
+        os.path.join(self.output_dir, '__pycache__',
+                     '%s.%s.pyc' % (name, sys.implementation.cache_tag)))
+        for name in ('主', '工具', 'dongbei_runtime')))
+
+  def testRunWithRuntimeOnly(self):
+    self.Build()
+    self.assertEqual(self.RunPython('-c', '''
+import sys
+import dongbei_runtime
+program = dongbei_runtime.Load('主')
+print(repr(program.Run()), program.budget)
+print(sorted(name for name in sys.modules if 'dongbei' in name))
+'''), "'42\\n1\\n2\\n3\\n' False\n['dongbei_runtime']\n")
+
+  def testRunModuleDirectly(self):
+    self.Build()
+    self.assertEqual(self.RunPython('主.py'), '42\n1\n2\n3\n')
+
+  def testBuildWithBudget(self):
+    self.Build(budget=True)
+    self.assertEqual(self.RunPython('-c', '''
+import dongbei_runtime
+program = dongbei_runtime.Load('主')
+try:
+  program.Run(max_steps=2)
+except dongbei_runtime.BudgetExceededError as e:
+  print(program.budget, e)
+'''), 'True 磨叽太久了：步数用完了。\n')
+
+if __name__ == '__main__':
+  unittest.main()
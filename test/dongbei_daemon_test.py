@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+from src.dongbei_daemon import DaemonServer
+from src.dongbei_daemon import Request
+
+class DongbeiDaemonTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.socket_path = os.path.join(self.tmp_dir.name, 'dongbei.sock')
+    self.server = DaemonServer(self.socket_path, workers=2, cache_size=2)
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.start()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.thread.join()
+    self.server.Close()
+    self.tmp_dir.cleanup()
+
+  def testRun(self):
+    self.assertEqual(
+        Request({'op': 'run', 'code': '唠唠：五加二。'}, self.socket_path),
+        {'ok': True, 'output': '7\n', 'cached': False})
+    self.assertEqual(
+        Request({'op': 'run', 'code': '唠唠：五加二。'}, self.socket_path),
+        {'ok': True, 'output': '7\n', 'cached': True})
+
+  def testRunsAreIsolated(self):
+    for _ in range(3):
+      self.assertEqual(
+          Request({'op': 'run', 'code': '老王装1。唠唠：老王。'},
+                  self.socket_path)['output'], '1\n')
+      response = Request({'op': 'run', 'code': '唠唠：老王。'},
+                         self.socket_path)
+      self.assertFalse(response['ok'])
+      self.assertIn('NameError', response['error'])
+
+  def testCacheIsBounded(self):
+    for code in ('唠唠：1。', '唠唠：2。', '唠唠：3。'):
+      Request({'op': 'run', 'code': code}, self.socket_path)
+    self.assertEqual(len(self.server.cache), 2)
+    response = Request({'op': 'run', 'code': '唠唠：1。'}, self.socket_path)
+    self.assertFalse(response['cached'])
+
+  def testCompile(self):
+    response = Request({'op': 'compile', 'code': '唠唠：五加二。'},
+                       self.socket_path)
+    self.assertTrue(response['ok'])
+    self.assertIn('5 + 2', response['python'])
+
+  def testErrors(self):
+    self.assertFalse(
+        Request({'op': 'run', 'code': '唠唠：五加二'}, self.socket_path)['ok'])
+    response = Request({'op': 'run', 'timeout': 0.1,
+                        'code': '老张从1到100000000000磨叽：磨叽完了。'},
+                       self.socket_path)
+    self.assertFalse(response['ok'])
+    self.assertIn('BudgetExceededError', response['error'])
+    self.assertFalse(Request({'op': '嘎哈'}, self.socket_path)['ok'])
+
+  def testImport(self):
+    with open(os.path.join(self.tmp_dir.name, '工具.dongbei'), 'w',
+              encoding='utf-8') as f:
+      f.write('【加一】（几）咋整：滚犊子吧几加1。整完了。')
+    with unittest.mock.patch.object(dongbei, 'MODULE_PATH',
+                                    [self.tmp_dir.name]):
+      # The workers are already running when the program is translated.
+      Request({'op': 'run', 'code': '唠唠：1。'}, self.socket_path)
+      # Only the daemon knows this name, not the workers.
+      Request({'op': 'run', 'code': '才有的名字装1。'}, self.socket_path)
+      self.assertEqual(
+          Request({'op': 'run', 'code': '翠花，上工具。唠唠：整【加一】（41）。'},
+                  self.socket_path),
+          {'ok': True, 'output': '42\n', 'cached': False})
+
+  def testCloseStopsRunningRequests(self):
+    responses = []
+    client = threading.Thread(target=lambda: responses.append(Request(
+        {'op': 'run', 'code': '老张从1到100000000000磨叽：磨叽完了。'},
+        self.socket_path)))
+    client.start()
+    time.sleep(0.5)  # Let the program start.
+    self.server.shutdown()
+    self.thread.join()
+    closer = threading.Thread(target=self.server.Close)
+    closer.start()
+    closer.join(10)
+    self.assertFalse(closer.is_alive())
+    client.join(10)
+    self.assertFalse(responses[0]['ok'])
+    self.assertIn('BudgetExceededError', responses[0]['error'])
+
+  def testShutdownRequest(self):
+    self.assertEqual(Request({'op': 'shutdown'}, self.socket_path),
+                     {'ok': True})
+    self.thread.join()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.dongbei import BudgetExceededError
+from src.dongbei_prefork import JobError
+from src.dongbei_prefork import PreforkPool
+
+class DongbeiPreforkTest(unittest.TestCase):
+  def setUp(self):
+    self.pool = PreforkPool(size=2)
+    self.pool.Precompile('阶乘', '''
+【阶乘】（几）咋整：
+寻思：几比一小吗？
+要行咧就滚犊子吧一。
+滚犊子吧几乘整【阶乘】（几减一）。
+整完了。
+
+唠唠：整【阶乘】（五）。
+        ''')
+    self.pool.Start()
+
+  def tearDown(self):
+    self.pool.Close()
+
+  def testRunCode(self):
+    self.assertEqual(self.pool.Run('唠唠：五加二。'), '7\n')
+
+  def testRunPrecompiled(self):
+    self.assertEqual(self.pool.Run(name='阶乘'), '120\n')
+    self.assertEqual(self.pool.Run(name='阶乘', max_steps=100), '120\n')
+    with self.assertRaises(JobError):
+      self.pool.Run(name='阶乘', max_steps=2)
+    with self.assertRaises(JobError):
+      self.pool.Run(name='九九表')
+
+  def testJobsAreIsolated(self):
+    self.assertEqual(self.pool.Run('老王是活雷锋。老王装二。唠唠：老王。'), '2\n')
+    with self.assertRaises(JobError):
+      self.pool.Run('唠唠：老王。')
+
+  def testJobsRunInParallel(self):
+    jobs = [self.pool.Submit('唠唠：%d。' % (i,)) for i in range(5)]
+    self.assertEqual([job.Result() for job in jobs],
+                     ['%d\n' % (i,) for i in range(5)])
+
+  def testErrors(self):
+    with self.assertRaises(JobError):
+      self.pool.Run('唠唠：五加二')
+    with self.assertRaisesRegex(JobError, BudgetExceededError.__name__):
+      self.pool.Run('老张从1到100000000000磨叽：磨叽完了。', timeout=0.1)
+
+if __name__ == '__main__':
+  unittest.main()
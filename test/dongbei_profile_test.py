@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import pstats
+import sys
+import tempfile
+import unittest.mock
+import unittest
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+from src.dongbei_profile import HeatMap
+from src.dongbei_profile import Profile
+from src.dongbei_profile import TOP_LEVEL_NAME
+
+CODE = '''【阶乘】（几）咋整：
+  寻思：几比一小吗？
+  要行咧就滚犊子吧一。
+  滚犊子吧几乘整【阶乘】（几减一）。
+整完了。
+
+【打招呼】咋整：
+  唠唠：“你好”。
+整完了。
+
+整【打招呼】。
+整【打招呼】。
+唠唠：整【阶乘】（三）。
+'''
+
+class DongbeiProfileTest(unittest.TestCase):
+  def setUp(self):
+    self.profile = Profile(CODE, 'test.dongbei')
+
+  def testOutput(self):
+    self.assertEqual(self.profile.output, '你好\n你好\n6\n')
+
+  def testCallCounts(self):
+    functions = self.profile.functions
+    self.assertEqual(sorted(functions),
+                     [('打招呼', 7), ('阶乘', 1), (TOP_LEVEL_NAME, 1)])
+    self.assertEqual(functions[('打招呼', 7)].calls, 2)
+    self.assertEqual(functions[('打招呼', 7)].primitive_calls, 2)
+    self.assertEqual(functions[('阶乘', 1)].calls, 4)
+    self.assertEqual(functions[('阶乘', 1)].primitive_calls, 1)
+    self.assertEqual(functions[('阶乘', 1)].callers,
+                     {(TOP_LEVEL_NAME, 1): [1, 1, unittest.mock.ANY,
+                                            unittest.mock.ANY],
+                      ('阶乘', 1): [3, 0, unittest.mock.ANY,
+                                    unittest.mock.ANY]})
+
+  def testTimes(self):
+    top = self.profile.functions[(TOP_LEVEL_NAME, 1)]
+    for stats in self.profile.functions.values():
+      self.assertLessEqual(stats.exclusive, stats.inclusive)
+      self.assertLessEqual(stats.inclusive, top.inclusive)
+
+  def testCollapsedStacks(self):
+    stacks = [line.rsplit(' ', 1)[0]
+              for line in self.profile.CollapsedStacks().splitlines()]
+    self.assertEqual(stacks, [
+        TOP_LEVEL_NAME,
+        TOP_LEVEL_NAME + ';打招呼',
+        TOP_LEVEL_NAME + ';阶乘',
+        TOP_LEVEL_NAME + ';阶乘;阶乘',
+        TOP_LEVEL_NAME + ';阶乘;阶乘;阶乘',
+        TOP_LEVEL_NAME + ';阶乘;阶乘;阶乘;阶乘'])
+
+  def testWritePstats(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      path = os.path.join(tmp_dir, 'test.prof')
+      self.profile.WritePstats(path)
+      stats = pstats.Stats(path).stats
+    self.assertEqual(stats[('test.dongbei', 1, '阶乘')][:2], (1, 4))
+    self.assertEqual(stats[('test.dongbei', 7, '打招呼')][:2], (2, 2))
+
+  def testSmallFunctionsAreNotInlined(self):
+    functions = Profile('''【平方】（几）咋整：滚犊子吧几乘几。整完了。
+【跑】咋整：
+  和装0。
+  老王从1到1000磨叽：和装和加整【平方】（老王）。磨叽完了。
+  滚犊子吧和。
+整完了。
+唠唠：整【跑】。
+''').functions
+    self.assertEqual(functions[('平方', 1)].calls, 1000)
+
+class DongbeiHeatMapTest(unittest.TestCase):
+  def setUp(self):
+    self.heat_map = HeatMap(CODE)
+
+  def testOutput(self):
+    self.assertEqual(self.heat_map.output, '你好\n你好\n6\n')
+
+  def testCounts(self):
+    self.assertEqual(self.heat_map.counts,
+                     {1: 1, 2: 4, 3: 1, 4: 3, 7: 1, 8: 2, 11: 1, 12: 1, 13: 1})
+    self.assertEqual(self.heat_map.Hottest(2), [(2, 4), (4, 3)])
+
+  def testReport(self):
+    lines = str(self.heat_map).split('\n')
+    self.assertEqual(lines[1], '   2 4│  寻思：几比一小吗？')
+    self.assertEqual(lines[5], '   6  │')
+
+  def testNoCountersByDefault(self):
+    self.assertNotIn('_db_counts', dongbei.TranslateToPython(CODE))
+    counted = []
+    self.assertIn('_db_counts[8] += 1',
+                  dongbei.TranslateToPython(CODE, counted=counted))
+    self.assertEqual(len(counted), 9)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import tempfile
+import unittest.mock
+import unittest
+
+# Add the repo root to the Python module path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import dongbei
+from src.dongbei_repl import Repl
+
+class DongbeiReplTest(unittest.TestCase):
+  def setUp(self):
+    self.output = io.StringIO()
+    self.repl = Repl(self.output, io.StringIO('3\n'))
+
+  def Feed(self, *lines):
+    """Feeds the lines and returns what they output."""
+    start = len(self.output.getvalue())
+    for line in lines:
+      self.repl.Feed(line)
+    return self.output.getvalue()[start:]
+
+  def testKeepsState(self):
+    self.assertEqual(self.Feed('老王是活雷锋。', '老王装听个数。'), '')
+    self.assertEqual(self.Feed('唠唠：老王。'), '3\n')
+    self.assertEqual(self.Feed('老王走走。唠唠：老王。'), '4\n')
+
+  def testMultiLineStatement(self):
+    self.assertFalse(self.repl.Feed('【加倍】（几）咋整：'))
+    self.assertTrue(self.repl.NeedsMore())
+    self.assertFalse(self.repl.Feed('  滚犊子吧几乘二。'))
+    self.assertTrue(self.repl.Feed('整完了。'))
+    self.assertFalse(self.repl.NeedsMore())
+    self.assertEqual(self.Feed('唠唠：整【加倍】（21）。'), '42\n')
+    self.assertEqual(self.Feed('唠唠：整【加倍】', '（1）。'), '2\n')
+
+  def testErrorsDoNotEndSession(self):
+    self.Feed('老王是活雷锋。老王装1。')
+    with self.assertRaises(ZeroDivisionError):
+      self.Feed('唠唠：老王除以0。')
+    with self.assertRaises(SystemExit):
+      self.Feed('整完了。')
+    self.assertFalse(self.repl.NeedsMore())
+    self.assertEqual(self.Feed('唠唠：老王。'), '1\n')
+
+  def testCompilesOnlyNewCode(self):
+    self.Feed('【一】咋整：滚犊子吧1。整完了。')
+    for i in range(100):
+      self.Feed('【变量%d】是活雷锋。' % (i,))
+    with unittest.mock.patch.object(
+        dongbei, 'Tokenize', wraps=dongbei.Tokenize) as tokenize:
+      self.assertEqual(self.Feed('唠唠：整【一】。'), '1\n')
+    tokenize.assert_called_once_with('唠唠：整【一】。\n', set(), set())
+
+  def testLookupInMapFromEarlierLine(self):
+    self.Feed('电话是本账。我的钱装1。')
+    self.Feed('电话的“老王”装1。')
+    self.Feed('人装“老王”。')
+    self.assertEqual(self.Feed('唠唠：电话的人、我的钱。'), '11\n')
+    self.Feed('电话装5。')
+    self.assertEqual(self.Feed('电话的人装2。唠唠：电话的人。'), '2\n')
+
+  def testArrayFromEarlierLine(self):
+    self.Feed('老李家装1，2。专家装5。')
+    self.assertEqual(self.Feed('唠唠：老李家乘二、专家。'), '2、45\n')
+
+  def testLookupInImportedMap(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      with io.open(os.path.join(tmp_dir, '通讯录.dongbei'), 'w',
+                   encoding='utf-8') as f:
+        f.write('号码是本账。号码的“老王”装“110”。')
+      with unittest.mock.patch.object(dongbei, 'MODULE_PATH', [tmp_dir]):
+        self.Feed('翠花，上通讯录。')
+    self.Feed('人装“老王”。')
+    self.assertEqual(self.Feed('唠唠：号码的人。'), '110\n')
+
+if __name__ == '__main__':
+  unittest.main()
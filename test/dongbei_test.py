@@ -1,18 +1,34 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import concurrent.futures
+import io
+import json
 import os
+import re
+import subprocess
 import sys
+import tempfile
 import unittest
+import unittest.mock
 
 # Add the repo root to the Python module path.
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from src import dongbei
+from src import dongbei_runtime
+from src.dongbei import AggregationExpr
 from src.dongbei import ArithmeticExpr
+from src.dongbei import ArrayExpr
 from src.dongbei import LiteralExpr
+from src.dongbei import LookupExpr
+from src.dongbei import MapExpr
+from src.dongbei import ModuleCache
 from src.dongbei import BasicTokenize
+from src.dongbei import BudgetExceededError
 from src.dongbei import CallExpr
+from src.dongbei import Compile
+from src.dongbei import IndexExpr
 from src.dongbei import ComparisonExpr
 from src.dongbei import ConcatExpr
 from src.dongbei import Keyword
@@ -23,13 +39,20 @@ from src.dongbei import ParseInteger
 from src.dongbei import ParseStmtFromStr
 from src.dongbei import ParseToAst
 from src.dongbei import Run
+from src.dongbei import RunBatch
+from src.dongbei import RunFileForBatch
+from src.dongbei import RunStats
 from src.dongbei import STMT_ASSIGN
 from src.dongbei import STMT_CALL
 from src.dongbei import STMT_CONDITIONAL
 from src.dongbei import STMT_DEC_BY
+from src.dongbei import STMT_DELETE_ELEMENT
+from src.dongbei import STMT_FOREACH
 from src.dongbei import STMT_FUNC_DEF
+from src.dongbei import STMT_IMPORT
 from src.dongbei import STMT_INC_BY
 from src.dongbei import STMT_LOOP
+from src.dongbei import STMT_PARALLEL_LOOP
 from src.dongbei import STMT_SAY
 from src.dongbei import Statement
 from src.dongbei import TK_CHAR
@@ -203,6 +226,17 @@ class DongbeiParseStatementTest(unittest.TestCase):
                    None
                   )))
   
+  def testStatementLines(self):
+    statements = ParseToAst('''老王是活雷锋。
+# 注释
+老王装“哈
+哈”。  唠唠：老王。
+寻思：老王比五大吗？
+要行咧就唠唠：老王。
+''')
+    self.assertEqual([s.line for s in statements], [1, 3, 4, 5])
+    self.assertEqual(statements[3].value[1].line, 6)
+
 class DongbeiTest(unittest.TestCase):
   def testRunEmptyProgram(self):
     self.assertEqual(Run(''), '')
@@ -311,6 +345,11 @@ class DongbeiTest(unittest.TestCase):
          Keyword('”'),
          Keyword('。')])
 
+  def testTokenLines(self):
+    self.assertEqual(
+        [token.line for token in Tokenize('唠唠：\n“你\n好”\n。【老\n王】走走。')],
+        [1, 1, 2, 2, 3, 4, 4, 5, 5])
+
   def testTokenizeArithmetic(self):
     self.assertEqual(
         list(Tokenize('250加13减二乘五除以九')),
@@ -714,6 +753,1232 @@ class DongbeiTest(unittest.TestCase):
         Run('【加一】（几）咋整：唠唠：几加一！整完了！\n'
                     '整【加一】（五）！'),
         '6\n')
-    
+
+class DongbeiBudgetTest(unittest.TestCase):
+  def testRunWithinBudget(self):
+    self.assertEqual(
+        Run('老张从1到3磨叽：唠唠：老张。磨叽完了。', max_steps=3),
+        '1\n2\n3\n')
+
+  def testLoopExceedsStepBudget(self):
+    with self.assertRaises(BudgetExceededError):
+      Run('老张从1到100磨叽：唠唠：老张。磨叽完了。', max_steps=3)
+    # The output up to the point of stopping is kept.
+    self.assertEqual(dongbei._db_output, '1\n2\n3\n')
+
+  def testRecursionExceedsStepBudget(self):
+    with self.assertRaises(BudgetExceededError):
+      Run('''
+【阶乘】（几）咋整：
+寻思：几比一小吗？
+要行咧就滚犊子吧一。
+滚犊子吧几乘整【阶乘】（几减一）。
+整完了。
+
+唠唠：整【阶乘】（50）。
+          ''', max_steps=20)
+
+  def testLoopExceedsTimeout(self):
+    with self.assertRaises(BudgetExceededError):
+      Run('老张从1到100000000000磨叽：磨叽完了。', timeout=0.05)
+
+  def testNoBudgetChecksByDefault(self):
+    self.assertNotIn(
+        '_db_check_budget',
+        dongbei.TranslateTokensToPython(
+            list(Tokenize('老张从1到3磨叽：磨叽完了。'))))
+
+class DongbeiStatsTest(unittest.TestCase):
+  def testRunWithStats(self):
+    stats = RunStats()
+    self.assertEqual(
+        Run('老张是活雷锋。老张装二。唠唠：老张。', stats=stats), '2\n')
+    self.assertEqual(sorted(stats.seconds),
+                     ['compile', 'execute', 'parse', 'tokenize', 'translate'])
+    self.assertEqual(stats.token_count, 11)
+    self.assertEqual(stats.statement_count, 3)
+    self.assertGreater(stats.python_code_size, 0)
+    self.assertEqual(stats.output_size, 2)
+    self.assertEqual(stats.ToDict()['statement_count'], 3)
+    self.assertIn('语句：3 句', str(stats))
+
+  def testStatementCountIncludesNestedStatements(self):
+    stats = RunStats()
+    Run('老张从1到2磨叽：唠唠：老张。寻思：老张比1大吗？要行咧就唠唠：“大”。'
+        '磨叽完了。', stats=stats)
+    self.assertEqual(stats.statement_count, 4)
+
+  def testRunWithStatsAndBudget(self):
+    stats = RunStats()
+    with self.assertRaises(BudgetExceededError):
+      Run('老张从1到100磨叽：磨叽完了。', max_steps=10, stats=stats)
+    self.assertIn('compile', stats.seconds)
+    self.assertNotIn('execute', stats.seconds)
+
+class DongbeiProgramTest(unittest.TestCase):
+  def testRunManyTimes(self):
+    program = Compile('''
+【阶乘】（几）咋整：
+寻思：几比一小吗？
+要行咧就滚犊子吧一。
+滚犊子吧几乘整【阶乘】（几减一）。
+整完了。
+
+老王是活雷锋。
+唠唠：老王。
+老王装整【阶乘】（五）。
+唠唠：老王。
+        ''')
+    self.assertEqual(program.Run(), '啥也不是\n120\n')
+    # Nothing is left over from the last run.
+    self.assertEqual(program.Run(), '啥也不是\n120\n')
+
+  def testRunToOutput(self):
+    program = Compile('老张从1到3磨叽：唠唠：老张。磨叽完了。')
+    output = io.StringIO()
+    self.assertIsNone(program.Run(output=output))
+    self.assertEqual(output.getvalue(), '1\n2\n3\n')
+
+  def testRunsAreIsolated(self):
+    Compile('老王是活雷锋。老王装二。').Run()
+    with self.assertRaises(NameError):
+      Compile('唠唠：老王。').Run()
+
+  def testRunWithBudget(self):
+    program = Compile('老张从1到100磨叽：唠唠：老张。磨叽完了。', budget=True)
+    self.assertEqual(program.Run(max_steps=100).count('\n'), 100)
+    output = io.StringIO()
+    with self.assertRaises(BudgetExceededError):
+      program.Run(output=output, max_steps=3)
+    self.assertEqual(output.getvalue(), '1\n2\n3\n')
+
+class DongbeiArrayTest(unittest.TestCase):
+  def testParseIndex(self):
+    def Index(index):
+      return IndexExpr(Token(TK_IDENTIFIER, '老李家'), index)
+
+    self.assertEqual(ParseExprFromStr('老李家老大')[0],
+                     Index(LiteralExpr(Token(TK_INTEGER_LITERAL, 1))))
+    self.assertEqual(ParseExprFromStr('老李家老二')[0],
+                     Index(LiteralExpr(Token(TK_INTEGER_LITERAL, 2))))
+    self.assertEqual(ParseExprFromStr('老李家老12')[0],
+                     Index(LiteralExpr(Token(TK_INTEGER_LITERAL, 12))))
+    self.assertEqual(ParseExprFromStr('老李家老幺')[0], Index(None))
+    self.assertEqual(ParseExprFromStr('老李家老【几】')[0],
+                     Index(VariableExpr(Token(TK_IDENTIFIER, '几'))))
+    self.assertEqual(
+        ParseExprFromStr('老李家有几口人')[0],
+        AggregationExpr(VariableExpr(Token(TK_IDENTIFIER, '老李家')),
+                        Keyword('有几口人')))
+
+  def testArrayOnlyWhenUsedAsOne(self):
+    # These are variables, not arrays.
+    self.assertEqual(Run('''
+专家装5。
+寻思：专家比3大吗？要行咧就唠唠：“大”。要不行咧就唠唠：“小”。
+人家装3。
+老王从1到人家磨叽：唠唠：老王。磨叽完了。
+国家装“中国”。
+唠唠：国家、人家加专家。
+'''), '大\n1\n2\n3\n中国8\n')
+    self.assertEqual(Run('''
+老李家是活雷锋。
+老李家装5。
+老张家装老李家。
+唠唠：老张家有几口人。
+'''), '1\n')
+
+  def testParseArrayStatements(self):
+    self.assertEqual(
+        ParseStmtFromStr('老李家装一，二。')[0],
+        Statement(STMT_ASSIGN,
+                  (Token(TK_IDENTIFIER, '老李家'),
+                   ArrayExpr([LiteralExpr(Token(TK_INTEGER_LITERAL, 1)),
+                              LiteralExpr(Token(TK_INTEGER_LITERAL, 2))]))))
+    self.assertEqual(
+        ParseStmtFromStr('削老李家老三。')[0],
+        Statement(STMT_DELETE_ELEMENT,
+                  IndexExpr(Token(TK_IDENTIFIER, '老李家'),
+                            LiteralExpr(Token(TK_INTEGER_LITERAL, 3)))))
+
+  def testRunArray(self):
+    self.assertEqual(Compile('''
+老李家装1，2，3。
+唠唠：老李家。
+老李家老二走走。
+老李家老大装老李家老幺乘十。
+唠唠：老李家、“；”、老李家老二。
+削老李家老三。
+唠唠：老李家乘二加一。
+老张家是活雷锋。
+唠唠：老张家有几口人。
+唠唠：老张家最大的。
+        ''').Run(), '1、2、3\n30、3、3；3\n61、7\n0\n啥也不是\n')
+
+  def testAppend(self):
+    code = '''
+老李家是活雷锋。
+几从1到300磨叽：
+  老李家装老李家，几。
+磨叽完了。
+唠唠：老李家有几口人。
+唠唠：老李家一共。
+唠唠：老李家乘二减老李家跟老李家一样一样的。
+唠唠：老李家最大的、“，”、老李家最小的。
+        '''
+    self.assertIn('.Extend(', dongbei.TranslateToPython(code))
+    expected = '300\n45150\n对\n300，1\n'
+    self.assertEqual(Compile(code).Run(), expected)
+    with unittest.mock.patch.object(dongbei_runtime, 'numpy', None):
+      self.assertEqual(Compile(code).Run(), expected)
+
+  def testCopyOnAssign(self):
+    self.assertEqual(Compile('''
+老李家装1，2。
+老张家装老李家。
+老张家老大装“哈”。
+唠唠：老李家、“/”、老张家。
+        ''').Run(), '1、2/哈、2\n')
+
+  def testIndexOutOfRange(self):
+    with self.assertRaisesRegex(IndexError, '没有老4'):
+      Compile('老李家装1，2，3。唠唠：老李家老四。').Run()
+
+  def testDifferentSizes(self):
+    with self.assertRaises(ValueError):
+      Compile('老李家装1，2，3。老张家装1，2。唠唠：老李家加老张家。').Run()
+
+  def testArrayKeywordsInIdentifiers(self):
+    self.assertEqual(Run('''
+家长装5。
+张家口装3。
+最大的数装家长加张家口。
+人数一共装最大的数加1。
+唠唠：家长、张家口、最大的数、人数一共。
+老李家装家长，张家口。
+唠唠：老李家一共、老李家最大的。
+'''), '5389\n85\n')
+
+  def testStorage(self):
+    numbers = dongbei._DbArray(range(1000))
+    self.assertEqual(numbers._items.typecode, 'q')
+    self.assertEqual((numbers * 3)._items.typecode, 'q')
+    # Results too big for 64 bits go to a list instead of wrapping around.
+    big = numbers * (1 << 62)
+    self.assertIsInstance(big._items, list)
+    self.assertEqual(big[1000], 999 * (1 << 62))
+    self.assertEqual(big.Sum(), 499500 * (1 << 62))
+    numbers[1] = '哈'
+    self.assertIsInstance(numbers._items, list)
+
+class DongbeiMapTest(unittest.TestCase):
+  def testParseLookup(self):
+    phones = VariableExpr(Token(TK_IDENTIFIER, '电话'))
+    self.assertEqual(
+        ParseExprFromStr('【电话】的“老王”的名加1')[0],
+        ArithmeticExpr(
+            LookupExpr(LookupExpr(phones,
+                                  LiteralExpr(Token(TK_STRING_LITERAL, '老王'))),
+                       VariableExpr(Token(TK_IDENTIFIER, '名'))),
+            Keyword('加'),
+            LiteralExpr(Token(TK_INTEGER_LITERAL, 1))))
+
+  def testParseMapStatements(self):
+    phones = Token(TK_IDENTIFIER, '电话')
+    self.assertEqual(ParseStmtFromStr('电话是本账。')[0],
+                     Statement(STMT_ASSIGN, (phones, MapExpr())))
+    self.assertEqual(
+        ParseStmtFromStr('削【电话】的1。')[0],
+        Statement(STMT_DELETE_ELEMENT,
+                  LookupExpr(VariableExpr(phones),
+                             LiteralExpr(Token(TK_INTEGER_LITERAL, 1)))))
+    self.assertEqual(
+        ParseStmtFromStr('人从电话挨个儿磨叽：磨叽完了。')[0],
+        Statement(STMT_FOREACH, (Token(TK_IDENTIFIER, '人'),
+                                 VariableExpr(phones), [])))
+
+  def testRunMap(self):
+    self.assertEqual(Compile('''
+电话是本账。
+电话的“老王”装“110”。
+电话的“老张”装“120”。
+唠唠：电话的“老王”、“，”、电话的“老李”。
+唠唠：电话、“，”、电话有几口人。
+名是活雷锋。
+名装“老张”。
+唠唠：电话的名。
+削电话的“老王”。
+削电话的“老李”。
+唠唠：电话。
+        ''').Run(), '110，啥也不是\n老王：110、老张：120，2\n120\n老张：120\n')
+
+  def testOfInIdentifiers(self):
+    # 的 only looks something up after a map.
+    self.assertEqual(Run('''
+我的钱装5。
+目的地装“沈阳”。
+唠唠：我的钱、目的地。
+电话是本账。
+电话的“我的钱”装我的钱。
+唠唠：电话的“我的钱”加电话的“我的钱”。
+'''), '5沈阳\n10\n')
+
+  def testLookupInUndeclaredMap(self):
+    self.assertEqual(Run('''
+【记上】（账）咋整：
+  【账】的“老王”装“110”。
+  滚犊子吧【账】的“老王”。
+整完了。
+电话是本账。
+唠唠：整【记上】（电话）、电话。
+'''), '110老王：110\n')
+
+  def testStringKeyAfterUndeclaredMap(self):
+    # Nothing else comes between a name and a string.
+    self.assertEqual(Run('''
+【记上】（账）咋整：
+  账的“老王”装“110”。
+整完了。
+电话是本账。
+整【记上】（电话）。
+唠唠：电话。
+'''), '老王：110\n')
+
+  def testUpdateValues(self):
+    self.assertEqual(Compile('''
+次数是本账。
+次数的1装0。
+次数的1走走。
+次数的（1加1）装次数的1加5。
+次数的2退2步。
+唠唠：次数。
+        ''').Run(), '1：1、2：4\n')
+
+  def testForeach(self):
+    self.assertEqual(Compile('''
+电话是本账。
+电话的“老王”装“110”。
+电话的“老张”装“120”。
+人从电话挨个儿磨叽：
+  唠唠：人、“：”、电话的人。
+  削电话的人。
+磨叽完了。
+唠唠：电话有几口人。
+老李家装1，2，3。
+几从老李家挨个儿磨叽：
+  唠唠：几乘十。
+磨叽完了。
+        ''').Run(), '老王：110\n老张：120\n0\n10\n20\n30\n')
+
+  def testForeachWithBudget(self):
+    with self.assertRaises(BudgetExceededError):
+      Compile('老李家装1，2，3。几从老李家挨个儿磨叽：磨叽完了。',
+              budget=True).Run(max_steps=2)
+
+class DongbeiInputTest(unittest.TestCase):
+  def testReadLinesAndIntegers(self):
+    program = Compile('''
+唠唠：听个数加听个数加听个数。
+唠唠：听一句。
+唠唠：听一句、“|”。
+唠唠：听个数。
+唠唠：听个数、听一句。
+        ''')
+    self.assertEqual(
+        program.Run(input_file=io.StringIO('3 4\n5\n你好 世界\n\n7\n')),
+        '12\n你好 世界\n|\n7\n啥也不是啥也不是\n')
+
+  def testRestOfLine(self):
+    self.assertEqual(
+        Compile('唠唠：听个数。唠唠：听一句。唠唠：听一句。').Run(
+            input_file=io.StringIO('1 二 三\n四\n')),
+        '1\n二 三\n四\n')
+
+  def testManyIntegersOnOneLine(self):
+    # Would take minutes if every read copied the rest of the line.
+    count = 200000
+    input = dongbei_runtime._DbInput(io.StringIO('7 ' * count + '\n尾巴\n'))
+    self.assertEqual(sum(input.ReadInt() for _ in range(count)), 7 * count)
+    self.assertEqual(input.ReadLine(), '尾巴')
+    self.assertIsNone(input.ReadInt())
+
+  def testNotAnInteger(self):
+    with self.assertRaisesRegex(ValueError, '“二”不是个数'):
+      Compile('唠唠：听个数。').Run(input_file=io.StringIO('二\n'))
+
+  def testReadsLazily(self):
+    input_file = io.StringIO('一\n二\n三\n')
+    self.assertEqual(Compile('唠唠：听一句。').Run(input_file=input_file),
+                     '一\n')
+    self.assertEqual(input_file.read(), '二\n三\n')
+
+  def testLoopOverInput(self):
+    program = Compile('''
+总数是活雷锋。
+总数装0。
+行挨句听磨叽：
+  总数走1步。
+  唠唠：行。
+磨叽完了。
+唠唠：总数。
+        ''')
+    self.assertEqual(program.Run(input_file=io.StringIO('甲\n乙')),
+                     '甲\n乙\n2\n')
+    self.assertEqual(program.Run(input_file=io.StringIO('')), '0\n')
+
+  def testLoopOverFile(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      path = os.path.join(tmp_dir, 'data.txt')
+      with io.open(path, 'w', encoding='utf-8') as data_file:
+        data_file.write('甲\n乙\n')
+      program = Compile('''
+文件是活雷锋。
+文件装“%s”。
+行从文件挨句听磨叽：
+  唠唠：“<”、行、“>”。
+磨叽完了。
+          ''' % (path,))
+      self.assertEqual(program.Run(), '<甲>\n<乙>\n')
+
+  def testExecutePythonInput(self):
+    py_code = dongbei.TranslateToPython('唠唠：听个数乘二。')
+    self.assertEqual(
+        dongbei.ExecutePython(py_code, input_file=io.StringIO('21')), '42\n')
+
+class DongbeiStringBuilderTest(unittest.TestCase):
+  def testBuildStringInLoop(self):
+    code = """
+结果是活雷锋。
+结果装“”。
+老王从1到3磨叽：
+  结果装结果、老王、“哈”。
+  寻思：老王比一大吗？要行咧就结果装结果、“！”。
+磨叽完了。
+唠唠：结果。
+"""
+    self.assertIn('_builder', dongbei.TranslateToPython(code))
+    self.assertEqual(Run(code), '1哈2哈！3哈！\n')
+
+  def testLoopThatNeverRuns(self):
+    self.assertEqual(Run("""
+结果是活雷锋。
+老王从1到0磨叽：
+  结果装结果、“哈”。
+磨叽完了。
+唠唠：结果。
+结果装5。
+老王从1到2磨叽：
+  结果装结果、老王。
+磨叽完了。
+唠唠：结果。
+"""), '啥也不是\n512\n')
+
+  def testEmptyLoopOverUnsetString(self):
+    self.assertEqual(Compile('''
+老王从1到0磨叽：
+  结果装结果、老王。
+磨叽完了。
+唠唠：“没事儿”。
+''').Run(), '没事儿\n')
+    with self.assertRaises(NameError):
+      Compile('''
+老王从1到2磨叽：
+  结果装结果、老王。
+磨叽完了。
+''').Run()
+
+  def testNoBuilderWhenStringIsUsedInLoop(self):
+    code = """
+结果是活雷锋。
+结果装“”。
+老王从1到2磨叽：
+  结果装结果、“哈”。
+  唠唠：结果。
+磨叽完了。
+"""
+    self.assertNotIn('_builder', dongbei.TranslateToPython(code))
+    self.assertEqual(Run(code), '哈\n哈哈\n')
+
+  def testNoBuilderWhenLoopCallsFunction(self):
+    code = """
+结果是活雷锋。
+结果装“”。
+【看看】咋整：
+  唠唠：结果。
+整完了。
+老王从1到2磨叽：
+  结果装结果、老王。
+  整【看看】。
+磨叽完了。
+"""
+    self.assertNotIn('_builder', dongbei.TranslateToPython(code))
+    self.assertEqual(Run(code), '1\n12\n')
+
+  def testErrorInLoop(self):
+    with self.assertRaises(BudgetExceededError):
+      Compile("""
+结果是活雷锋。
+结果装“”。
+老王从1到10磨叽：
+  结果装结果、老王。
+磨叽完了。
+""", budget=True).Run(max_steps=3)
+    with self.assertRaises(ZeroDivisionError):
+      dongbei.ExecutePython(dongbei.TranslateToPython("""
+唠唠：“开始”。
+结果是活雷锋。
+结果装“”。
+老王从1到3磨叽：
+  结果装结果、3除以（3减老王）。
+磨叽完了。
+"""))
+    # The output before the error is kept.
+    self.assertEqual(dongbei._db_output, '开始\n')
+
+  def testSayConcat(self):
+    self.assertEqual(
+        Run('唠唠：“一”、1、“二”、2、“三”、3。'),
+        '一1二2三3\n')
+
+class DongbeiClosedFormTest(unittest.TestCase):
+  def testClosedForms(self):
+    code = """
+和装0。个数装0。倒数装100。幅度装3。
+老王从1到100磨叽：
+  和走老王步。
+  个数走走。
+  倒数退幅度步。
+  倒数走2步。
+磨叽完了。
+唠唠：和、“，”、个数、“，”、倒数、“，”、老王。
+"""
+    self.assertIn('_db_range', dongbei.TranslateToPython(code))
+    self.assertEqual(Run(code), '5050，100，0，100\n')
+    # With a budget, every iteration runs.
+    self.assertNotIn('_db_range', dongbei.TranslateToPython(code, True))
+    self.assertEqual(Compile(code, budget=True).Run(), Run(code))
+
+  def testHugeRange(self):
+    self.assertEqual(Run("""
+和装0。
+老王从1000000000000到3000000000000磨叽：
+  和退老王步。
+磨叽完了。
+唠唠：和、“，”、老王。
+"""), '-4000000000002000000000000，3000000000000\n')
+
+  def testLoopThatNeverRuns(self):
+    self.assertEqual(Run("""
+和装“哈”。老王装“没动”。
+老王从1到0磨叽：
+  和走老王步。
+磨叽完了。
+唠唠：和、老王。
+"""), '哈没动\n')
+
+  def testFloatsAddUpInOrder(self):
+    total = 0
+    for _ in range(10):
+      total += 1 / 10
+    self.assertNotEqual(total, 1)
+    self.assertEqual(Run("""
+和装0。【一毛】装1除以10。
+老王从1到10磨叽：
+  和走【一毛】步。
+磨叽完了。
+唠唠：和。
+"""), '%s\n' % (total,))
+    with self.assertRaises(TypeError):
+      Run("""
+和装“哈”。
+老王从1到3磨叽：
+  和走走。
+磨叽完了。
+""")
+
+  def testOtherLoopsRunAsUsual(self):
+    for body in ('和走走。唠唠：和。', '老王走走。', '和走和步。',
+                 '和走老王乘二步。', '和装和加老王。'):
+      self.assertNotIn('_db_range', dongbei.TranslateToPython(
+          '和装0。老王从1到3磨叽：%s磨叽完了。' % (body,)))
+
+class DongbeiInlineTest(unittest.TestCase):
+  def testInline(self):
+    code = """
+【平方加一】（几）咋整：滚犊子吧几乘几加1。整完了。
+【连上】（头，尾）咋整：滚犊子吧头、“和”、尾。整完了。
+【跑】咋整：
+  和装0。
+  老王从1到3磨叽：
+    和装和加整【平方加一】（老王）。
+    唠唠：整【连上】（“老王”，老王）。
+  磨叽完了。
+  滚犊子吧和。
+整完了。
+唠唠：整【跑】、整【平方加一】（2）。
+"""
+    # Only the calls in functions are inlined.
+    py_code = dongbei.TranslateToPython(code)
+    self.assertEqual(py_code.count(' is _db_inline_'), 2)
+    self.assertEqual(Run(code), '老王和1\n老王和2\n老王和3\n175\n')
+    # Calls count towards the budget, so they stay.
+    self.assertNotIn('_db_inline_', dongbei.TranslateToPython(code, True))
+    self.assertEqual(Compile(code, budget=True).Run(), Run(code))
+    self.assertNotIn('_db_inline_',
+                     dongbei.TranslateToPython(code, inline=False))
+
+  def testArgumentsEvaluatedOnce(self):
+    code = """
+【平方】（几）咋整：滚犊子吧几乘几。整完了。
+【跑】咋整：
+  唠唠：整【平方】（听个数）。
+  唠唠：整【平方】（（听个数））、整【平方】（2加1）。
+  老张装5。
+  唠唠：整【平方】（老张）。
+整完了。
+整【跑】。
+"""
+    py_code = dongbei.TranslateToPython(code)
+    self.assertEqual(py_code.count(' is _db_inline_'), 1)
+    self.assertEqual(
+        dongbei.ExecutePython(py_code, input_file=io.StringIO('3\n4\n')),
+        '9\n169\n25\n')
+    # Nested too deep, the arguments are temporaries, which can be inlined.
+    with unittest.mock.patch.object(dongbei, '_MAX_EXPR_DEPTH', 1):
+      py_code = dongbei.TranslateToPython(code)
+      self.assertEqual(py_code.count(' is _db_inline_'), 4)
+      self.assertEqual(
+          dongbei.ExecutePython(py_code, input_file=io.StringIO('3\n4\n')),
+          '9\n169\n25\n')
+
+  def testNotInlined(self):
+    for definition in (
+        # Recursive.
+        '【干】（几）咋整：滚犊子吧整【干】（几减1）。整完了。',
+        # More than one statement.
+        '【干】（几）咋整：唠唠：几。滚犊子吧几。整完了。',
+        # Uses a variable that is not a parameter.
+        '【干】（几）咋整：滚犊子吧几加老王。整完了。',
+        # Does not use a parameter, whose argument must still be evaluated.
+        '【干】（几）咋整：滚犊子吧1。整完了。',
+        # Too big.
+        '【干】（几）咋整：滚犊子吧%s几。整完了。' % ('几加' * 10,),
+        # Defined twice.
+        '【干】（几）咋整：滚犊子吧几。整完了。' * 2,
+        # Defined in another function.
+        '【外】咋整：【干】（几）咋整：滚犊子吧几。整完了。整完了。',
+        ):
+      self.assertNotIn('_db_inline_', dongbei.TranslateToPython(
+          '老王装1。%s唠唠：整【干】（0）。' % (definition,)))
+
+  def testArgumentOfUnusedParameter(self):
+    with self.assertRaises(NameError):
+      Run('''
+【常】（几）咋整：滚犊子吧1。整完了。
+【跑】咋整：滚犊子吧整【常】（未定义）。整完了。
+唠唠：整【跑】。
+''')
+
+  def testRedefinedLater(self):
+    code = """
+【干】（几）咋整：滚犊子吧几加1。整完了。
+【用】咋整：滚犊子吧整【干】（1）。整完了。
+唠唠：整【用】。
+"""
+    self.assertIn(' is _db_inline_', dongbei.TranslateToPython(code))
+    self.assertEqual(dongbei.ExecutePython(
+        dongbei.TranslateToPython(code) + '\n' +
+        dongbei.TranslateToPython("""
+【干】（几）咋整：滚犊子吧几减1。整完了。
+唠唠：整【用】。
+""")), '2\n0\n')
+
+class DongbeiLazyTest(unittest.TestCase):
+  def testLazy(self):
+    code = """
+【阶乘】（几）咋整：
+  寻思：几比1大吗？要行咧就滚犊子吧几乘整【阶乘】（几减1）。
+  滚犊子吧1。
+整完了。
+【外】咋整：
+  【里】咋整：唠唠：“里”。整完了。
+  整【里】。
+  滚犊子吧整【阶乘】（3）。
+整完了。
+唠唠：整【阶乘】（5）。
+唠唠：整【外】、整【外】。
+"""
+    py_code = dongbei.TranslateToPython(code, lazy=True)
+    self.assertEqual(py_code.count('_db_lazy('), 2)
+    self.assertNotIn('def ', py_code)
+    expected = '120\n里\n里\n66\n'
+    self.assertEqual(Run(code), expected)
+    self.assertEqual(dongbei.Run(code, lazy=True), expected)
+    self.assertEqual(dongbei.Run(code, max_steps=100, lazy=True), expected)
+    program = Compile(code, lazy=True)
+    self.assertEqual(program.Run(), expected)
+    self.assertEqual(program.Run(), expected)
+    self.assertRaises(dongbei.BudgetExceededError,
+                      dongbei.Run, code, max_steps=10, lazy=True)
+
+  def testErrorOnFirstCall(self):
+    code = '【坏】（几）咋整：滚犊子吧几乘。整完了。唠唠：1。'
+    self.assertEqual(dongbei.Run(code, lazy=True), '1\n')
+    self.assertRaisesRegex(SystemExit, '期望符号', dongbei.Run,
+                           code + '唠唠：整【坏】（2）。', lazy=True)
+    self.assertRaisesRegex(SystemExit, '语句结束太早', dongbei.Run,
+                           '【坏】咋整：唠唠：1。', lazy=True)
+
+  def testCodeKeepsFunctions(self):
+    # Nothing is left behind in this process, and the code runs in another.
+    py_code = dongbei.TranslateToPython(
+        '【加倍】（几）咋整：滚犊子吧几乘二。整完了。唠唠：整【加倍】（21）。',
+        lazy=True)
+    result = subprocess.run(
+        [sys.executable, '-c', '''
+import io, sys
+from src import dongbei
+parts = []
+exec(sys.stdin.read(), dongbei.NewNamespace(parts.append, io.StringIO()))
+print(''.join(parts), end='')
+'''], input=py_code, capture_output=True, text=True, encoding='utf-8',
+        cwd=os.path.join(os.path.dirname(__file__), '..'), check=True)
+    self.assertEqual(result.stdout, '42\n')
+
+  def testRedefined(self):
+    code = """
+【干】咋整：滚犊子吧1。整完了。
+【用】咋整：滚犊子吧整【干】。整完了。
+【干】咋整：滚犊子吧2。整完了。
+唠唠：整【用】、整【干】。
+【干】装3。
+唠唠：【干】。
+"""
+    self.assertEqual(dongbei.Run(code, lazy=True), Run(code))
+
+class DongbeiCommonSubexprTest(unittest.TestCase):
+  def AssertSameWithout(self, code):
+    """Checks that code says the same without computing expressions once.
+    """
+    with unittest.mock.patch.object(dongbei, '_COMMON_SUBEXPR_TYPES', ()):
+      expected = dongbei.ExecutePython(dongbei.TranslateToPython(code))
+    self.assertEqual(dongbei.ExecutePython(dongbei.TranslateToPython(code)),
+                     expected)
+
+  def testOneStatement(self):
+    code = """
+【甲】装3。【乙】装4。
+唠唠：（【甲】乘【乙】）加（【甲】乘【乙】）。
+唠唠：（【甲】、“号”）、“，”、（【甲】、“号”）。
+"""
+    py_code = dongbei.TranslateToPython(code)
+    self.assertEqual(py_code.count('_db_common0 = '), 1)
+    self.assertEqual(py_code.count('_db_common1 = '), 1)
+    self.assertNotIn('_db_common2', py_code)
+    self.assertEqual(Run(code), '24\n3号，3号\n')
+
+  def testStatements(self):
+    code = """
+【甲】装3。【乙】装4。
+老王装【甲】乘【乙】加1。
+寻思：【甲】乘【乙】加1比老王大吗？要行咧就唠唠：“大”。要不行咧就唠唠：【甲】乘【乙】。
+"""
+    # The branches are blocks of their own.
+    py_code = dongbei.TranslateToPython(code)
+    self.assertEqual(len(re.findall(r'_db_var\w+ \* _db_var\w+', py_code)), 2)
+    self.assertEqual(Run(code), '12\n')
+    self.AssertSameWithout(code)
+
+  def testNested(self):
+    code = """
+【甲】装3。
+唠唠：（【甲】乘【甲】加1）乘（【甲】乘【甲】加1）、【甲】乘【甲】。
+"""
+    # 甲乘甲 is computed again only for the repeated expression around it.
+    py_code = dongbei.TranslateToPython(code)
+    self.assertEqual(len(re.findall(r'_db_var\w+ \* _db_var\w+', py_code)), 1)
+    self.assertEqual(Run(code), '1009\n')
+
+  def testChanged(self):
+    for change in ('【甲】装5。', '【甲】走走。', '【甲】退两步。', '削【甲】。',
+                   '老李家老一装2。', '削老李家老幺。', '【乙】装老李家。',
+                   '整【改】。', '老王从1到1磨叽：【甲】走走。磨叽完了。'):
+      code = """
+老李家装1，2，3。【乙】装老李家。【甲】装3。
+【改】咋整：老李家老二装2。整完了。
+唠唠：【甲】、“，”、【乙】、“，”、老李家。
+%s
+唠唠：【甲】、“，”、【乙】、“，”、老李家。
+""" % (change,)
+      self.assertEqual(
+          dongbei.TranslateToPython(code).count('_db_common0 = '), 0, change)
+      self.AssertSameWithout(code)
+
+  def testNotCommon(self):
+    for expr in ('整【干】（1）加1', '听个数加1', '老李家老一加1'):
+      code = """
+老李家装1，2，3。
+【干】（几）咋整：唠唠：“干”。滚犊子吧几。整完了。
+唠唠：%s、%s。
+""" % (expr, expr)
+      self.assertNotIn('_db_common', dongbei.TranslateToPython(code), expr)
+
+class DongbeiDeepNestingTest(unittest.TestCase):
+  # Deeper than Python can indent or recurse.
+  DEPTH = 1000
+
+  def Execute(self, code, **kwargs):
+    return dongbei.ExecutePython(dongbei.TranslateToPython(code, **kwargs))
+
+  def assertShallow(self, code):
+    """Checks that code translates to Python indented only a few levels."""
+    py_code = dongbei.TranslateToPython(code)
+    indent = max(len(line) - len(line.lstrip(' '))
+                 for line in py_code.split('\n'))
+    self.assertLessEqual(indent, 2 * (dongbei._MAX_BLOCK_DEPTH + 1))
+
+  def testNestedCompound(self):
+    code = '开整：' * self.DEPTH + '唠唠：“到底了”。' + '整完了。' * self.DEPTH
+    self.assertEqual(self.Execute(code), '到底了\n')
+    self.assertEqual(dongbei.TranslateToPython(code),
+                     '_db_append_output("%s\\n" % (u"到底了",))')
+
+  def testElseChain(self):
+    code = '老王是活雷锋。老王装%d。' % (self.DEPTH - 1,)
+    for i in range(self.DEPTH):
+      code += '寻思：老王跟%d一样一样的吗？要行咧就唠唠：%d。要不行咧就' % (i, i)
+    code += '唠唠：“没有”。'
+    self.assertEqual(self.Execute(code), '%d\n' % (self.DEPTH - 1,))
+    self.assertEqual(self.Execute(code.replace('老王装', '老王装1加')),
+                     '没有\n')
+    self.assertShallow(code)
+
+  def testDecisionTree(self):
+    def Tree(value):
+      code = '老王是活雷锋。老王装%d。' % (value,)
+      for i in range(self.DEPTH):
+        code += '寻思：老王比%d大吗？要行咧就' % (i,)
+      code += '唠唠：“到底了”。'
+      for i in range(self.DEPTH):
+        code += '要不行咧就唠唠：%d。' % (self.DEPTH - 1 - i,)
+      return code
+    self.assertEqual(self.Execute(Tree(self.DEPTH)), '到底了\n')
+    self.assertEqual(self.Execute(Tree(321)), '321\n')
+    self.assertShallow(Tree(0))
+
+  def testDecisionTreeInFunction(self):
+    code = '【找】（几）咋整：'
+    for i in range(self.DEPTH):
+      code += '寻思：几比%d大吗？要行咧就' % (i,)
+    code += '滚犊子吧“大”。'
+    for i in range(self.DEPTH):
+      code += '要不行咧就开整：唠唠：%d。滚犊子吧%d。整完了。' % (
+          self.DEPTH - 1 - i, self.DEPTH - 1 - i)
+    code += '整完了。唠唠：整【找】（321）。唠唠：整【找】（%d）。' % (
+        self.DEPTH,)
+    self.assertEqual(self.Execute(code), '321\n321\n大\n')
+
+  def testNestedParens(self):
+    code = '唠唠：' + '（1加' * self.DEPTH + '0' + '）' * self.DEPTH + '。'
+    self.assertEqual(self.Execute(code), '%d\n' % (self.DEPTH,))
+
+  def testLongChains(self):
+    self.assertEqual(
+        self.Execute('唠唠：%s。' % ('减'.join(['1'] * self.DEPTH),)),
+        '%d\n' % (2 - self.DEPTH,))
+    self.assertEqual(
+        self.Execute('唠唠：%s。' % ('、'.join(['1'] * self.DEPTH),)),
+        '1' * self.DEPTH + '\n')
+
+  def testDeepExpressionsRunInOrder(self):
+    code = """
+【记】（几）咋整：
+  唠唠：几。
+  滚犊子吧几。
+整完了。
+老李家装1，2，3。
+老李家老（整【记】（1））装整【记】（2）加%s。
+唠唠：老李家。
+""" % ('（' * self.DEPTH + '整【记】（3）' + '）' * self.DEPTH,)
+    self.assertEqual(self.Execute(code), '2\n3\n1\n5、2、3\n')
+
+  def testSameOutputWithGuardsAndTemporaries(self):
+    code = """
+【记】（几）咋整：
+  唠唠：几。
+  滚犊子吧几加1。
+整完了。
+结果是活雷锋。
+结果装“”。
+老王从1到4磨叽：
+  寻思：老王比2大吗？要行咧就开整：
+    结果装结果、整【记】（老王）。
+    寻思：老王跟3一样一样的吗？要行咧就唠唠：“三”。要不行咧就唠唠：“四”。
+  整完了。
+  要不行咧就寻思：老王跟1一样一样的吗？要行咧就结果装结果、“一”。
+  要不行咧就开整：整完了。
+磨叽完了。
+唠唠：结果。
+"""
+    expected = self.Execute(code)
+    self.assertEqual(expected, '3\n三\n4\n四\n一45\n')
+    with unittest.mock.patch.multiple(dongbei, _MAX_BLOCK_DEPTH=0,
+                                      _MAX_EXPR_DEPTH=1):
+      py_code = dongbei.TranslateToPython(code)
+      self.assertIn('_db_guard', py_code)
+      self.assertIn('_db_tmp', py_code)
+      self.assertEqual(dongbei.ExecutePython(py_code), expected)
+      counted = []
+      py_code = dongbei.TranslateToPython(code, counted=counted)
+      counts = [0] * len(counted)
+      self.assertEqual(dongbei.ExecutePython(py_code, counts=counts),
+                       expected)
+      self.assertEqual(counts[0], 1)  # The function definition.
+      self.assertEqual(Compile(code, budget=True).Run(), expected)
+
+class DongbeiParallelLoopTest(unittest.TestCase):
+  def setUp(self):
+    # Use worker processes even on one CPU.
+    patcher = unittest.mock.patch.object(dongbei_runtime, 'PARALLEL_JOBS', 3)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def testParse(self):
+    self.assertEqual(
+        ParseStmtFromStr('老王从1到3一块堆儿磨叽：唠唠：老王。磨叽完了。')[0],
+        Statement(STMT_PARALLEL_LOOP, (
+            Token(TK_IDENTIFIER, '老王'),
+            LiteralExpr(Token(TK_INTEGER_LITERAL, 1)),
+            LiteralExpr(Token(TK_INTEGER_LITERAL, 3)),
+            [Statement(STMT_SAY,
+                       VariableExpr(Token(TK_IDENTIFIER, '老王')))])))
+
+  def testOutputInOrder(self):
+    code = """
+【平方和】（几）咋整：
+  结果装0。
+  老张从1到几磨叽：
+    结果装结果加老张乘老张。
+  磨叽完了。
+  滚犊子吧结果。
+整完了。
+老王从1到100%s
+  唠唠：“到”、老王、“的平方和是”、整【平方和】（老王）。
+磨叽完了。
+唠唠：老王。
+"""
+    expected = Run(code % ('磨叽：',))
+    with unittest.mock.patch.object(
+        concurrent.futures, 'ProcessPoolExecutor',
+        wraps=concurrent.futures.ProcessPoolExecutor) as executor:
+      self.assertEqual(Run(code % ('一块堆儿磨叽：',)), expected)
+    executor.assert_called_once()
+    self.assertTrue(expected.startswith('到1的平方和是1\n到2的平方和是5\n'))
+    self.assertTrue(expected.endswith('到100的平方和是338350\n100\n'))
+
+  def testInFunction(self):
+    program = Compile("""
+【唠到】（头儿）咋整：
+  老王从1到头儿一块堆儿磨叽：
+    唠唠：头儿减老王。
+  磨叽完了。
+  滚犊子吧老王。
+整完了。
+唠唠：整【唠到】（5）。
+""", budget=True)
+    self.assertEqual(program.Run(), '4\n3\n2\n1\n0\n5\n')
+    with self.assertRaises(BudgetExceededError):
+      program.Run(max_steps=3)
+
+  def testEmptyRange(self):
+    self.assertEqual(Run("""
+老王装0。
+老王从1到0一块堆儿磨叽：
+  唠唠：老王。
+磨叽完了。
+唠唠：老王。
+"""), '0\n')
+
+  def testErrorKeepsEarlierOutput(self):
+    output = io.StringIO()
+    with self.assertRaises(ZeroDivisionError):
+      Compile("""
+老王从1到8一块堆儿磨叽：
+  唠唠：12除以（老王减5）。
+磨叽完了。
+""").Run(output)
+    self.assertEqual(output.getvalue(), '-3.0\n-4.0\n-6.0\n-12.0\n')
+
+  def testProgramsInThreads(self):
+    programs = [Compile('老王从1到6一块堆儿磨叽：唠唠：“%s”、老王。磨叽完了。' %
+                        (name,)) for name in 'AB']
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+      outputs = list(executor.map(lambda i: programs[i % 2].Run(), range(12)))
+    for i, output in enumerate(outputs):
+      self.assertEqual(output, ''.join(
+          '%s%d\n' % ('AB'[i % 2], n) for n in range(1, 7)))
+
+  def testBudgetCoversAllWorkers(self):
+    program = Compile('''
+【磨】咋整：
+  老张从1到8磨叽：磨叽完了。
+整完了。
+老王从1到90一块堆儿磨叽：
+  整【磨】。
+磨叽完了。
+唠唠：“完事儿”。
+''', budget=True)
+    # 90 iterations of 10 steps each, as without workers.
+    self.assertEqual(program.Run(max_steps=900), '完事儿\n')
+    with self.assertRaisesRegex(BudgetExceededError, '步数用完了'):
+      program.Run(max_steps=899)
+
+  def testRejectsSharingBody(self):
+    for body, message in (
+        ('老张装老王。', '一块堆儿磨叽里不能动老张：各磨叽各的，动了谁也看不着。'),
+        ('老张走走。', '一块堆儿磨叽里不能动老张：各磨叽各的，动了谁也看不着。'),
+        ('老李家老（老王）装1。',
+         '一块堆儿磨叽里不能动老李家：各磨叽各的，动了谁也看不着。'),
+        ('开整：老张从1到2磨叽：磨叽完了。整完了。',
+         '一块堆儿磨叽里不能动老张：各磨叽各的，动了谁也看不着。'),
+        ('【干】咋整：整完了。',
+         '一块堆儿磨叽里不能动干：各磨叽各的，动了谁也看不着。'),
+        ('翠花，上工具。', '一块堆儿磨叽里不能叫翠花上工具。'),
+        ('滚犊子吧老王。', '一块堆儿磨叽里不能滚犊子。'),
+        ('唠唠：老王加听个数。', '一块堆儿磨叽里不能听：谁先听着算谁的？'),
+        ):
+      with self.assertRaises(SystemExit) as context:
+        ParseToAst('老王从1到3一块堆儿磨叽：%s磨叽完了。' % (body,))
+      self.assertEqual(context.exception.code, message)
+
+class DongbeiCallManyTest(unittest.TestCase):
+  CODE = """
+【乘方】（底，次）咋整：
+  结果装1。
+  老王从1到次磨叽：
+    结果装结果乘底。
+  磨叽完了。
+  唠唠：结果。
+  滚犊子吧结果。
+整完了。
+【除】（甲，乙）咋整：滚犊子吧甲除以乙。整完了。
+【一对儿】（几）咋整：老李家装几，几加1。滚犊子吧老李家。整完了。
+唠唠：“开始”。
+"""
+
+  def testCallMany(self):
+    program = Compile(self.CODE)
+    args_list = [(base, n) for base in range(1, 20) for n in range(10)]
+    expected = [base ** n for base, n in args_list]
+    self.assertEqual(program.CallMany('乘方', args_list, jobs=1), expected)
+    with unittest.mock.patch.object(
+        concurrent.futures, 'ProcessPoolExecutor',
+        wraps=concurrent.futures.ProcessPoolExecutor) as executor:
+      self.assertEqual(program.CallMany('乘方', iter(args_list), jobs=3),
+                       expected)
+    executor.assert_called_once()
+    self.assertEqual(
+        [str(array) for array in program.CallMany(
+            '一对儿', [(1,), (2,), (3,)], jobs=2)],
+        ['1、2', '2、3', '3、4'])
+    self.assertEqual(program.CallMany('除', [], jobs=2), [])
+    self.assertEqual(Compile(self.CODE, lazy=True).CallMany(
+        '除', [(1, 2), (3, 4)], jobs=2), [0.5, 0.75])
+
+  def testError(self):
+    program = Compile(self.CODE)
+    for jobs in (1, 3):
+      self.assertRaises(ZeroDivisionError, program.CallMany, '除',
+                        [(1, 2), (3, 0), (5, 6)], jobs=jobs)
+    self.assertRaisesRegex(SystemExit, '没有【加】', program.CallMany, '加',
+                           [(1, 2)])
+    self.assertRaisesRegex(SystemExit, '没有【结果】', program.CallMany,
+                           '结果', [(1, 2)])
+
+  def testBudget(self):
+    program = Compile(self.CODE, budget=True)
+    # Each call gets its own steps: one for the call and one per iteration.
+    for jobs in (1, 3):
+      self.assertEqual(program.CallMany('乘方', [(2, 3)] * 10, jobs=jobs,
+                                        max_steps=4), [8] * 10)
+      self.assertRaises(BudgetExceededError, program.CallMany, '乘方',
+                        [(2, 3), (2, 4)], jobs=jobs, max_steps=4)
+
+class DongbeiModuleTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.WriteModule('工具', """
+唠唠：“工具上来了”。
+【加倍】（几）咋整：
+  滚犊子吧几乘二。
+整完了。
+招呼是活雷锋。
+招呼装“你好”。
+""")
+    for patcher in (
+        unittest.mock.patch.object(dongbei, 'MODULE_PATH',
+                                   [self.tmp_dir.name]),
+        unittest.mock.patch.object(dongbei, 'module_cache', ModuleCache())):
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def WriteModule(self, name, code):
+    path = os.path.join(self.tmp_dir.name, name + '.dongbei')
+    with io.open(path, 'w', encoding='utf-8') as f:
+      f.write(code)
+    return path
+
+  def testParseImport(self):
+    self.assertEqual(ParseStmtFromStr('翠花，上【工具】。')[0],
+                     Statement(STMT_IMPORT, Token(TK_IDENTIFIER, '工具')))
+
+  def testImport(self):
+    self.assertEqual(Compile("""
+翠花，上工具。
+翠花，上工具。
+唠唠：整【加倍】（21）、招呼。
+""").Run(), '工具上来了\n42你好\n')
+
+  def testImportInFunctionWithBudget(self):
+    self.assertEqual(Compile("""
+【用工具】咋整：
+  翠花，上工具。
+  滚犊子吧整【加倍】（2）。
+整完了。
+唠唠：整【用工具】。
+""", budget=True).Run(max_steps=10), '工具上来了\n4\n')
+
+  def testModulesImportingEachOther(self):
+    self.WriteModule('甲', '翠花，上乙。唠唠：“甲”。')
+    self.WriteModule('乙', '翠花，上甲。唠唠：“乙”。')
+    self.assertEqual(Run('翠花，上甲。'), '乙\n甲\n')
+
+  def testLoadsModuleOnlyWhenImportRuns(self):
+    self.assertEqual(Run("""
+寻思：1比2大吗？要行咧就翠花，上【没这个】。
+唠唠：“没事”。
+"""), '没事\n')
+    with self.assertRaises(SystemExit):
+      Run('翠花，上【没这个】。')
+
+  def testCompilesModuleOncePerProcess(self):
+    with unittest.mock.patch.object(
+        dongbei, 'TranslateToPython',
+        wraps=dongbei.TranslateToPython) as translate:
+      for _ in range(3):
+        self.assertEqual(
+            Compile('翠花，上工具。唠唠：整【加倍】（1）。').Run(),
+            '工具上来了\n2\n')
+      # Once for each program, and once for the module.
+      self.assertEqual(translate.call_count, 4)
+
+  def testRecompilesChangedModule(self):
+    program = Compile('翠花，上工具。唠唠：招呼。')
+    self.assertEqual(program.Run(), '工具上来了\n你好\n')
+    path = self.WriteModule('工具', '招呼是活雷锋。招呼装“再见”。')
+    os.utime(path, ns=(0, 0))  # The mtime changes even on coarse clocks.
+    self.assertEqual(program.Run(), '再见\n')
+
+  def testModuleDir(self):
+    for name in ('甲', '乙'):
+      os.mkdir(os.path.join(self.tmp_dir.name, name))
+      self.WriteModule(os.path.join(name, '工具'), '唠唠：“%s的工具”。' % (name,))
+    for name in ('甲', '乙', '甲'):
+      module_dir = os.path.join(self.tmp_dir.name, name)
+      self.assertEqual(
+          Compile('翠花，上工具。', module_dir=module_dir).Run(),
+          '%s的工具\n' % (name,))
+    # Without module_dir, MODULE_PATH is as it was.
+    self.assertEqual(dongbei.MODULE_PATH, [self.tmp_dir.name])
+    self.assertEqual(Compile('翠花，上工具。').Run(), '工具上来了\n')
+
+  def testDiskCache(self):
+    cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+    path = os.path.join(self.tmp_dir.name, '工具.dongbei')
+    ModuleCache(cache_dir).Load(path)
+    self.assertTrue(os.listdir(cache_dir))
+    # Another process would not have to translate the module again.
+    with unittest.mock.patch.object(dongbei, 'TranslateToPython',
+                                    side_effect=AssertionError):
+      code_object = ModuleCache(cache_dir).Load(path)
+    namespace = {'_dongbei_str': dongbei._dongbei_str,
+                 '_db_append_output': lambda s: None}
+    exec(code_object, namespace)
+    self.assertEqual(
+        namespace[dongbei.GetPythonVarName('加倍')](3), 6)
+
+class DongbeiBatchTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.good_file = self.WriteProgram('good.dongbei', '唠唠：五加二。')
+    self.bad_file = self.WriteProgram('bad.dongbei', '唠唠：五加二')
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def WriteProgram(self, name, code):
+    path = os.path.join(self.tmp_dir.name, name)
+    with io.open(path, 'w', encoding='utf-8') as f:
+      f.write(code)
+    return path
+
+  def testRunFileForBatch(self):
+    report = RunFileForBatch(self.good_file)
+    self.assertEqual(report['exit_status'], 0)
+    self.assertEqual(report['output'], '7\n')
+    report = RunFileForBatch(self.bad_file)
+    self.assertEqual(report['exit_status'], 1)
+    self.assertIn('error', report)
+
+  def testRunFileForBatchImportsNextToFile(self):
+    self.WriteProgram('工具.dongbei', '唠唠：“工具上来了”。')
+    program = self.WriteProgram('main.dongbei', '翠花，上工具。')
+    with unittest.mock.patch.object(dongbei, 'MODULE_PATH', []):
+      report = RunFileForBatch(program)
+    self.assertEqual(report['output'], '工具上来了\n')
+
+  def testRunBatchReport(self):
+    report_file = io.StringIO()
+    failures = RunBatch([self.good_file, self.bad_file, self.good_file],
+                        jobs=2, report_file=report_file)
+    self.assertEqual(failures, 1)
+    reports = [json.loads(line)
+               for line in report_file.getvalue().splitlines()]
+    self.assertEqual([r['file'] for r in reports],
+                     [self.good_file, self.bad_file, self.good_file])
+    self.assertEqual([r['exit_status'] for r in reports], [0, 1, 0])
+
+  def testRunBatchOutputDir(self):
+    output_dir = os.path.join(self.tmp_dir.name, 'out')
+    RunBatch([self.good_file], jobs=1, report_file=io.StringIO(),
+             output_dir=output_dir)
+    with io.open(os.path.join(output_dir, 'good.dongbei.out'),
+                 encoding='utf-8') as f:
+      self.assertEqual(f.read(), '7\n')
+
+  def testRunBatchOutputDirSameNames(self):
+    os.mkdir(os.path.join(self.tmp_dir.name, 'b'))
+    other_file = self.WriteProgram(os.path.join('b', 'good.dongbei'),
+                                   '唠唠：五。')
+    output_dir = os.path.join(self.tmp_dir.name, 'out')
+    with self.assertRaisesRegex(SystemExit, '重名'):
+      RunBatch([self.good_file, other_file], jobs=1,
+               report_file=io.StringIO(), output_dir=output_dir)
+    self.assertFalse(os.path.exists(output_dir))
+
+  def testRunsAreIsolated(self):
+    first = self.WriteProgram('first.dongbei', '老王装1。唠唠：老王。')
+    second = self.WriteProgram('second.dongbei', '唠唠：老王。')
+    report_file = io.StringIO()
+    self.assertEqual(RunBatch([first, second], jobs=1,
+                              report_file=report_file), 1)
+    reports = [json.loads(line)
+               for line in report_file.getvalue().splitlines()]
+    self.assertEqual(reports[0]['output'], '1\n')
+    self.assertIn('NameError', reports[1]['error'])
+
 if __name__ == '__main__':
   unittest.main()